@@ -0,0 +1,208 @@
+# area_index.py
+#
+# Description
+# ===========
+#
+# This module builds and searches area index file 'lookup_data.areas', the reverse of
+# the postcode lookup. For each MSOA code and LTLA code the index records where the
+# postcodes in that area lie in compact lookup file 'lookup_data.bin' ( see
+# 'compact_lookup.py' ) as a list of runs of consecutive postcode records. As
+# 'lookup_data.bin' holds its postcode records in the same postcode sorted order as
+# 'lookup_data.csv' the postcodes of an area are returned in that order and a query
+# such as "all postcodes in E02006621" reads only the records of those postcodes
+# rather than scanning the whole lookup file.
+#
+# The runs are collected by an 'AreaIndexWriter' object while 'generate_lookup.py' writes
+# the postcode records so no further pass over the lookup files is required.
+#
+# Index file layout
+# =================
+#
+# The index file is JSON of the following form:
+#
+# {"CompactSize": <size of lookup_data.bin>, "Records": <postcode record count>,
+#  "Msoas": {"E02006621": [<byte offset>,<bytes>,<byte offset>,<bytes>,...], ...},
+#  "Ltlas": {"E07000229": [<byte offset>,<bytes>,...], ...}}
+#
+# Offsets are counted from the start of 'lookup_data.bin' and each run is a whole number
+# of postcode records.
+
+import array
+import itertools
+import json
+import os
+import sys
+import compact_lookup as Compact
+
+# Number of 16 bit fields in each postcode record and the positions of the MSOA and LTLA ids
+RecordFields = Compact.CompactRecord.size // 2
+MsoaField = 4
+AuthorityField = 5
+
+# Number of postcode records read at a time when building an index from a compact lookup file
+ChunkRecords = 65536
+
+# Adds the run of 'count' records starting at record 'start' to the runs 'runs' of area 'areaid'
+def AddRun (runs,areaid,start,count) :
+
+    "Adds a run of records to the runs of an area"
+
+    arearuns = runs.get(areaid)
+    if ( arearuns == None ) :
+        runs[areaid] = [start,count]
+    elif ( arearuns[-2] + arearuns[-1] == start ) :
+        arearuns[-1] += count
+    else:
+        arearuns += [start,count]
+
+# Class collecting the runs of postcode records of each MSOA and LTLA as the records
+# of a compact lookup file are written. Records are passed to 'AddRecords' in file order.
+class AreaIndexWriter :
+
+    "Collects the postcode record runs of each MSOA and LTLA"
+
+    def __init__ (self) :
+
+        self.count = 0
+        self.msoaruns = {}
+        self.authorityruns = {}
+
+    # Add the packed postcode records 'data' ( see 'compact_lookup.py' )
+    def AddRecords (self,data) :
+
+        "Add packed postcode records"
+
+        fields = array.array('H')
+        fields.frombytes(data)
+        if ( sys.byteorder == 'big' ) : fields.byteswap()
+
+        for runs,field in ((self.msoaruns,MsoaField),(self.authorityruns,AuthorityField)) :
+            start = self.count
+            for areaid,records in itertools.groupby(fields[field::RecordFields]) :
+                count = len(list(records))
+                AddRun(runs,areaid,start,count)
+                start += count
+
+        self.count += len(fields) // RecordFields
+
+    # Writes area index file 'areafilename' for compact lookup file 'compactfilename'
+    # whose records have been added. Returns the number of areas indexed.
+    def Save (self,compactfilename,areafilename) :
+
+        "Writes the area index file"
+
+        lookup = Compact.CompactLookup(compactfilename)
+        recordoffset = lookup.recordoffset
+        count = lookup.count
+        msoacodes = lookup.msoas.codes
+        authoritycodes = lookup.authorities.codes
+        lookup.Close()
+        if ( count != self.count ) : raise ValueError('%s holds %d records not %d' % (compactfilename,count,self.count))
+
+        size = Compact.CompactRecord.size
+        index = {'CompactSize' : os.path.getsize(compactfilename), 'Records' : count}
+        for name,codes,runs in (('Msoas',msoacodes,self.msoaruns),('Ltlas',authoritycodes,self.authorityruns)) :
+            index[name] = {codes[areaid] : [recordoffset + value * size if ( position % 2 == 0 ) else value * size for position,value in enumerate(arearuns)] for areaid,arearuns in sorted(runs.items())}
+
+        with open(areafilename + '.part','w') as areafile :
+            json.dump(index,areafile)
+        os.replace(areafilename + '.part',areafilename)
+
+        return len(index['Msoas']) + len(index['Ltlas'])
+
+# Builds area index file 'areafilename' from existing compact lookup file 'compactfilename'.
+# Returns the number of areas indexed.
+def BuildAreaIndex (compactfilename,areafilename,failure) :
+
+    "Builds an area index file for compact lookup file 'compactfilename'"
+
+    writer = AreaIndexWriter()
+
+    try:
+        lookup = Compact.CompactLookup(compactfilename)
+        size = Compact.CompactRecord.size
+        for record in range(0,lookup.count,ChunkRecords) :
+            start = lookup.recordoffset + record * size
+            writer.AddRecords(lookup.buffer[start:start + min(ChunkRecords,lookup.count - record) * size])
+        lookup.Close()
+
+        return writer.Save(compactfilename,areafilename)
+    except (OSError,ValueError) :
+        return failure
+
+# Class answering MSOA and LTLA queries of a compact lookup file using its area index file
+class AreaIndex :
+
+    "Answers MSOA and LTLA queries using an area index file"
+
+    def __init__ (self,compactfilename,areafilename) :
+
+        with open(areafilename,'r') as areafile :
+            index = json.load(areafile)
+
+        if ( index['CompactSize'] != os.path.getsize(compactfilename) ) :
+            raise ValueError('%s does not index the current %s' % (areafilename,compactfilename))
+
+        self.msoas = index['Msoas']
+        self.authorities = index['Ltlas']
+        self.lookup = Compact.CompactLookup(compactfilename)
+
+    # Return the indexed form of MSOA or LTLA code 'code' or None if it is not present
+    def Key (self,code) :
+
+        "Return the indexed form of an MSOA or LTLA code"
+
+        code = code.strip().upper()
+
+        return code if ( code in self.msoas ) or ( code in self.authorities ) else None
+
+    # Return the list of byte offsets and lengths of the record runs of MSOA or LTLA 'code'
+    def Runs (self,code) :
+
+        "Return the record runs of an MSOA or LTLA"
+
+        code = code.strip().upper()
+
+        return self.msoas.get(code) or self.authorities.get(code) or []
+
+    # Return the number of postcodes in MSOA or LTLA 'code'
+    def Count (self,code) :
+
+        "Return the number of postcodes in an MSOA or LTLA"
+
+        return sum(self.Runs(code)[1::2]) // Compact.CompactRecord.size
+
+    # Return a generator of (Postcode,MSOA position,LTLA position) tuples for the
+    # postcodes in MSOA or LTLA 'code'
+    def Records (self,code) :
+
+        "Return a generator of the postcode records of an MSOA or LTLA"
+
+        runs = self.Runs(code)
+        for position in range(0,len(runs),2) :
+            for postcode,msoaid,authorityid in Compact.CompactRecord.iter_unpack(self.lookup.buffer[runs[position]:runs[position] + runs[position + 1]]) :
+                yield postcode.rstrip(b'\x00').decode('ascii'),msoaid,authorityid
+
+    # Return a list of the postcodes in MSOA or LTLA 'code'
+    def Postcodes (self,code) :
+
+        "Return the postcodes in an MSOA or LTLA"
+
+        return [postcode for postcode,msoaid,authorityid in self.Records(code)]
+
+    # Return a list of the 'lookup_data.csv' rows of the postcodes in MSOA or LTLA 'code'
+    def Rows (self,code) :
+
+        "Return the lookup rows of an MSOA or LTLA"
+
+        msoasuffixes = self.lookup.msoasuffixes
+        authoritysuffixes = self.lookup.authoritysuffixes
+
+        return ['%s,%s,%s' % (postcode,msoasuffixes[msoaid],authoritysuffixes[authorityid]) for postcode,msoaid,authorityid in self.Records(code)]
+
+    # Release the memory mapped compact lookup file
+    def Close (self) :
+
+        "Release the memory mapped compact lookup file"
+
+        self.lookup.Close()
@@ -0,0 +1,188 @@
+# benchmark_downloads.py
+#
+# Description
+# ===========
+#
+# This script measures the downloads made by 'downloads.py' against a local HTTP server
+# which serves a file of random data and supports byte ranges, ETags and the 'Repr-Digest'
+# header. The bandwidth of each connection to the server is limited so that the benefit
+# of downloading in parallel segments is seen as it would be from a remote server. The
+# following downloads are made:
+#
+# Single stream      The file is downloaded without byte ranges
+# Segmented          The file is downloaded in parallel segments
+# Interrupted        The server drops every connection part way through and no retries
+#                    are made so the download fails leaving its saved progress
+# Resumed            The interrupted download is continued from its saved progress
+# No range support   The server ignores byte ranges so the file is downloaded as a
+#                    single stream
+#
+# Each downloaded file is compared with the file served and the script returns exit
+# status 1 if any differs or a download other than the interrupted one fails.
+#
+# Usage
+# =====
+#
+# python benchmarks\benchmark_downloads.py [--size <bytes>] [--rate <bytes/sec>]
+#                                          [--directory <directory>]
+#
+# The rate is the bandwidth of each connection. If no directory is given the files are
+# downloaded to a temporary directory.
+
+import argparse
+import base64
+import hashlib
+import http.server
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import downloads as Download
+
+# Size of each write to a connection
+WriteSize = 65536
+
+# Class of the HTTP server serving the file. Its settings are held on the server object.
+class RangeHandler (http.server.BaseHTTPRequestHandler) :
+
+    "Serves a file supporting byte ranges"
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message (self,format,*arguments) :
+
+        pass
+
+    def do_GET (self) :
+
+        server = self.server
+        data = server.data
+        start,end = 0,len(data) - 1
+        status = 200
+
+        byterange = self.headers.get('Range','')
+        ifrange = self.headers.get('If-Range',server.etag)
+        if ( server.ranges ) and ( byterange.startswith('bytes=') ) and ( ifrange == server.etag ) :
+            first,separator,last = byterange[6:].partition('-')
+            start = int(first)
+            end = min(int(last),len(data) - 1) if ( last != '' ) else len(data) - 1
+            status = 206
+
+        if ( start >= len(data) ) and ( status == 206 ) :
+            self.send_response(416)
+            self.send_header('Content-Range','bytes */%d' % len(data))
+            self.send_header('Content-Length','0')
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header('Content-Length',str(end + 1 - start))
+        self.send_header('ETag',server.etag)
+        self.send_header('Repr-Digest','sha-256=:%s:' % base64.b64encode(hashlib.sha256(data).digest()).decode('ascii'))
+        if ( server.ranges ) : self.send_header('Accept-Ranges','bytes')
+        if ( status == 206 ) : self.send_header('Content-Range','bytes %d-%d/%d' % (start,end,len(data)))
+        self.end_headers()
+
+        # Send the body at the rate of the server dropping the connection after
+        # 'dropafter' bytes if it is set. Clients close the connection of the request
+        # for the whole file once its first segment is complete.
+        sent = 0
+        started = time.perf_counter()
+        for position in range(start,end + 1,WriteSize) :
+            if ( server.dropafter != None ) and ( sent >= server.dropafter ) :
+                self.close_connection = True
+                return
+            chunk = data[position:min(position + WriteSize,end + 1)]
+            try:
+                self.wfile.write(chunk)
+            except ConnectionError:
+                self.close_connection = True
+                return
+            sent += len(chunk)
+            delay = sent / server.rate - ( time.perf_counter() - started )
+            if ( delay > 0 ) : time.sleep(delay)
+
+# Start a server serving 'data' on a free local port with 'rate' bytes/sec per connection
+# and return it
+def StartServer (data,rate) :
+
+    "Start the local HTTP server"
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1',0),RangeHandler)
+    server.daemon_threads = True
+    server.data = data
+    server.etag = '"%s"' % hashlib.sha256(data).hexdigest()[:16]
+    server.rate = rate
+    server.ranges = True
+    server.dropafter = None
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+
+    return server
+
+# Download 'url' to 'filename' and print and return the download statistics or the
+# 'DownloadError' of the download
+def Measure (name,url,filename) :
+
+    "Download a file and print its statistics"
+
+    try:
+        with Download.NewSession(Download.Segments) as session :
+            result = Download.DownloadFile(session,url,filename)
+    except Download.DownloadError as exception :
+        print('%-18s failed: %s' % (name,exception))
+        return exception
+
+    print('%-18s %8.2f seconds %12d bytes %14.0f bytes/sec %3d segments %12d bytes resumed' % (name,result['Duration'],result['Bytes'],result['Throughput'],result['Segments'],result['Resumed']))
+
+    return result
+
+############
+### MAIN ###
+############
+
+if ( __name__ == '__main__' ) :
+
+    Parser = argparse.ArgumentParser(description='Measure segmented downloads against a local HTTP server')
+    Parser.add_argument('--size',type=int,default=2 * Download.SegmentedSize,help='size of the file served in bytes')
+    Parser.add_argument('--rate',type=float,default=16777216,help='bandwidth of each connection in bytes/sec')
+    Parser.add_argument('--directory',help='directory to receive the downloaded files')
+    Arguments = Parser.parse_args()
+
+    Data = os.urandom(Arguments.size)
+    Server = StartServer(Data,Arguments.rate)
+    Url = 'http://127.0.0.1:%d/postcode_data.zip' % Server.server_address[1]
+    Failures = 0
+
+    with tempfile.TemporaryDirectory() as TempDir :
+        Directory = Arguments.directory or TempDir
+        Filename = os.path.join(Directory,'postcode_data.zip')
+
+        Server.ranges = False
+        Result = Measure('Single stream',Url,Filename)
+        Server.ranges = True
+        Results = [Result,Measure('Segmented',Url,Filename)]
+
+        Server.dropafter = Arguments.size // ( 2 * Download.Segments )
+        Retries,Download.Retries = Download.Retries,0
+        Measure('Interrupted',Url,Filename)
+        Server.dropafter = None
+        Download.Retries = Retries
+        Results.append(Measure('Resumed',Url,Filename))
+
+        Server.ranges = False
+        Results.append(Measure('No range support',Url,Filename))
+
+        for Result in Results :
+            if ( isinstance(Result,Download.DownloadError) ) :
+                Failures += 1
+                continue
+            with open(Result['Filename'],'rb') as FileObject :
+                if ( FileObject.read() != Data ) :
+                    print('Downloaded file %s differs from the file served' % Result['Filename'])
+                    Failures += 1
+
+    Server.shutdown()
+    if ( Failures > 0 ) : sys.exit(1)
@@ -0,0 +1,120 @@
+# benchmark_output.py
+#
+# Description
+# ===========
+#
+# This script measures the time taken to write lookup rows using the original output
+# path of 'generate_lookup.py' and the current one. The original path built each row
+# with 'Utils.GenerateCSVRow', formatted an error message containing the row and wrote
+# the row with 'Utils.Writeline'. The current path appends MSOA and LTLA fields which
+# are pre-rendered once per MSOA and LTLA to each postcode and writes rows in batches
+# using 'Utils.WriteLines' through a 1MB file buffer.
+#
+# Results
+# =======
+#
+# 2,600,000 rows, 7,000 MSOAs and 300 LTLAs ( Python 3.11, Linux ):
+#
+# Original output path:  26.91 seconds
+# Current output path:    0.96 seconds
+# Speedup:               28.2x
+#
+# Usage
+# =====
+#
+# python benchmarks\benchmark_output.py [<row count>]
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils as Utils
+
+# Function return values
+failure = 0
+
+# Return synthetic MSOA, authority and postcode data
+def SyntheticData (rowcount) :
+
+    "Return synthetic MSOA, authority and postcode data"
+
+    random.seed(1)
+    AuthorityCodes = {}
+    for Position in range(300) :
+        Code = 'E0%07d' % ( 7000000 + Position )
+        AuthorityCodes[Code] = {'Code' : Code, 'Name' : 'Authority %d' % Position, 'Population' : random.randint(50000,500000)}
+
+    Msoas = {}
+    for Position in range(7000) :
+        Code = 'E0%07d' % ( 2000000 + Position )
+        Msoas[Code] = {'Code' : Code, 'Name' : 'Middle Super Output Area %d' % Position, 'Population' : random.randint(5000,12000)}
+
+    MsoaCodes = list(Msoas)
+    AuthorityCodeList = list(AuthorityCodes)
+    Postcodes = []
+    for Position in range(rowcount) :
+        Postcode = 'AB%d %d%s' % ( Position // 4000, Position % 10, 'AB'[Position % 2] * 2 )
+        Postcodes.append((Postcode,MsoaCodes[Position % 7000],AuthorityCodeList[Position % 300]))
+
+    return Msoas,AuthorityCodes,Postcodes
+
+# Write rows using the original output path
+def OriginalOutput (filename,msoas,authoritycodes,postcodes) :
+
+    "Write rows using the original output path"
+
+    LookupFileObject = Utils.Open(filename,'w',failure)
+    for Postcode,MsoaCode,AuthorityCode in postcodes :
+        OutputRow = [Postcode,msoas[MsoaCode]['Name'],msoas[MsoaCode]['Code'],msoas[MsoaCode]['Population'],authoritycodes[AuthorityCode]['Name'],authoritycodes[AuthorityCode]['Code'],authoritycodes[AuthorityCode]['Population']]
+        PostCodeDataLine = Utils.GenerateCSVRow(OutputRow)
+        ErrorMessage = 'Could not write line %s to %s' % (PostCodeDataLine,filename)
+        Utils.Writeline(LookupFileObject,PostCodeDataLine,failure)
+    Utils.Close(LookupFileObject,failure)
+
+# Write rows using the current output path
+def CurrentOutput (filename,msoas,authoritycodes,postcodes) :
+
+    "Write rows using the current output path"
+
+    MsoaSuffixes = {}
+    for MsoaCode in msoas :
+        MsoaSuffixes[MsoaCode] = ',%s,%s,%d' % (msoas[MsoaCode]['Name'],msoas[MsoaCode]['Code'],msoas[MsoaCode]['Population'])
+    AuthoritySuffixes = {}
+    for AuthorityCode in authoritycodes :
+        AuthoritySuffixes[AuthorityCode] = ',%s,%s,%d\n' % (authoritycodes[AuthorityCode]['Name'],authoritycodes[AuthorityCode]['Code'],authoritycodes[AuthorityCode]['Population'])
+
+    LookupFileObject = Utils.Open(filename,'w',failure,1048576)
+    Rows = ( Postcode + MsoaSuffixes[MsoaCode] + AuthoritySuffixes[AuthorityCode] for Postcode,MsoaCode,AuthorityCode in postcodes )
+    Utils.WriteLines(LookupFileObject,Rows,10000,failure)
+    Utils.Close(LookupFileObject,failure)
+
+############
+### MAIN ###
+############
+
+RowCount = int(sys.argv[1]) if ( len(sys.argv) > 1 ) else 2600000
+Msoas,AuthorityCodes,Postcodes = SyntheticData(RowCount)
+
+with tempfile.TemporaryDirectory() as TempDir :
+    OriginalFilename = os.path.join(TempDir,'original.csv')
+    CurrentFilename = os.path.join(TempDir,'current.csv')
+
+    StartTime = time.perf_counter()
+    OriginalOutput(OriginalFilename,Msoas,AuthorityCodes,Postcodes)
+    OriginalTime = time.perf_counter() - StartTime
+
+    StartTime = time.perf_counter()
+    CurrentOutput(CurrentFilename,Msoas,AuthorityCodes,Postcodes)
+    CurrentTime = time.perf_counter() - StartTime
+
+    with open(OriginalFilename,'rb') as OriginalFile, open(CurrentFilename,'rb') as CurrentFile :
+        Identical = ( OriginalFile.read() == CurrentFile.read() )
+
+print('%d rows, %d MSOAs and %d LTLAs' % (RowCount,len(Msoas),len(AuthorityCodes)))
+print('Original output path: %.2f seconds' % OriginalTime)
+print('Current output path:  %.2f seconds' % CurrentTime)
+print('Speedup:              %.1fx' % ( OriginalTime / CurrentTime ))
+print('Output identical:     %s' % Identical)
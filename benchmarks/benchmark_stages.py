@@ -0,0 +1,254 @@
+# benchmark_stages.py
+#
+# Description
+# ===========
+#
+# This script times each stage of 'generate_lookup.py' and postcode lookups using the
+# synthetic data files written by 'synthetic_data.py' and writes the results to a JSON
+# file so that the performance of successive versions can be compared. The following
+# stages are timed:
+#
+# Configuration      Reading configuration file generate_lookup.csv
+# Authorities        Loading authority_data.csv
+# MSOAs              Merging msoa_names.csv and msoa_populations.csv
+# Postcode join      Joining each line of postcode_data.csv to its MSOA and LTLA
+# Output write       Writing lookup_data.csv and lookup_data.bin
+# Index build        Generating index file lookup_data.idx
+# Postcode lookup    Looking up random postcodes using lookup_postcode.py's index
+# Bulk encode        Encoding the random postcodes and a set of malformed postcodes using
+#                    bulk_join.py, checking each key is that given by postcode_codec.py
+# Library import     Importing msoa_lookup.py in a new interpreter, timed using the
+#                    interpreter's own import timing ( python -X importtime ) so that
+#                    interpreter startup is excluded
+#
+# For each stage the elapsed and CPU seconds, number of items processed, throughput in
+# items per second and the peak resident memory of the process are recorded. If a baseline
+# results file is given any stage whose throughput is lower than its baseline throughput by
+# more than the tolerance is reported and the script returns exit status 1. Stages taking
+# less than 50 milliseconds in the baseline are not compared as their timings are dominated
+# by noise.
+#
+# Usage
+# =====
+#
+# python benchmarks\benchmark_stages.py [--directory <directory>] [--postcodes <count>]
+#                                       [--msoas <count>] [--authorities <count>]
+#                                       [--lookups <count>] [--output <results file>]
+#                                       [--baseline <results file>] [--tolerance <fraction>]
+#
+# If no directory is given synthetic data files of the given scale are written to a
+# temporary directory. If the directory given holds no data files they are written to it.
+#
+# Results
+# =======
+#
+# The results file has the following form:
+#
+# {"Parameters": {...}, "Platform": "...", "Python": "...",
+#  "Stages": [{"Stage": "Configuration", "Seconds": ..., "CpuSeconds": ..., "Items": ...,
+#              "ItemsPerSecond": ..., "PeakMemory": ...}, ...],
+#  "TotalSeconds": ...}
+#
+# Peak memory is given in bytes and is null where it can not be measured.
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import numpy
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bulk_join as Join
+import compact_lookup as Compact
+import generate_lookup as Generate
+import metrics as Metrics
+import postcode_codec as Codec
+import postcode_index as Index
+import synthetic_data as Synthetic
+import utils as Utils
+
+# Function return values
+failure = 0
+
+# Shortest baseline stage time compared with the current results
+MinimumSeconds = 0.05
+
+# Number of times the library is imported
+ImportCount = 10
+
+# Postcodes of unusual form or spacing, both valid and invalid, whose keys are checked
+UnusualPostcodes = ['bn14 0bh','N1\t1AA',' w1a  0ax ','GIR 0AA','EC1A 1BB','N1\xa01AA','AB1  0AB\n','12345','AAAAAAA','AB1 1A1',
+                    '1N1 1AA','AB1 0A','ABCDE 1AA','N1\x001AA','\u00d11 1AA','','BN14 0BH' + ' ' * 20]
+
+# Class timing a stage and recording its results in 'stages'
+class Stage :
+
+    "Times a stage"
+
+    def __init__ (self,stages,name) :
+
+        self.stages = stages
+        self.name = name
+        self.items = 0
+        self.seconds = None
+
+    def __enter__ (self) :
+
+        self.starttime = time.perf_counter()
+        self.startcpu = time.process_time()
+
+        return self
+
+    def __exit__ (self,exceptiontype,exception,traceback) :
+
+        seconds = time.perf_counter() - self.starttime if ( self.seconds == None ) else self.seconds
+        self.stages.append({'Stage' : self.name, 'Seconds' : seconds, 'CpuSeconds' : time.process_time() - self.startcpu, 'Items' : self.items,
+                            'ItemsPerSecond' : self.items / max(seconds,1e-9), 'PeakMemory' : Metrics.PeakMemory()})
+        print('%-16s %8.3f seconds %12d items %14.0f items/sec' % (self.name,seconds,self.items,self.items / max(seconds,1e-9)))
+
+# Return the seconds taken to import module 'module' in a new interpreter as reported
+# by the interpreter's import timing
+def ImportSeconds (module) :
+
+    "Return the seconds taken to import a module"
+
+    result = subprocess.run([sys.executable,'-X','importtime','-c','import ' + module],capture_output=True,text=True,check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    for line in result.stderr.splitlines() :
+        fields = [field.strip() for field in line.split('|')]
+        if ( len(fields) == 3 ) and ( fields[2] == module ) : return int(fields[1]) / 1000000
+
+    raise ValueError('Import time of %s not reported' % module)
+
+# Runs each stage using the data files in directory 'directory' and returns the stage results
+def RunStages (directory,lookupcount) :
+
+    "Runs each stage and returns the stage results"
+
+    datadir = os.path.join(directory,'data')
+    lookupfilename = os.path.join(datadir,'lookup_data.csv')
+    compactfilename = os.path.join(datadir,'lookup_data.bin')
+    indexfilename = os.path.join(datadir,'lookup_data.idx')
+    postcodefilename = os.path.join(datadir,'postcode_data.csv')
+    stages = []
+
+    with open(os.path.join(directory,'log','log.txt'),'a') as errorfileobject :
+
+        with Stage(stages,'Configuration') as stage :
+            msoasfilefields,populationfields,authoritiesfields,postcodefields,geographyfields = Generate.ReadConfiguration(os.path.join(directory,'config','generate_lookup.csv'),errorfileobject)
+            stage.items = 4
+
+        with Stage(stages,'Authorities') as stage :
+            authorities = Generate.LoadAuthorities(os.path.join(datadir,'authority_data.csv'),authoritiesfields,errorfileobject)
+            stage.items = len(authorities)
+
+        with Stage(stages,'MSOAs') as stage :
+            msoas = Generate.LoadMsoas(os.path.join(datadir,'msoa_populations.csv'),os.path.join(datadir,'msoa_names.csv'),populationfields,msoasfilefields,authorities,errorfileobject)
+            stage.items = len(msoas)
+
+        with Stage(stages,'Postcode join') as stage :
+            msoasuffixes,authoritysuffixes = Generate.RenderSuffixes(msoas,authorities)
+            compactwriter = Compact.CompactWriter(compactfilename,msoas,authorities)
+            compactrecords = Compact.CompactRecords()
+            statistics = Generate.NewStatistics()
+            with open(postcodefilename,'r',Generate.BufferSize) as postcodefileobject :
+                rows = list(Generate.GenerateRows(postcodefileobject,postcodefields,msoas,authorities,msoasuffixes,authoritysuffixes,compactrecords,{},statistics))
+            stage.items = statistics['PostcodeCount']
+
+        with Stage(stages,'Output write') as stage :
+            with open(lookupfilename,'w',Generate.BufferSize) as lookupfileobject :
+                if ( Utils.WriteLines(lookupfileobject,iter(rows),Generate.BatchSize,failure) == failure ) : raise OSError('Could not write to ' + lookupfilename)
+            compactwriter.WriteRecords(compactrecords.Data())
+            compactwriter.Close()
+            stage.items = len(rows)
+
+        postcodes = [row.split(',',1)[0] for row in rows]
+        del rows,compactrecords
+
+        with Stage(stages,'Index build') as stage :
+            stage.items = Index.BuildIndex(lookupfilename,indexfilename,failure)
+            if ( stage.items == failure ) : raise OSError('Could not generate ' + indexfilename)
+
+        random.seed(1)
+        samples = [random.choice(postcodes) for count in range(lookupcount)] if ( len(postcodes) > 0 ) else []
+        del postcodes
+
+        with Stage(stages,'Postcode lookup') as stage :
+            postcodeindex = Index.PostcodeIndex(lookupfilename,indexfilename)
+            for postcode in samples :
+                if ( postcodeindex.Lookup(postcode) == '' ) : raise ValueError('Postcode %s not found' % postcode)
+            postcodeindex.Close()
+            stage.items = len(samples)
+
+        with Stage(stages,'Bulk encode') as stage :
+            postcodes = samples + UnusualPostcodes
+            keys = Join.EncodePostcodes(numpy.array(postcodes,dtype=str))
+            for postcode,key in zip(postcodes,keys) :
+                if ( key != Codec.Encode(postcode) ) : raise ValueError('Postcode %r has key %d in bulk_join.py and %d in postcode_codec.py' % (postcode,key,Codec.Encode(postcode)))
+            stage.items = len(postcodes)
+
+        with Stage(stages,'Library import') as stage :
+            stage.items = ImportCount
+            stage.seconds = sum(ImportSeconds('msoa_lookup') for count in range(ImportCount))
+
+    return stages
+
+# Return a list of messages describing each stage of 'stages' whose throughput is
+# lower than its throughput in 'baseline' by more than 'tolerance'
+def Regressions (stages,baseline,tolerance) :
+
+    "Return the stages slower than their baseline"
+
+    baselinestages = {stage['Stage'] : stage for stage in baseline['Stages'] if ( stage['Seconds'] >= MinimumSeconds )}
+    messages = []
+    for stage in stages :
+        if not ( stage['Stage'] in baselinestages ) : continue
+        baselinethroughput = baselinestages[stage['Stage']]['ItemsPerSecond']
+        if ( stage['ItemsPerSecond'] < baselinethroughput * ( 1 - tolerance ) ) :
+            messages.append('%s processed %.0f items/sec compared with %.0f items/sec' % (stage['Stage'],stage['ItemsPerSecond'],baselinethroughput))
+
+    return messages
+
+############
+### MAIN ###
+############
+
+if ( __name__ == '__main__' ) :
+
+    Parser = argparse.ArgumentParser(description='Time each stage of generate_lookup.py using synthetic data')
+    Parser.add_argument('--directory',help='directory holding or to receive the synthetic data files')
+    Parser.add_argument('--postcodes',type=int,default=Synthetic.PostcodeCount,help='number of synthetic postcodes')
+    Parser.add_argument('--msoas',type=int,default=Synthetic.MsoaCount,help='number of synthetic MSOAs')
+    Parser.add_argument('--authorities',type=int,default=Synthetic.AuthorityCount,help='number of synthetic LTLAs')
+    Parser.add_argument('--lookups',type=int,default=100000,help='number of postcode lookups')
+    Parser.add_argument('--output',default='benchmark_results.json',help='results file to write')
+    Parser.add_argument('--baseline',help='results file to compare against')
+    Parser.add_argument('--tolerance',type=float,default=0.25,help='fraction by which the throughput of a stage may fall below its baseline')
+    Arguments = Parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as TempDir :
+        Directory = Arguments.directory or TempDir
+        if not ( os.path.exists(os.path.join(Directory,'data','postcode_data.csv')) ) :
+            print('Writing synthetic data files to %s' % Directory)
+            Synthetic.WriteSyntheticData(Directory,Arguments.postcodes,Arguments.msoas,Arguments.authorities,1)
+
+        StartTime = time.perf_counter()
+        Stages = RunStages(Directory,Arguments.lookups)
+        TotalSeconds = time.perf_counter() - StartTime
+
+    Results = {'Parameters' : {'Directory' : Arguments.directory, 'Postcodes' : Arguments.postcodes, 'Msoas' : Arguments.msoas, 'Authorities' : Arguments.authorities, 'Lookups' : Arguments.lookups},
+               'Platform' : platform.platform(), 'Python' : platform.python_version(), 'Stages' : Stages, 'TotalSeconds' : TotalSeconds}
+    with open(Arguments.output,'w') as OutputFile :
+        json.dump(Results,OutputFile,indent=1)
+    print('Results written to %s' % Arguments.output)
+
+    if ( Arguments.baseline != None ) :
+        with open(Arguments.baseline,'r') as BaselineFile :
+            Messages = Regressions(Stages,json.load(BaselineFile),Arguments.tolerance)
+        for Message in Messages : print('Regression: ' + Message)
+        if ( len(Messages) > 0 ) : sys.exit(1)
@@ -0,0 +1,126 @@
+# load_service.py
+#
+# Description
+# ===========
+#
+# This script load tests a running 'lookup_service.py'. A number of concurrent client
+# connections each send a series of requests over a kept alive connection for postcodes
+# chosen at random from 'lookup_data.csv'. A proportion of the postcodes are chosen from
+# a small set of hot postcodes so the LRU cache of the service is exercised. The request
+# rate and the 50th, 90th and 99th percentile client latencies are reported followed by
+# the statistics returned by the service.
+#
+# Usage
+# =====
+#
+# python benchmarks\load_service.py [--host <address>] [--port <port>] [--lookup <lookup file>]
+#                                   [--connections <count>] [--requests <count>]
+#                                   [--bulk <postcodes per request>] [--hot <fraction>]
+#
+# Requests are single postcode GETs unless '--bulk' is given in which case each request
+# is a POST of the given number of postcodes.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import lookup_service as Service
+
+# Number of hot postcodes
+HotCount = 1000
+
+# Return a list of 'count' postcodes read from lookup file 'filename'
+def SamplePostcodes (filename,count) :
+
+    "Return a list of postcodes read from a lookup file"
+
+    postcodes = []
+    with open(filename,'r') as fileobject :
+        for line in fileobject :
+            postcodes.append(line[:line.find(',')])
+
+    return random.sample(postcodes,min(count,len(postcodes)))
+
+# Send HTTP request 'request' over connection 'reader','writer' and return the response status and body
+async def Request (reader,writer,request) :
+
+    "Send a request and return the response status and body"
+
+    writer.write(request)
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    length = 0
+    for line in lines[1:] :
+        name,separator,value = line.partition(':')
+        if ( name.strip().lower() == 'content-length' ) : length = int(value)
+
+    return int(lines[0].split()[1]),await reader.readexactly(length)
+
+# Send 'count' requests over one connection and add the latency of each to 'latencies'
+async def Client (host,port,count,postcodes,hot,hotfraction,bulk,latencies) :
+
+    "Send a series of requests over one connection"
+
+    reader,writer = await asyncio.open_connection(host,port)
+    for number in range(count) :
+        if ( bulk > 0 ) :
+            body = json.dumps([random.choice(hot) if ( random.random() < hotfraction ) else random.choice(postcodes) for position in range(bulk)]).encode('utf-8')
+            request = b'POST /postcodes HTTP/1.1\r\nHost: %s\r\nContent-Length: %d\r\n\r\n' % (host.encode('ascii'),len(body)) + body
+        else:
+            postcode = random.choice(hot) if ( random.random() < hotfraction ) else random.choice(postcodes)
+            request = b'GET /postcode/%s HTTP/1.1\r\nHost: %s\r\n\r\n' % (postcode.replace(' ','%20').encode('ascii'),host.encode('ascii'))
+
+        started = time.perf_counter()
+        status,body = await Request(reader,writer,request)
+        latencies.append(time.perf_counter() - started)
+        if ( status != 200 ) : raise ValueError('Request failed with status %d: %s' % (status,body.decode('utf-8')))
+
+    writer.close()
+
+# Run the load test and return the request rate, latency percentiles and service statistics
+async def LoadTest (host,port,postcodes,connections,requests,bulk,hotfraction) :
+
+    "Run the load test"
+
+    hot = postcodes[:HotCount]
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*[Client(host,port,requests,postcodes,hot,hotfraction,bulk,latencies) for connection in range(connections)])
+    seconds = time.perf_counter() - started
+
+    reader,writer = await asyncio.open_connection(host,port)
+    status,body = await Request(reader,writer,b'GET /stats HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n\r\n' % host.encode('ascii'))
+    writer.close()
+
+    latencies.sort()
+    return len(latencies) / seconds,[Service.Percentile(latencies,percentile) * 1000 for percentile in Service.Percentiles],json.loads(body)
+
+############
+### MAIN ###
+############
+
+if ( __name__ == '__main__' ) :
+
+    Parser = argparse.ArgumentParser(description='Load test a running lookup_service.py')
+    Parser.add_argument('--host',default=Service.Host,help='service address')
+    Parser.add_argument('--port',type=int,default=Service.Port,help='service port')
+    Parser.add_argument('--lookup',default=os.path.join('data','lookup_data.csv'),help='lookup file from which postcodes are chosen')
+    Parser.add_argument('--connections',type=int,default=50,help='number of concurrent connections')
+    Parser.add_argument('--requests',type=int,default=200,help='number of requests sent over each connection')
+    Parser.add_argument('--bulk',type=int,default=0,help='number of postcodes in each bulk request')
+    Parser.add_argument('--hot',type=float,default=0.8,help='fraction of postcodes chosen from the hot postcodes')
+    Arguments = Parser.parse_args()
+
+    random.seed(1)
+    Postcodes = SamplePostcodes(Arguments.lookup,100000)
+    Rate,Latencies,Statistics = asyncio.run(LoadTest(Arguments.host,Arguments.port,Postcodes,Arguments.connections,Arguments.requests,Arguments.bulk,Arguments.hot))
+
+    print('%.0f requests/sec' % Rate)
+    print('Client latency p50 %.2f ms, p90 %.2f ms, p99 %.2f ms' % tuple(Latencies))
+    print(json.dumps(Statistics,indent=1))
@@ -0,0 +1,175 @@
+# synthetic_data.py
+#
+# Description
+# ===========
+#
+# This script writes synthetic versions of the input data files used by 'generate_lookup.py'
+# so that it can be benchmarked without the government downloads. The following files are
+# written to the ..\data directory of the given directory along with a copy of configuration
+# file ..\config\generate_lookup.csv:
+#
+# msoa_names.csv
+# msoa_populations.csv
+# authority_data.csv
+# postcode_data.csv
+#
+# Each field is written at the position given by the configuration file so the files can
+# be read by 'generate_lookup.py' unchanged. As in the real files the MSOA names and
+# populations files are sorted by MSOA code, the MSOAs of each LTLA have consecutive codes,
+# some MSOA names contain commas and are quoted, populations contain thousands separators
+# and postcodes are sorted and grouped by sector, each sector lying within a single MSOA.
+# The data generated depends only on the scale and seed given.
+#
+# Usage
+# =====
+#
+# python benchmarks\synthetic_data.py <directory> [--postcodes <count>] [--msoas <count>]
+#                                      [--authorities <count>] [--seed <seed>]
+#
+# The default scale of 2,600,000 postcodes, 7,000 MSOAs and 300 LTLAs is similar to that of
+# the national data.
+
+import argparse
+import os
+import random
+import shutil
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import utils as Utils
+
+# Default scale
+PostcodeCount = 2600000
+MsoaCount = 7000
+AuthorityCount = 300
+
+# Configuration file giving the field positions of each data file
+ConfigurationFilename = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'config','generate_lookup.csv')
+
+# Number of fields in each line of the postcode file
+PostcodeFieldCount = 52
+
+# Postcode areas and the letters used in postcode units
+PostcodeAreas = ['AL','B','BA','BB','BD','BH','BL','BN','BR','BS','CA','CB','CH','CM','CO','CR','CT','CV','CW','DA',
+                 'DE','DH','DL','DN','DT','DY','E','EC','EN','EX','FY','GL','GU','HA','HD','HG','HP','HR','HU','HX',
+                 'IG','IP','KT','L','LA','LE','LN','LS','LU','M','ME','MK','N','NE','NG','NN','NR','NW','OL','OX',
+                 'PE','PL','PO','PR','RG','RH','RM','S','SE','SG','SK','SL','SM','SN','SO','SP','SR','SS','ST','SW',
+                 'TA','TF','TN','TQ','TR','TS','TW','UB','W','WA','WC','WD','WF','WN','WR','WS','WV','YO']
+UnitLetters = 'ABDEFGHJLNPQRSTUWXYZ'
+
+# Typical number of postcode units in a postcode sector
+UnitsPerSector = 250
+
+# Return a list of 'fieldcount' placeholder values large enough to hold the fields at 'positions'
+def Placeholders (fieldcount,positions) :
+
+    "Return a list of placeholder field values"
+
+    return ['x%d' % position for position in range(max(fieldcount,max(positions.values()) + 1))]
+
+# Return a csv line holding 'fields' at the positions given by 'positions'. Unused
+# positions are filled from the list of placeholder values 'placeholders'.
+def CsvLine (placeholders,positions,fields) :
+
+    "Return a csv line holding fields at the configured positions"
+
+    values = list(placeholders)
+    for key,value in fields.items() :
+        values[positions[key]] = '"%s"' % value if ( ',' in value ) else value
+
+    return ','.join(values) + '\n'
+
+# Return a generator of the postcodes of 'count' postcode units in sorted order.
+# Each postcode is returned with the number of its sector.
+def Postcodes (count) :
+
+    "Return a generator of postcodes and sector numbers"
+
+    units = [first + second for first in UnitLetters for second in UnitLetters]
+    districts = max(1,-(-count // ( len(PostcodeAreas) * 10 * UnitsPerSector )))
+    perdistrict = -(-count // ( len(PostcodeAreas) * districts ))
+    sector = 0
+    produced = 0
+
+    for area in sorted(PostcodeAreas) :
+        for district in sorted(range(1,districts + 1),key=str) :
+            remaining = min(perdistrict,count - produced)
+            for number in range(10) :
+                sectorcount = remaining // ( 10 - number )
+                for unit in units[:sectorcount] :
+                    yield '%s%d %d%s' % (area,district,number,unit),sector
+                produced += sectorcount
+                remaining -= sectorcount
+                sector += 1
+            if ( produced >= count ) : return
+
+# Writes synthetic data files to directory 'directory' and returns the number of
+# postcodes, MSOAs and authorities written
+def WriteSyntheticData (directory,postcodecount,msoacount,authoritycount,seed) :
+
+    "Writes synthetic data files"
+
+    random.seed(seed)
+    datadir = os.path.join(directory,'data')
+    configdir = os.path.join(directory,'config')
+    for subdir in (datadir,configdir,os.path.join(directory,'log')) : os.makedirs(subdir,exist_ok=True)
+
+    shutil.copyfile(ConfigurationFilename,os.path.join(configdir,'generate_lookup.csv'))
+    with open(ConfigurationFilename,'r') as fileobject :
+        msoasfields,populationfields,authoritiesfields,postcodefields = [Utils.ReturnPositions(line) for line in fileobject.read().splitlines()[:4]]
+
+    # Authorities
+    authorities = [('E0%07d' % ( 6000000 + position ),'Local Authority %d' % position) for position in range(authoritycount)]
+    with open(os.path.join(datadir,'authority_data.csv'),'w') as fileobject :
+        for code,name in sorted(authorities) :
+            fileobject.write(CsvLine(Placeholders(4,authoritiesfields),authoritiesfields,{'Code' : code, 'Name' : name}))
+
+    # MSOAs with consecutive codes for each authority
+    msoas = []
+    for position in range(msoacount) :
+        authoritycode,authorityname = authorities[position * authoritycount // msoacount]
+        name = 'Middle Super Output Area %d' % position
+        if ( position % 5 == 0 ) : name = name + ', North'
+        msoas.append(('E0%07d' % ( 2000001 + position ),name,authorityname,random.randint(5000,12000),authoritycode))
+
+    with open(os.path.join(datadir,'msoa_names.csv'),'w') as fileobject :
+        for code,name,authorityname,population,authoritycode in msoas :
+            fileobject.write(CsvLine(Placeholders(6,msoasfields),msoasfields,{'Code' : code, 'Name' : name}))
+
+    with open(os.path.join(datadir,'msoa_populations.csv'),'w') as fileobject :
+        for code,name,authorityname,population,authoritycode in msoas :
+            fileobject.write(CsvLine(Placeholders(4,populationfields),populationfields,{'Code' : code, 'Name' : authorityname, 'Population' : '{:,}'.format(population)}))
+
+    # Postcodes grouped by sector, each sector lying within one MSOA of a run of nearby MSOAs
+    placeholders = Placeholders(PostcodeFieldCount,postcodefields)
+    written = 0
+    with open(os.path.join(datadir,'postcode_data.csv'),'w',1048576) as fileobject :
+        lines = []
+        for postcode,sector in Postcodes(postcodecount) :
+            code,name,authorityname,population,authoritycode = msoas[( sector * 7 + sector % 3 ) % msoacount]
+            lines.append(CsvLine(placeholders,postcodefields,{'Postcode' : postcode, 'AuthorityCode' : authoritycode, 'MsoaCode' : code}))
+            if ( len(lines) == 10000 ) :
+                fileobject.writelines(lines)
+                written += len(lines)
+                lines = []
+        fileobject.writelines(lines)
+        written += len(lines)
+
+    return written,len(msoas),len(authorities)
+
+############
+### MAIN ###
+############
+
+if ( __name__ == '__main__' ) :
+
+    Parser = argparse.ArgumentParser(description='Write synthetic input data files for generate_lookup.py')
+    Parser.add_argument('directory',help='directory in which the data, config and log directories are created')
+    Parser.add_argument('--postcodes',type=int,default=PostcodeCount,help='number of postcodes')
+    Parser.add_argument('--msoas',type=int,default=MsoaCount,help='number of MSOAs')
+    Parser.add_argument('--authorities',type=int,default=AuthorityCount,help='number of LTLAs')
+    Parser.add_argument('--seed',type=int,default=1,help='random seed')
+    Arguments = Parser.parse_args()
+
+    Counts = WriteSyntheticData(Arguments.directory,Arguments.postcodes,Arguments.msoas,Arguments.authorities,Arguments.seed)
+    print('%d postcodes, %d MSOAs and %d LTLAs written to %s' % (Counts + (Arguments.directory,)))
@@ -0,0 +1,309 @@
+# block_lookup.py
+#
+# Description
+# ===========
+#
+# This module writes and searches block compressed lookup file 'lookup_data.csv.gz' and
+# its block index file 'lookup_data.gzi'. In the manner of bgzip the rows of
+# 'lookup_data.csv' are split into blocks of about 'BlockSize' bytes, each ending at the
+# end of a row, and each block is compressed independently as a complete gzip member. The
+# file may therefore be decompressed in full by any gzip tool, for example:
+#
+# gzip -dc lookup_data.csv.gz > lookup_data.csv
+#
+# while a postcode is looked up by decompressing only the one block which holds it. The
+# rows of 'lookup_data.csv' are in postcode order so each block holds a contiguous range of
+# postcodes and the block index records the lowest and highest postcode key ( see
+# 'postcode_codec.py' ) of each block. These are the keys of the first and last rows of a
+# block unless its first postcode follows its last, when the keys of all of its rows are
+# compared, so a lookup file whose postcodes are only sorted within each outward code can
+# also be searched.
+#
+# Blocks are compressed and written on a background thread so that compression overlaps
+# the generation of further rows. Compression releases the GIL so the thread runs
+# alongside the generating thread on separate CPUs.
+#
+# Index file layout
+# =================
+#
+# <Magic 'MSOAGZI1' (8 bytes)><Block count (8 bytes)><Block 0>...<Block n-1>
+#
+# Each block record consists of the following fields:
+#
+# <Lowest postcode key (8 bytes)><Highest postcode key (8 bytes)><Compressed offset (8 bytes)>
+# <Compressed length (4 bytes)><Uncompressed length (4 bytes)><Row count (4 bytes)>
+#
+# All integers are stored little endian.
+
+import bisect
+import itertools
+import locale
+import os
+import queue
+import struct
+import threading
+import zlib
+import postcode_codec as Codec
+
+# Block index file format
+BlockMagic = b'MSOAGZI1'
+BlockHeader = struct.Struct('<8sQ')
+BlockRecord = struct.Struct('<QQQIII')
+
+# Uncompressed size of each block and compression level
+BlockSize = 65536
+CompressionLevel = 6
+
+# Number of blocks waiting to be compressed before writers wait
+QueueLength = 16
+
+# gzip window bits for zlib
+GzipBits = 16 + zlib.MAX_WBITS
+
+# Return the postcode key of lookup row 'row' held as bytes
+def RowKey (row) :
+
+    "Return the postcode key of a lookup row"
+
+    return Codec.Encode(row[:row.find(b',')].decode('ascii','replace'))
+
+# Return the lowest and highest postcode keys of the rows of block 'block'
+def KeyRange (block) :
+
+    "Return the lowest and highest postcode keys of a block"
+
+    low = RowKey(block[:block.find(b'\n')])
+    high = RowKey(block[block.rfind(b'\n',0,len(block) - 1) + 1:])
+    if ( low > high ) :
+        keys = [key for key in map(RowKey,block.splitlines()) if ( key != Codec.InvalidKey )]
+        low,high = min(keys),max(keys)
+
+    return low,high
+
+# Class writing a block compressed lookup file and its block index file. Rows are given
+# to 'write' in lookup file order as text or bytes in pieces of any size. If 'target'
+# is given everything written is also written to file object 'target' so this object
+# may be used in place of the lookup file object. If 'state' is given an unfinished
+# file is continued from the state returned by 'Checkpoint'.
+class BlockWriter :
+
+    "Writes a block compressed lookup file on a background thread"
+
+    def __init__ (self,filename,indexfilename,target=None,encoding=None,state=None) :
+
+        self.filename = filename
+        self.indexfilename = indexfilename
+        self.target = target
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.pending = []
+        self.pendingsize = 0
+        self.records = []
+        self.offset = 0
+        self.failure = None
+
+        if ( state == None ) :
+            self.file = open(filename + '.part','wb')
+        else:
+            self.file = open(filename + '.part','r+b')
+            self.file.truncate(state['Offset'])
+            self.file.seek(state['Offset'])
+            self.offset = state['Offset']
+            records = bytes.fromhex(state['Records'])
+            self.records = [records[start:start + BlockRecord.size] for start in range(0,len(records),BlockRecord.size)]
+        self.queue = queue.Queue(QueueLength)
+        self.thread = threading.Thread(target=self.Run,name='BlockWriter',daemon=True)
+        self.thread.start()
+
+    # Write 'data' to the target file and add it to the pending block. Complete blocks
+    # are passed to the background thread.
+    def write (self,data) :
+
+        "Write lookup rows"
+
+        if ( self.target != None ) : self.target.write(data)
+        if ( isinstance(data,str) ) : data = data.encode(self.encoding)
+
+        self.pending.append(data)
+        self.pendingsize += len(data)
+        if ( self.pendingsize >= BlockSize ) : self.Cut()
+
+        return len(data)
+
+    # Add the lines 'lines' to the lookup rows written
+    def writelines (self,lines) :
+
+        "Write a list of lookup rows"
+
+        self.write(''.join(lines))
+
+    # Flush the target file
+    def flush (self) :
+
+        "Flush the target file"
+
+        if ( self.target != None ) : self.target.flush()
+
+    # Pass the complete rows of the pending data to the background thread in blocks
+    def Cut (self) :
+
+        "Pass complete blocks to the background thread"
+
+        data = b''.join(self.pending)
+        start = 0
+        while ( len(data) - start >= BlockSize ) :
+            end = data.rfind(b'\n',start,start + BlockSize) + 1
+            if ( end <= start ) : end = data.find(b'\n',start + BlockSize) + 1
+            if ( end <= start ) : break
+            self.Queue(data[start:end])
+            start = end
+
+        self.pending = [data[start:]]
+        self.pendingsize = len(data) - start
+
+    # Pass block 'block' to the background thread
+    def Queue (self,block) :
+
+        "Pass a block to the background thread"
+
+        if ( self.failure != None ) : raise OSError('Could not write %s: %s' % (self.filename,self.failure))
+        self.queue.put(block)
+
+    # Write the pending rows as a block and wait until all blocks are on disk. Returns
+    # the state from which the file may be continued.
+    def Checkpoint (self) :
+
+        "Write all rows and return the state of the file"
+
+        data = b''.join(self.pending)
+        if ( len(data) > 0 ) : self.Queue(data)
+        self.pending = []
+        self.pendingsize = 0
+
+        written = threading.Event()
+        self.queue.put(written)
+        written.wait()
+        if ( self.failure != None ) : raise OSError('Could not write %s: %s' % (self.filename,self.failure))
+
+        return {'Offset' : self.offset, 'Records' : b''.join(self.records).hex()}
+
+    # Compress and write the blocks passed by 'Queue' until 'None' is passed
+    def Run (self) :
+
+        "Compress and write blocks"
+
+        while True :
+            block = self.queue.get()
+            if ( block == None ) : break
+            if ( isinstance(block,threading.Event) ) :
+                try:
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                except OSError as error:
+                    self.failure = self.failure or str(error)
+                block.set()
+                continue
+            if ( self.failure != None ) : continue
+
+            try:
+                compressor = zlib.compressobj(CompressionLevel,zlib.DEFLATED,GzipBits)
+                compressed = compressor.compress(block) + compressor.flush()
+                self.file.write(compressed)
+            except (OSError,zlib.error) as error:
+                self.failure = str(error)
+                continue
+
+            self.records.append(BlockRecord.pack(*KeyRange(block),self.offset,len(compressed),len(block),block.count(b'\n')))
+            self.offset += len(compressed)
+
+    # Write the remaining rows, wait for the background thread and write the block
+    # index file. Returns the number of blocks written.
+    def Close (self) :
+
+        "Complete the block compressed file and its index"
+
+        data = b''.join(self.pending)
+        if ( len(data) > 0 ) and not ( data.endswith(b'\n') ) : data += b'\n'
+        if ( len(data) > 0 ) : self.Queue(data)
+        self.pending = []
+
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        if ( self.failure != None ) : raise OSError('Could not write %s: %s' % (self.filename,self.failure))
+
+        with open(self.indexfilename + '.part','wb') as indexfile :
+            indexfile.write(BlockHeader.pack(BlockMagic,len(self.records)))
+            indexfile.write(b''.join(self.records))
+
+        os.replace(self.filename + '.part',self.filename)
+        os.replace(self.indexfilename + '.part',self.indexfilename)
+
+        return len(self.records)
+
+# Class looking up postcodes in a block compressed lookup file using its block index file.
+# The most recently decompressed block is kept.
+class BlockLookup :
+
+    "Looks up postcodes in a block compressed lookup file"
+
+    def __init__ (self,filename,indexfilename) :
+
+        with open(indexfilename,'rb') as indexfile :
+            data = indexfile.read()
+
+        magic,count = BlockHeader.unpack_from(data,0)
+        if ( magic != BlockMagic ) : raise ValueError('%s is not a block index file' % indexfilename)
+
+        # Blocks in order of their lowest key with the highest key of the blocks up to each
+        self.blocks = sorted(BlockRecord.iter_unpack(data[BlockHeader.size:BlockHeader.size + count * BlockRecord.size]))
+        self.lowkeys = [block[0] for block in self.blocks]
+        self.highkeys = list(itertools.accumulate((block[1] for block in self.blocks),max))
+        self.encoding = locale.getpreferredencoding(False)
+        self.file = open(filename,'rb')
+        self.cached = None
+        self.cachedblock = None
+
+    # Return the decompressed rows of block 'position'
+    def Block (self,position) :
+
+        "Return a decompressed block"
+
+        if ( position != self.cached ) :
+            firstkey,lastkey,offset,length,size,rows = self.blocks[position]
+            self.file.seek(offset)
+            self.cachedblock = zlib.decompress(self.file.read(length),GzipBits)
+            self.cached = position
+
+        return self.cachedblock
+
+    # Return the lookup file row for 'postcode' or an empty string if
+    # 'postcode' is not present.
+    def Lookup (self,postcode) :
+
+        "Return the lookup file row for 'postcode'"
+
+        key = Codec.Encode(postcode)
+        if ( key == Codec.InvalidKey ) : return ''
+        printed = b'\n' + Codec.Decode(key).encode('ascii') + b','
+
+        # Blocks whose key range holds the postcode, normally one
+        position = bisect.bisect_right(self.lowkeys,key) - 1
+        while ( position >= 0 ) and ( self.highkeys[position] >= key ) :
+            if ( key <= self.blocks[position][1] ) :
+                data = b'\n' + self.Block(position)
+                start = data.find(printed)
+                if ( start >= 0 ) : return data[start + 1:data.find(b'\n',start + 1)].decode(self.encoding)
+
+                # Rows whose postcode is not in printed form
+                for row in data.splitlines() :
+                    if ( row != b'' ) and ( RowKey(row) == key ) : return row.decode(self.encoding)
+            position -= 1
+
+        return ''
+
+    # Close the block compressed file
+    def Close (self) :
+
+        "Close the block compressed file"
+
+        self.file.close()
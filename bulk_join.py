@@ -0,0 +1,332 @@
+# bulk_join.py
+#
+# Description
+# ===========
+#
+# This script enriches a csv file containing a column of UK postcodes with the MSOA
+# ( Middle Super Output Area ) and LTLA (Lower Tier Local Authority ) in which each
+# postcode resides. The following fields are appended to each row of the input file:
+#
+# <MSOA name>,<MSOA code>,<MSOA population>,<LTLA name>,<LTLA code>,<LTLA population>
+#
+# These fields are left empty for postcodes which are not found. Postcodes may be
+# given in any case and with or without spacing.
+#
+# Rather than looking up each postcode in turn the input file is read in chunks. The
+# postcodes of each chunk are encoded as integer keys ( see 'postcode_codec.py' ) and
+# joined against the sorted keys of compact lookup file 'lookup_data.bin' ( see
+# 'compact_lookup.py' ) using NumPy sorted array searches.
+#
+# Usage
+# =====
+#
+# python bulk_join.py <input file> <output file> [--column <name or position>] [--no-header]
+#                     [--chunk-size <rows>] [--lookup <compact lookup file>]
+#
+# The postcode column may be given as a header name or a zero based column position and
+# defaults to column 'Postcode'. Use '--no-header' if the input file has no header row.
+#
+# Data and configuration files
+# ============================
+#
+# This utility requires the file ..\data\lookup_data.bin created by 'generate_lookup.py'
+# and the third party NumPy package.
+#
+# Logging
+# =======
+#
+# This script logs error and status messages, including the join throughput in rows per
+# second, to the file .\log\log.txt an to the user console.
+# Messages are written on a background thread ( see 'log_writer.py' ) and may also be
+# written as JSON lines to <file> using '--json-log <file>'.
+
+import argparse
+import csv
+import os
+import time
+import numpy
+import compact_lookup as Compact
+import log_writer as LogWriter
+import postcode_codec as Codec
+import utils as Utils
+
+# Lookup file record layout
+RecordType = numpy.dtype([('Postcode','S8'),('Msoa','<u2'),('Authority','<u2')])
+
+# Fields appended to each input row
+JoinFields = ['MSOA name','MSOA code','MSOA population','LTLA name','LTLA code','LTLA population']
+
+# Postcode key value of each byte and the shift of each normalised postcode character
+ByteValues = numpy.array([Codec.Values.get(chr(byte),0) for byte in range(256)],dtype=numpy.uint64)
+KeyShifts = numpy.arange(Codec.KeyLength - 1,-1,-1,dtype=numpy.uint64) * numpy.uint64(Codec.CharacterBits)
+
+# Whether each character code is spacing removed by 'str.split'. No character above
+# U+3000 is spacing.
+SpacingCodes = numpy.array([chr(code).isspace() for code in range(0x3001)],dtype=bool)
+
+# Return the character codes of the array of postcodes 'postcodes', held as bytes or
+# text, as a 2 dimensional array with one row for each postcode padded with zeros
+def CharacterCodes (postcodes) :
+
+    "Return the character codes of an array of postcodes"
+
+    postcodes = numpy.ascontiguousarray(postcodes)
+    if ( postcodes.dtype.kind == 'U' ) : return postcodes.view(numpy.uint32).reshape(len(postcodes),postcodes.dtype.itemsize // 4)
+
+    return postcodes.view(numpy.uint8).reshape(len(postcodes),postcodes.dtype.itemsize)
+
+# Return an array of 64 bit integer keys for the array of postcodes 'postcodes'.
+# Each key is the key of the postcode given by 'postcode_codec.Encode' so keys
+# sort in normalised postcode order. Postcodes which can not be valid UK
+# postcodes ( see 'postcode_codec.Valid' ) are given key 'postcode_codec.InvalidKey'.
+def EncodePostcodes (postcodes) :
+
+    "This procedure will return an array of integer keys for an array of postcodes"
+
+    codes = CharacterCodes(postcodes)
+
+    # Move the characters other than spacing to the start of each row, zeroing the spacing.
+    # Bytes are ASCII so only ASCII spacing is removed from them.
+    limit = 128 if ( codes.dtype == numpy.uint8 ) else len(SpacingCodes)
+    spacing = SpacingCodes[numpy.minimum(codes,limit - 1)] & ( codes < limit )
+    if ( spacing.any() ) :
+        compacted = numpy.zeros_like(codes)
+        rows = numpy.arange(len(codes))
+        positions = numpy.zeros(len(codes),dtype=numpy.intp)
+        for column in range(codes.shape[1]) :
+            compacted[rows,positions] = numpy.where(spacing[:,column],0,codes[:,column])
+            positions += ~spacing[:,column]
+        codes = compacted
+
+    # Lengths up to the last non zero character with letters in upper case
+    present = codes != 0
+    lengths = numpy.where(present.any(axis=1),codes.shape[1] - numpy.argmax(present[:,::-1],axis=1),0)
+    codes = numpy.where(( codes >= ord('a') ) & ( codes <= ord('z') ),codes - 32,codes)
+    digits = ( codes >= ord('0') ) & ( codes <= ord('9') )
+    letters = ( codes >= ord('A') ) & ( codes <= ord('Z') )
+    inside = numpy.arange(codes.shape[1])[None,:] < lengths[:,None]
+    valid = ( lengths >= 5 ) & ( lengths <= Codec.KeyLength ) & ( digits | letters | ~inside ).all(axis=1)
+
+    # Keys of the first 7 characters of each postcode
+    characters = numpy.zeros((len(codes),Codec.KeyLength),dtype=numpy.uint8)
+    width = min(Codec.KeyLength,codes.shape[1])
+    characters[:,:width] = numpy.where(valid[:,None],codes[:,:width],0)
+    letters = numpy.zeros((len(codes),Codec.KeyLength),dtype=bool)
+    letters[:,:width] = ( characters[:,:width] >= ord('A') ) & ( characters[:,:width] <= ord('Z') )
+    lengths = numpy.where(valid,lengths,Codec.KeyLength)[:,None]
+
+    # A letter followed by the outward code and an inward code of a digit and two letters
+    inward = lengths - Codec.InwardLength + numpy.arange(Codec.InwardLength)[None,:]
+    inwardcharacters = numpy.take_along_axis(characters,inward,axis=1)
+    inwardletters = numpy.take_along_axis(letters,inward,axis=1)
+    valid &= letters[:,0] & ( inwardcharacters[:,0] >= ord('0') ) & ( inwardcharacters[:,0] <= ord('9') ) & inwardletters[:,1:].all(axis=1)
+
+    # Outward code left justified in 4 characters followed by the inward code
+    normalised = numpy.full((len(codes),Codec.KeyLength),ord(' '),dtype=numpy.uint8)
+    outward = numpy.arange(Codec.KeyLength - Codec.InwardLength)[None,:]
+    normalised[:,:4] = numpy.where(outward < lengths - Codec.InwardLength,characters[:,:4],ord(' '))
+    normalised[:,4:] = inwardcharacters
+
+    keys = numpy.bitwise_or.reduce(ByteValues[normalised] << KeyShifts,axis=1)
+    keys[~valid] = Codec.InvalidKey
+
+    return keys
+
+# Class joining postcodes against a compact lookup file
+class PostcodeJoin :
+
+    "Joins arrays of postcodes against a compact lookup file"
+
+    def __init__ (self,filename) :
+
+        lookup = Compact.CompactLookup(filename)
+        records = numpy.frombuffer(lookup.buffer,dtype=RecordType,count=lookup.count,offset=lookup.recordoffset)
+
+        keys = EncodePostcodes(records['Postcode'])
+        order = numpy.argsort(keys,kind='stable')
+        self.keys = keys[order]
+        self.msoaids = records['Msoa'][order]
+        self.authorityids = records['Authority'][order]
+
+        # Appended fields for each MSOA and LTLA plus empty fields for unmatched postcodes
+        self.msoas = lookup.msoas
+        self.authorities = lookup.authorities
+        self.msoafields = [[name,code,str(population)] for code,name,population in lookup.msoas] + [['','','']]
+        self.authorityfields = [[name,code,str(population)] for code,name,population in lookup.authorities] + [['','','']]
+        self.unmatchedmsoa = len(lookup.msoas)
+        self.unmatchedauthority = len(lookup.authorities)
+
+        del records
+        lookup.Close()
+
+    # Return arrays of MSOA and LTLA table positions for the list of 'postcodes'.
+    # Unmatched postcodes are given the position of the empty fields.
+    def Join (self,postcodes) :
+
+        "Return MSOA and LTLA table positions for a list of postcodes"
+
+        return self.JoinKeys(EncodePostcodes(numpy.array(postcodes,dtype=str)))
+
+    # Return arrays of MSOA and LTLA table positions for the array of postcode keys 'keys'
+    # ( see 'postcode_codec.py' ) and the number of keys matched.
+    def JoinKeys (self,keys) :
+
+        "Return MSOA and LTLA table positions for an array of postcode keys"
+
+        msoaids = numpy.full(len(keys),self.unmatchedmsoa,dtype=numpy.int64)
+        authorityids = numpy.full(len(keys),self.unmatchedauthority,dtype=numpy.int64)
+        if ( len(self.keys) == 0 ) : return msoaids,authorityids,0
+
+        positions = numpy.searchsorted(self.keys,keys)
+        positions[positions == len(self.keys)] = 0
+        matched = ( self.keys[positions] == keys ) & ( keys != Codec.InvalidKey )
+
+        msoaids[matched] = self.msoaids[positions[matched]]
+        authorityids[matched] = self.authorityids[positions[matched]]
+
+        return msoaids,authorityids,int(matched.sum())
+
+    # Return 'rows' with the MSOA and LTLA fields of the postcode in column 'column' appended
+    def JoinRows (self,rows,column) :
+
+        "Return 'rows' with MSOA and LTLA fields appended"
+
+        msoaids,authorityids,matched = self.Join([row[column] if ( column < len(row) ) else '' for row in rows])
+        msoafields = self.msoafields
+        authorityfields = self.authorityfields
+
+        joined = [row + msoafields[msoaid] + authorityfields[authorityid] for row,msoaid,authorityid in zip(rows,msoaids.tolist(),authorityids.tolist())]
+
+        return joined,matched
+
+# Return a generator of lists of at most 'size' rows read using 'reader'
+def Chunks (reader,size) :
+
+    "Return a generator of lists of rows"
+
+    chunk = []
+    for row in reader :
+        chunk.append(row)
+        if ( len(chunk) == size ) :
+            yield chunk
+            chunk = []
+    if ( len(chunk) > 0 ) : yield chunk
+
+############
+### MAIN ###
+############
+
+if ( __name__ == '__main__' ) :
+
+    # File names and modes
+    Currentdir = os.getcwd()
+    LogDir = os.path.join(Currentdir,'log')
+    ErrorFilename = os.path.join(LogDir,'log.txt')
+    DataDir = os.path.join(Currentdir,'data')
+    CompactFilename = os.path.join(DataDir,'lookup_data.bin')
+    append = 'a'
+
+    # Function return values
+    invalid = failure = 0
+    empty = ''
+    success = 1
+
+    # Error levels
+    error = 'ERROR'
+    warning = 'WARNING'
+    info = 'INFO'
+
+    # Script names
+    module = 'bulk_join.py'
+
+    # Parse command line
+    Parser = argparse.ArgumentParser(description='Append MSOA and LTLA fields to a csv file of postcodes')
+    Parser.add_argument('input',help='csv file containing a postcode column')
+    Parser.add_argument('output',help='enriched csv file to create')
+    Parser.add_argument('--column',default='Postcode',help='postcode column name or zero based position')
+    Parser.add_argument('--no-header',dest='header',action='store_false',help='input file has no header row')
+    Parser.add_argument('--chunk-size',type=int,default=200000,help='rows joined per chunk')
+    Parser.add_argument('--lookup',default=CompactFilename,help='compact lookup file')
+    LogWriter.AddArguments(Parser)
+    Arguments = Parser.parse_args()
+
+    # Create/open log file
+    ErrorFileObject = Utils.OpenLog(ErrorFilename,failure,Arguments.jsonlog)
+    ErrorMessage = 'Could not open ' + ErrorFilename
+    if ( ErrorFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Log start of script
+    Utils.Logerror(ErrorFileObject,module,'Started',info)
+
+    # Load lookup keys
+    ErrorMessage = 'Reading compact lookup file %s ' % Arguments.lookup
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    try:
+        Join = PostcodeJoin(Arguments.lookup)
+    except:
+        ErrorMessage = 'Could not read compact lookup file ' + Arguments.lookup
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Open input and output files
+    InputFileObject = Utils.Open(Arguments.input,'r',failure)
+    ErrorMessage = 'Could not open ' + Arguments.input
+    if ( InputFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    OutputFileObject = Utils.Open(Arguments.output,'w',failure)
+    ErrorMessage = 'Could not open ' + Arguments.output
+    if ( OutputFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    Reader = csv.reader(InputFileObject)
+    Writer = csv.writer(OutputFileObject,lineterminator='\n')
+
+    # Locate postcode column
+    if ( Arguments.column.isdigit() ) : PostcodeColumn = int(Arguments.column)
+    if ( Arguments.header ) :
+        Header = next(Reader,[])
+        if not ( Arguments.column.isdigit() ) :
+            if ( Arguments.column not in Header ) :
+                ErrorMessage = 'Column %s not found in %s' % (Arguments.column,Arguments.input)
+                Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+            PostcodeColumn = Header.index(Arguments.column)
+        Writer.writerow(Header + JoinFields)
+    elif not ( Arguments.column.isdigit() ) :
+        ErrorMessage = 'A column position must be given when the input file has no header row'
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Log progress messages
+    ErrorMessage = 'Joining postcodes in %s ' % Arguments.input
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    # Join input file in chunks
+    RowCount = 0
+    MatchedCount = 0
+    StartTime = time.perf_counter()
+
+    for Chunk in Chunks(Reader,Arguments.chunk_size) :
+        JoinedRows,Matched = Join.JoinRows(Chunk,PostcodeColumn)
+        Writer.writerows(JoinedRows)
+        RowCount += len(Chunk)
+        MatchedCount += Matched
+
+    ElapsedTime = time.perf_counter() - StartTime
+
+    # Output statistics.
+    ErrorMessage = 'A total of %d rows were joined in %.2f seconds ( %d rows/sec ) ' % (RowCount,ElapsedTime,RowCount / max(ElapsedTime,1e-9))
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+    if ( MatchedCount != RowCount ) :
+        ErrorMessage = 'A total of %d postcodes were not found ' % (RowCount - MatchedCount)
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+    # Close input and output files
+    ErrorMessage = 'Could not close ' + Arguments.input
+    if ( Utils.Close(InputFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+    ErrorMessage = 'Could not close ' + Arguments.output
+    if ( Utils.Close(OutputFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+    # Log end of script
+    Utils.Logerror(ErrorFileObject,module,'Completed',info)
+
+    # Close error log file
+    ErrorMessage = 'Could not close ' + ErrorFilename
+    if ( Utils.Close(ErrorFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
@@ -0,0 +1,120 @@
+# checkpoint.py
+#
+# Description
+# ===========
+#
+# This module records checkpoints of a 'generate_lookup.py' run so that a run which is
+# stopped partway through the postcode file, for example when it is killed or the disk
+# fills, can be continued from its last checkpoint using 'generate_lookup.py --resume'
+# rather than started again.
+#
+# While a run is in progress the lookup files are written to temporary '.part' files.
+# Each checkpoint flushes these files to disk and records the following in checkpoint
+# file 'lookup_data.checkpoint':
+#
+# - The byte offset of the next unprocessed line of the postcode file
+# - The length of the temporary lookup file and the number of compact lookup records
+# - The state of the block compressed lookup file ( see 'block_lookup.py' )
+# - The postcode counts and the invalid MSOAs found so far
+# - An identity of the run made up of the size and modification time of the postcode
+#   file and a hash of the MSOA and LTLA tables. A checkpoint is only used when the
+#   identity of the new run is the same.
+#
+# The checkpoint file is itself written to a temporary file and renamed so a checkpoint
+# is either complete or absent. The checkpoint file is removed when the run completes.
+
+import json
+import os
+import time
+
+# Minimum number of seconds between checkpoints
+CheckpointInterval = 60
+
+# Return the identity of a run which reads postcode file 'postcodefilename' using the
+# tables with hash 'tablesdigest'. 'options' holds any further settings which must be
+# unchanged for a checkpoint to be used.
+def Identity (postcodefilename,tablesdigest,options) :
+
+    "Return the identity of a run"
+
+    status = os.stat(postcodefilename)
+
+    return {'PostcodeSize' : status.st_size, 'PostcodeModified' : status.st_mtime_ns, 'Tables' : tablesdigest, 'Options' : options}
+
+# Return the checkpoint held in checkpoint file 'checkpointfilename' if it was written
+# by a run with identity 'identity' or None otherwise
+def LoadCheckpoint (checkpointfilename,identity) :
+
+    "Return the checkpoint of an earlier run with the same identity"
+
+    try:
+        with open(checkpointfilename,'r') as checkpointfile :
+            state = json.load(checkpointfile)
+    except (OSError,ValueError) :
+        return None
+
+    return state if ( state.get('Identity') == identity ) else None
+
+# Remove checkpoint file 'checkpointfilename' if it exists
+def RemoveCheckpoint (checkpointfilename) :
+
+    "Remove a checkpoint file"
+
+    if ( os.path.exists(checkpointfilename) ) : os.remove(checkpointfilename)
+
+# Flush file object 'fileobject' to disk and return it
+def Sync (fileobject) :
+
+    "Flush a file object to disk"
+
+    fileobject.flush()
+    os.fsync(fileobject.fileno())
+
+    return fileobject
+
+# Class writing the checkpoints of a run with identity 'identity' to checkpoint file
+# 'checkpointfilename'. The run writes lookup file object 'lookupfileobject', compact
+# lookup writer 'compactfileobject' and block writer 'blockwriter' if it is given and
+# keeps its counts and invalid MSOAs in 'statistics' and 'invalidmsoas'.
+class Checkpoint :
+
+    "Writes the checkpoints of a run"
+
+    def __init__ (self,checkpointfilename,identity,lookupfileobject,compactfileobject,blockwriter,statistics,invalidmsoas,interval=CheckpointInterval) :
+
+        self.checkpointfilename = checkpointfilename
+        self.identity = identity
+        self.lookupfileobject = lookupfileobject
+        self.compactfileobject = compactfileobject
+        self.blockwriter = blockwriter
+        self.statistics = statistics
+        self.invalidmsoas = invalidmsoas
+        self.interval = interval
+        self.saved = time.monotonic()
+        self.count = 0
+
+    # Write a checkpoint recording that the postcode file has been processed up to byte
+    # offset 'inputoffset' if 'interval' seconds have passed since the last checkpoint
+    # or 'force' is set. Returns True if a checkpoint was written.
+    def Save (self,inputoffset,force=False) :
+
+        "Write a checkpoint if one is due"
+
+        if not ( force ) and ( time.monotonic() - self.saved < self.interval ) : return False
+
+        state = {'Identity' : self.identity, 'InputOffset' : inputoffset}
+        state['LookupOffset'] = Sync(self.lookupfileobject).buffer.tell()
+        state['CompactRecords'] = self.compactfileobject.Sync()
+        state['Blocks'] = self.blockwriter.Checkpoint() if ( self.blockwriter != None ) else None
+        state['Statistics'] = self.statistics
+        state['InvalidMsoas'] = self.invalidmsoas
+
+        with open(self.checkpointfilename + '.part','w') as checkpointfile :
+            json.dump(state,checkpointfile)
+            Sync(checkpointfile)
+        os.replace(self.checkpointfilename + '.part',self.checkpointfilename)
+
+        self.saved = time.monotonic()
+        self.count += 1
+
+        return True
@@ -0,0 +1,266 @@
+# compact_lookup.py
+#
+# Description
+# ===========
+#
+# This module writes and reads file 'lookup_data.bin', a compact dictionary encoded
+# version of file 'lookup_data.csv' created by 'generate_lookup.py'. Rather than
+# repeating the MSOA and LTLA details on every row the file holds a small LTLA table
+# and a small MSOA table followed by one fixed width record for each postcode which
+# refers to its MSOA and LTLA by table position. Each row of 'lookup_data.csv' can be
+# recreated exactly from this file.
+#
+# File layout
+# ===========
+#
+# <Magic 'MSOABIN1' (8 bytes)><LTLA count (4 bytes)><MSOA count (4 bytes)><Postcode count (4 bytes)>
+# <LTLA table length (4 bytes)><LTLA table>
+# <MSOA table length (4 bytes)><MSOA table>
+# <Postcode record 0>...<Postcode record n-1>
+#
+# Each table is UTF-8 text with one line per entry of the form:
+#
+# <Code><tab><Name><tab><Population>
+#
+# Each postcode record consists of the following fields:
+#
+# <Post code (8 bytes, NUL padded)><MSOA table position (2 bytes)><LTLA table position (2 bytes)>
+#
+# All integers are stored little endian.
+#
+# Usage
+# =====
+#
+# The contents of a compact lookup file can be written as csv file using:
+#
+# python compact_lookup.py <compact lookup file> <csv file>
+
+import mmap
+import os
+import struct
+import sys
+import lookup_tables as Tables
+
+# Compact file format
+CompactMagic = b'MSOABIN1'
+CompactHeader = struct.Struct('<8sIII')
+TableLength = struct.Struct('<I')
+CompactRecord = struct.Struct('<8sHH')
+
+# Number of records buffered before each write
+BatchSize = 65536
+
+# Return the encoded form of table 'table' ( see 'lookup_tables.py' )
+def EncodeTable (table) :
+
+    "Return the encoded form of table 'table'"
+
+    lines = ['%s\t%s\t%d\n' % (code,name,population) for code,name,population in table]
+    data = ''.join(lines).encode('utf-8')
+
+    return TableLength.pack(len(data)) + data
+
+# Return the table decoded from 'buffer' at 'offset' ( see 'lookup_tables.py' )
+# and the offset of the data following the table.
+def DecodeTable (buffer,offset) :
+
+    "Return the table decoded from 'buffer' at 'offset'"
+
+    (length,) = TableLength.unpack_from(buffer,offset)
+    start = offset + TableLength.size
+    table = Tables.Table()
+    for line in bytes(buffer[start:start + length]).decode('utf-8').splitlines() :
+        code,name,population = line.split('\t')
+        table.Add(code,name,int(population))
+
+    return table,start + length
+
+# Class writing a compact lookup file one postcode at a time. The MSOA and LTLA
+# of each postcode are given by their ids in tables 'msoas' and 'authorities'.
+# If 'areas' is given the written records are also passed to its 'AddRecords'
+# method ( see 'area_index.py' ). If 'count' is given an unfinished file written
+# with the same tables is continued after its first 'count' records.
+class CompactWriter :
+
+    "Writes a compact lookup file"
+
+    def __init__ (self,filename,msoas,authorities,areas=None,count=None) :
+
+        self.msoas = msoas
+        self.authorities = authorities
+        self.areas = areas
+        self.count = 0
+        self.records = []
+
+        if ( count == None ) :
+            self.file = open(filename,'wb')
+            self.file.write(CompactHeader.pack(CompactMagic,len(authorities),len(msoas),0))
+            self.file.write(EncodeTable(authorities))
+            self.file.write(EncodeTable(msoas))
+        else:
+            self.Continue(filename,count)
+
+    # Continue unfinished file 'filename' after its first 'count' records
+    def Continue (self,filename,count) :
+
+        "Continue an unfinished compact lookup file"
+
+        recordoffset = CompactHeader.size + len(EncodeTable(self.authorities)) + len(EncodeTable(self.msoas))
+        end = recordoffset + count * CompactRecord.size
+        if ( os.path.getsize(filename) < end ) : raise ValueError('%s holds fewer than %d records' % (filename,count))
+
+        self.file = open(filename,'r+b')
+        self.file.seek(recordoffset)
+        while ( self.count < count ) :
+            data = self.file.read(min(count - self.count,BatchSize) * CompactRecord.size)
+            if ( self.areas != None ) : self.areas.AddRecords(data)
+            self.count += len(data) // CompactRecord.size
+        self.file.truncate(end)
+
+    # Add a postcode record
+    def Write (self,postcode,msoaid,authorityid) :
+
+        "Add a postcode record"
+
+        self.records.append(CompactRecord.pack(postcode.encode('ascii'),msoaid,authorityid))
+        if ( len(self.records) == BatchSize ) : self.Flush()
+
+    # Write buffered records
+    def Flush (self) :
+
+        "Write buffered records"
+
+        data = b''.join(self.records)
+        self.file.write(data)
+        if ( self.areas != None ) : self.areas.AddRecords(data)
+        self.count += len(self.records)
+        self.records = []
+
+    # Write buffered records to disk and return the number of records written
+    def Sync (self) :
+
+        "Write buffered records to disk"
+
+        self.Flush()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        return self.count
+
+    # Write the packed records 'data' created by a 'CompactRecords' object
+    def WriteRecords (self,data) :
+
+        "Write packed records"
+
+        self.Flush()
+        self.file.write(data)
+        if ( self.areas != None ) : self.areas.AddRecords(data)
+        self.count += len(data) // CompactRecord.size
+
+    # Write remaining records, complete the header and close the file
+    def Close (self) :
+
+        "Complete the header and close the file"
+
+        self.Flush()
+        self.file.seek(0)
+        self.file.write(CompactHeader.pack(CompactMagic,len(self.authorities),len(self.msoas),self.count))
+        self.file.close()
+
+        return self.count
+
+# Class packing postcode records in memory using the MSOA and LTLA ids of the
+# tables of a 'CompactWriter' object. This allows records to be created in
+# another process and written using 'CompactWriter.WriteRecords'.
+class CompactRecords :
+
+    "Packs postcode records in memory"
+
+    def __init__ (self) :
+
+        self.records = []
+
+    # Add a postcode record
+    def Write (self,postcode,msoaid,authorityid) :
+
+        "Add a postcode record"
+
+        self.records.append(CompactRecord.pack(postcode.encode('ascii'),msoaid,authorityid))
+
+    # Return the packed records
+    def Data (self) :
+
+        "Return the packed records"
+
+        return b''.join(self.records)
+
+# Class reading a compact lookup file. Postcode records are memory mapped
+# and only decoded when requested.
+class CompactLookup :
+
+    "Reads a compact lookup file"
+
+    def __init__ (self,filename) :
+
+        with open(filename,'rb') as file :
+            self.buffer = mmap.mmap(file.fileno(),0,access=mmap.ACCESS_READ)
+
+        magic,authoritycount,msoacount,self.count = CompactHeader.unpack_from(self.buffer,0)
+        if ( magic != CompactMagic ) :
+            self.buffer.close()
+            raise ValueError('%s is not a compact lookup file' % filename)
+
+        self.authorities,offset = DecodeTable(self.buffer,CompactHeader.size)
+        self.msoas,offset = DecodeTable(self.buffer,offset)
+        self.recordoffset = offset
+
+        # Pre-render the csv suffix of every MSOA and LTLA
+        self.msoasuffixes = self.msoas.Render()
+        self.authoritysuffixes = self.authorities.Render()
+
+    # Return the (Postcode,MSOA position,LTLA position) tuple of record 'position'
+    def Record (self,position) :
+
+        "Return record 'position'"
+
+        postcode,msoaid,authorityid = CompactRecord.unpack_from(self.buffer,self.recordoffset + position * CompactRecord.size)
+
+        return postcode.rstrip(b'\x00').decode('ascii'),msoaid,authorityid
+
+    # Return a generator of (Postcode,MSOA position,LTLA position) tuples for all records
+    def Records (self) :
+
+        "Return a generator of all records"
+
+        end = self.recordoffset + self.count * CompactRecord.size
+        for postcode,msoaid,authorityid in CompactRecord.iter_unpack(memoryview(self.buffer)[self.recordoffset:end]) :
+            yield postcode.rstrip(b'\x00').decode('ascii'),msoaid,authorityid
+
+    # Return a generator of the 'lookup_data.csv' rows for all records
+    def Rows (self) :
+
+        "Return a generator of the csv rows for all records"
+
+        msoasuffixes = self.msoasuffixes
+        authoritysuffixes = self.authoritysuffixes
+        for postcode,msoaid,authorityid in self.Records() :
+            yield '%s,%s,%s\n' % (postcode,msoasuffixes[msoaid],authoritysuffixes[authorityid])
+
+    # Release the memory mapped file
+    def Close (self) :
+
+        "Release the memory mapped file"
+
+        self.buffer.close()
+
+# Write the contents of a compact lookup file as a csv file
+if ( __name__ == '__main__' ) :
+
+    if ( len(sys.argv) != 3 ) :
+        print('Usage: python compact_lookup.py <compact lookup file> <csv file>')
+        sys.exit(1)
+
+    Compact = CompactLookup(sys.argv[1])
+    with open(sys.argv[2],'w') as CsvFile :
+        CsvFile.writelines(Compact.Rows())
+    Compact.Close()
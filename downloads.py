@@ -0,0 +1,479 @@
+# downloads.py
+#
+# Description
+# ===========
+#
+# This module downloads files over HTTP for 'retrieve_files.py'. All files are fetched
+# concurrently by a pool of threads sharing one pooled 'requests' session and each
+# response body is streamed to disk in fixed size chunks so memory use does not depend
+# on the size of the file. The number of bytes, duration and throughput of each
+# download is returned so they can be logged.
+#
+# Download cache
+# ==============
+#
+# Downloads may be made through a persistent cache directory. The cache holds the last
+# copy of each url together with its ETag, Last-Modified and SHA-256 values and the size
+# and modification time of the copy in file 'cache.json'. Cached urls are requested
+# conditionally so an unchanged file is answered with '304 Not Modified' and copied from
+# the cache rather than downloaded again. A cached copy whose size and modification time
+# are unchanged is taken to be intact without reading it, and it is only copied if the
+# destination file is not already a copy of it. Each download reports whether its
+# contents changed since the previous download.
+#
+# The metadata of downloads which have changed is written to 'cache.pending.json' rather
+# than 'cache.json' so they are reported as changed until the lookup files have been
+# generated from them ( see 'utils.py' ).
+#
+# Segmented downloads
+# ===================
+#
+# Every file is requested with the open ended range 'bytes=0-' so that the one request
+# both probes whether the server supports byte ranges and starts the download. A server
+# which does not support ranges answers '200 OK' with the whole file which is streamed
+# to disk as a single download. A file of at least 'SegmentedSize' bytes answered with
+# '206 Partial Content' is split into 'Segments' byte range segments which are downloaded
+# in parallel each over its own connection. The response to the probe supplies the first
+# segment and is closed once the first segment is complete.
+#
+# The segments are written in place to temporary file '<file>.part' and the progress of
+# each segment is saved to '<file>.segments' at most every 'ProgressInterval' seconds
+# after the temporary file has been flushed to disk. A segment whose connection drops is
+# continued from where it stopped up to 'Retries' times, and a download which fails or is
+# interrupted is continued from its saved progress by the next download of the same url
+# provided the server reports the same size and ETag or Last-Modified value. Further
+# segment requests carry an 'If-Range' header so a file which changes on the server during
+# the download fails the download rather than mixing the contents of two versions, and the
+# next download starts again as the server then reports a different validator.
+#
+# Once all segments are complete the size of the file is checked and its SHA-256 is
+# compared with the 'Repr-Digest' or 'Digest' header of the server if either is given.
+# The download statistics of a segmented download include the number of segments and
+# the number of bytes continued from an earlier download.
+
+import base64
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import utils as Utils
+
+# Download settings
+ChunkSize = 1048576
+Timeout = 60
+
+# Segmented download settings
+SegmentedSize = 33554432
+Segments = 4
+ProgressInterval = 1.0
+Retries = 3
+
+# Exception raised when a download fails
+class DownloadError (Exception) :
+
+    "Raised when a download fails"
+
+# Return a 'requests' session able to keep 'poolsize' connections open
+def NewSession (poolsize) :
+
+    "Return a pooled 'requests' session"
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=poolsize,pool_maxsize=poolsize)
+    session.mount('http://',adapter)
+    session.mount('https://',adapter)
+
+    return session
+
+# Return the start, end and total size given by the 'Content-Range' header of 'response'
+# or None if it has none
+def ContentRange (response) :
+
+    "Return the byte range of a partial response"
+
+    units,separator,value = response.headers.get('Content-Range','').partition(' ')
+    byterange,separator,total = value.partition('/')
+    start,separator,end = byterange.partition('-')
+    if ( units != 'bytes' ) or not ( start.isdigit() and end.isdigit() and total.isdigit() ) : return None
+
+    return int(start),int(end),int(total)
+
+# Return the validator of 'response' used to check the file has not changed, its ETag if
+# it is a strong ETag or its Last-Modified value otherwise
+def Validator (response) :
+
+    "Return the validator of a response"
+
+    etag = response.headers.get('ETag','')
+    if ( etag != '' ) and not ( etag.startswith('W/') ) : return etag
+
+    return response.headers.get('Last-Modified','')
+
+# Return the SHA-256 of the file given by the 'Repr-Digest' or 'Digest' header of
+# 'response' in hexadecimal or an empty string if neither gives one
+def ServerDigest (response) :
+
+    "Return the SHA-256 of the file given by the server"
+
+    for header,separator in (('Repr-Digest',':'),('Digest','=')) :
+        for value in response.headers.get(header,'').split(',') :
+            algorithm,equals,encoded = value.strip().partition('=')
+            if ( algorithm.lower() == 'sha-256' ) and ( encoded != '' ) :
+                try:
+                    return base64.b64decode(encoded.strip(':')).hex()
+                except ValueError:
+                    return ''
+
+    return ''
+
+# Class downloading 'url' to file 'filename' in parallel byte range segments using
+# 'session'. The file has 'size' bytes and validator 'validator' ( see 'Validator' ).
+# The progress of the segments is saved so an interrupted download can be continued.
+class SegmentedDownload :
+
+    "Downloads a file in parallel byte range segments"
+
+    def __init__ (self,session,url,filename,size,validator) :
+
+        self.session = session
+        self.url = url
+        self.filename = filename
+        self.size = size
+        self.validator = validator
+        self.partfilename = filename + '.part'
+        self.progressfilename = filename + '.segments'
+        self.lock = threading.Lock()
+        self.savelock = threading.Lock()
+        self.saved = time.monotonic()
+        self.failure = None
+        self.transferred = 0
+        self.segments = self.LoadProgress()
+        self.resumed = sum(position - start for start,end,position in self.segments)
+
+    # Return the segments of the file as lists of their start, end and next unwritten
+    # byte offsets. The segments of an earlier download of the same file are continued.
+    def LoadProgress (self) :
+
+        "Return the segments of the file"
+
+        try:
+            with open(self.progressfilename,'r') as fileobject :
+                progress = json.load(fileobject)
+            if ( self.validator != '' ) and ( progress['Url'] == self.url ) and ( progress['Size'] == self.size ) and ( progress['Validator'] == self.validator ) :
+                if ( os.path.getsize(self.partfilename) == self.size ) : return progress['Segments']
+        except (OSError,ValueError,KeyError) :
+            pass
+
+        with open(self.partfilename,'wb') as fileobject :
+            fileobject.truncate(self.size)
+        segmentsize = -( -self.size // Segments )
+
+        return [[start,min(start + segmentsize,self.size),start] for start in range(0,self.size,segmentsize)]
+
+    # Flush the temporary file to disk and save the progress of the segments if
+    # 'ProgressInterval' seconds have passed since it was last saved or 'force' is set
+    def SaveProgress (self,force=False) :
+
+        "Save the progress of the segments"
+
+        with self.lock :
+            if not ( force ) and ( time.monotonic() - self.saved < ProgressInterval ) : return
+            progress = {'Url' : self.url, 'Size' : self.size, 'Validator' : self.validator, 'Segments' : [list(segment) for segment in self.segments]}
+            self.saved = time.monotonic()
+
+        with self.savelock :
+            with open(self.partfilename,'rb') as fileobject :
+                os.fsync(fileobject.fileno())
+            with open(self.progressfilename + '.part','w') as fileobject :
+                json.dump(progress,fileobject)
+            os.replace(self.progressfilename + '.part',self.progressfilename)
+
+    # Request the rest of segment 'segment' and return the response
+    def Request (self,segment) :
+
+        "Request the rest of a segment"
+
+        headers = {'Range' : 'bytes=%d-%d' % (segment[2],segment[1] - 1), 'Accept-Encoding' : 'identity'}
+        if ( self.validator != '' ) : headers['If-Range'] = self.validator
+        response = self.session.get(self.url,headers=headers,stream=True,timeout=Timeout)
+        if ( response.status_code != 206 ) or ( ContentRange(response) != (segment[2],segment[1] - 1,self.size) ) :
+            response.close()
+            raise DownloadError('GET operation for %s failed as the file changed during the download' % self.url)
+
+        return response
+
+    # Download segment 'segment' using response 'response' if it is given. A segment whose
+    # connection fails is continued from where it stopped up to 'Retries' times. A segment
+    # which fails sets 'failure' which stops the other segments.
+    def Fetch (self,segment,response=None) :
+
+        "Download a segment"
+
+        retries = 0
+        try:
+            with open(self.partfilename,'r+b') as fileobject :
+                while ( segment[2] < segment[1] ) and ( self.failure == None ) :
+                    reason = 'connection closed'
+                    try:
+                        if ( response == None ) : response = self.Request(segment)
+                        with response :
+                            fileobject.seek(segment[2])
+                            for chunk in response.iter_content(ChunkSize) :
+                                chunk = chunk[:segment[1] - segment[2]]
+                                fileobject.write(chunk)
+                                fileobject.flush()
+                                with self.lock :
+                                    segment[2] += len(chunk)
+                                    self.transferred += len(chunk)
+                                self.SaveProgress()
+                                if ( segment[2] == segment[1] ) or ( self.failure != None ) : break
+                    except requests.RequestException as exception :
+                        reason = str(exception)
+                    response = None
+
+                    if ( segment[2] < segment[1] ) and ( self.failure == None ) :
+                        retries += 1
+                        if ( retries > Retries ) : raise DownloadError('GET operation for %s failed: %s' % (self.url,reason))
+        except (DownloadError,OSError) as exception :
+            self.failure = self.failure or exception
+        finally:
+            if ( response != None ) : response.close()
+
+    # Download the incomplete segments in parallel using response 'response' to the
+    # request for the whole file for the first segment if it has not been started
+    def Run (self,response) :
+
+        "Download the incomplete segments"
+
+        pending = [segment for segment in self.segments if ( segment[2] < segment[1] )]
+        first = self.segments[0] if ( self.segments[0][2] == 0 ) else None
+        if ( first == None ) : response.close()
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max(1,len(pending))) as executor :
+                for segment in pending : executor.submit(self.Fetch,segment,response if ( segment is first ) else None)
+        finally:
+            self.SaveProgress(True)
+
+        if ( self.failure != None ) : raise self.failure
+
+    # Check the downloaded file against its size and SHA-256 'digest' given by the server
+    # if it is not empty and replace 'filename' with it. Returns the SHA-256 of the file.
+    def Complete (self,digest) :
+
+        "Check the downloaded file and replace 'filename' with it"
+
+        filehash = FileHash(self.partfilename)
+        if ( os.path.getsize(self.partfilename) != self.size ) or ( digest != '' ) and ( filehash != digest ) :
+            os.remove(self.partfilename)
+            os.remove(self.progressfilename)
+            raise DownloadError('Download of %s does not match its size or SHA-256' % self.url)
+
+        os.replace(self.partfilename,self.filename)
+        os.remove(self.progressfilename)
+
+        return filehash
+
+# Download 'url' to file 'filename' using 'session' and return the download statistics.
+# Additional request headers may be given in 'headers'. If the server responds with
+# '304 Not Modified' file 'filename' is left unchanged. Large files are downloaded in
+# parallel segments if the server supports byte ranges unless 'ranges' is False.
+def DownloadFile (session,url,filename,headers=None,ranges=True) :
+
+    "Download 'url' to file 'filename'"
+
+    starttime = time.perf_counter()
+    digest = hashlib.sha256()
+    filehash = ''
+    size = 0
+    segments = 1
+    resumed = 0
+    requestheaders = dict(headers or {})
+    if ( ranges ) : requestheaders['Range'] = 'bytes=0-'
+
+    try:
+        with session.get(url,headers=requestheaders,stream=True,timeout=Timeout) as response :
+            status = response.status_code
+
+            # Request the file without a range if the server can not satisfy the range,
+            # as for an empty file, or does not return it correctly
+            contentrange = ContentRange(response) if ( status == 206 ) else None
+            if ( status == 416 ) or ( status == 206 ) and ( contentrange == None or contentrange[0] != 0 ) :
+                if ( ranges ) : return DownloadFile(session,url,filename,headers,False)
+            if ( status not in (200,206,304) ) or ( status == 206 ) and not ( ranges ) :
+                raise DownloadError('GET operation for %s failed' % url)
+            encoded = response.headers.get('Content-Encoding','identity') != 'identity'
+            serverdigest = ServerDigest(response)
+
+            # Download large files in segments
+            if ( status == 206 ) and ( contentrange[2] >= SegmentedSize ) and not ( encoded ) :
+                download = SegmentedDownload(session,url,filename,contentrange[2],Validator(response))
+                download.Run(response)
+                filehash = download.Complete(serverdigest)
+                size = download.transferred
+                segments = len(download.segments)
+                resumed = download.resumed
+
+            # Download to a partial file which replaces 'filename' once complete
+            elif ( status != 304 ) :
+                partfilename = '%s.%d.part' % (filename,threading.get_ident())
+                with open(partfilename,'wb') as fileobject :
+                    for chunk in response.iter_content(ChunkSize) :
+                        fileobject.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+                filehash = digest.hexdigest()
+
+                expectedsize = contentrange[2] if ( status == 206 ) else int(response.headers.get('Content-Length',size))
+                if ( not ( encoded ) and ( size != expectedsize ) ) or ( serverdigest != '' and filehash != serverdigest ) :
+                    os.remove(partfilename)
+                    raise DownloadError('Download of %s does not match its size or SHA-256' % url)
+                os.replace(partfilename,filename)
+
+            etag = response.headers.get('ETag','')
+            lastmodified = response.headers.get('Last-Modified','')
+    except (requests.RequestException,OSError) as exception :
+        raise DownloadError('GET operation for %s failed: %s' % (url,exception))
+
+    duration = time.perf_counter() - starttime
+    status = 304 if ( status == 304 ) else 200
+
+    return {'Url' : url, 'Filename' : filename, 'Status' : status, 'Bytes' : size, 'Duration' : duration, 'Throughput' : size / max(duration,1e-9),
+            'SHA256' : filehash, 'ETag' : etag, 'LastModified' : lastmodified, 'Segments' : segments, 'Resumed' : resumed}
+
+# Return the SHA-256 of file 'filename'
+def FileHash (filename) :
+
+    "Return the SHA-256 of file 'filename'"
+
+    digest = hashlib.sha256()
+    with open(filename,'rb') as fileobject :
+        for chunk in iter(lambda : fileobject.read(ChunkSize),b'') :
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+# Return the contents of the metadata file of cache directory 'cachedir'
+def LoadCache (cachedir) :
+
+    "Return the download cache metadata"
+
+    try:
+        with open(os.path.join(cachedir,Utils.CacheMetadataFilename),'r') as fileobject :
+            return json.load(fileobject)
+    except (OSError,ValueError) :
+        return {}
+
+# Write 'cache' to metadata file 'metadatafilename' of cache directory 'cachedir'
+def SaveCache (cachedir,cache,metadatafilename=Utils.CacheMetadataFilename) :
+
+    "Write the download cache metadata"
+
+    filename = os.path.join(cachedir,metadatafilename)
+    with open(filename + '.part','w') as fileobject :
+        json.dump(cache,fileobject,indent=1)
+    os.replace(filename + '.part',filename)
+
+# Return True if cached file 'filename' is intact, that is it has the size and modification
+# time recorded in its cache entry 'entry'. Entries recorded without them are checked
+# against the SHA-256 of the file.
+def Intact (filename,entry) :
+
+    "Return True if a cached file is intact"
+
+    try:
+        status = os.stat(filename)
+    except OSError:
+        return False
+
+    if ( 'Size' in entry ) : return ( status.st_size == entry['Size'] ) and ( status.st_mtime_ns == entry['Modified'] )
+
+    return FileHash(filename) == entry['SHA256']
+
+# Download 'url' through cache directory 'cachedir' using the cache entry 'entry'
+# and copy the result to file 'filename'. The returned download statistics include
+# the new cache entry and whether the contents of 'url' have changed.
+def CachedDownload (session,cachedir,entry,url,filename) :
+
+    "Download 'url' through the download cache"
+
+    cachedfilename = os.path.join(cachedir,hashlib.sha1(url.encode('utf-8')).hexdigest())
+    headers = {}
+
+    # Request the file conditionally if the cached copy is intact
+    if ( entry != None ) and ( Intact(cachedfilename,entry) ) :
+        if ( entry['ETag'] != '' ) : headers['If-None-Match'] = entry['ETag']
+        if ( entry['LastModified'] != '' ) : headers['If-Modified-Since'] = entry['LastModified']
+
+    result = DownloadFile(session,url,cachedfilename,headers)
+    if ( result['Status'] == 304 ) :
+        if ( len(headers) == 0 ) : raise DownloadError('GET operation for %s returned 304 for an unconditional request' % url)
+        result['SHA256'] = entry['SHA256']
+        result['ETag'] = result['ETag'] or entry['ETag']
+        result['LastModified'] = result['LastModified'] or entry['LastModified']
+
+    # Copy the cached file with its modification time unless 'filename' is already a copy
+    try:
+        status = os.stat(cachedfilename)
+        try:
+            target = os.stat(filename)
+            result['Copied'] = ( target.st_size != status.st_size ) or ( target.st_mtime_ns != status.st_mtime_ns )
+        except FileNotFoundError:
+            result['Copied'] = True
+        if ( result['Copied'] ) : shutil.copy2(cachedfilename,filename)
+    except OSError as exception :
+        raise DownloadError('Could not copy %s to %s: %s' % (cachedfilename,filename,exception))
+    result['Filename'] = filename
+
+    result['Changed'] = ( entry == None ) or ( entry['SHA256'] != result['SHA256'] )
+    result['Entry'] = {'ETag' : result['ETag'], 'LastModified' : result['LastModified'], 'SHA256' : result['SHA256'], 'Size' : status.st_size, 'Modified' : status.st_mtime_ns}
+
+    return result
+
+# Download each (url,filename) pair in 'downloads' concurrently using up to 'workers'
+# threads. If 'cachedir' is given downloads are made through the cache in that directory.
+# Returns a list holding the download statistics or the 'DownloadError' of each download
+# in the order given.
+def DownloadFiles (downloads,workers,cachedir=None) :
+
+    "Download a list of files concurrently"
+
+    workers = max(1,min(workers,len(downloads)))
+    results = []
+
+    if ( cachedir != None ) :
+        os.makedirs(cachedir,exist_ok=True)
+        cache = LoadCache(cachedir)
+
+    with NewSession(max(workers,Segments)) as session :
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor :
+            if ( cachedir != None ) :
+                futures = [executor.submit(CachedDownload,session,cachedir,cache.get(url),url,filename) for url,filename in downloads]
+            else:
+                futures = [executor.submit(DownloadFile,session,url,filename) for url,filename in downloads]
+
+            for future in futures :
+                try:
+                    results.append(future.result())
+                except DownloadError as exception :
+                    results.append(exception)
+
+    # Record successful downloads in the cache. If any has changed the metadata is written
+    # to the pending file which replaces the metadata file once the lookup is regenerated.
+    if ( cachedir != None ) :
+        changed = False
+        for result in results :
+            if not ( isinstance(result,DownloadError) ) :
+                cache[result['Url']] = result['Entry']
+                changed = changed or result['Changed']
+
+        for metadatafilename in (Utils.CachePendingFilename,Utils.CachePreparedFilename) :
+            if ( os.path.exists(os.path.join(cachedir,metadatafilename)) ) : os.remove(os.path.join(cachedir,metadatafilename))
+        SaveCache(cachedir,cache,Utils.CachePendingFilename if ( changed ) else Utils.CacheMetadataFilename)
+
+    return results
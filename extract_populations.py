@@ -0,0 +1,201 @@
+# extract_populations.py
+#
+# Description
+# ===========
+#
+# This module extracts MSOA population data from the 'Mid-2019 Persons' sheet of the
+# ONS spreadsheet 'SAPE22DT4-mid-2019-msoa-syoa-estimates-unformatted.xlsx' without the
+# use of Excel. The spreadsheet is read as a zip archive and the sheet is parsed
+# incrementally a row at a time so memory use does not depend on the size of the sheet.
+# Only the shared string table of the spreadsheet is held in memory.
+#
+# The first 5 rows of the sheet are ignored and the following columns of each
+# remaining row are written as a csv line:
+#
+# <MSOA code (A)>,<MSOA name (B)>,<LA name 2020 (F)>,<All Ages population (G)>
+#
+# These are the fields described by configuration line 2 of 'generate_lookup.py'.
+#
+# Usage
+# =====
+#
+# The population data of a spreadsheet can be written as a csv file using:
+#
+# python extract_populations.py <xlsx file> <csv file>
+
+import csv
+import io
+import locale
+import posixpath
+import sys
+import zipfile
+import xml.etree.ElementTree as ElementTree
+
+# Sheet holding the population data
+SheetName = 'Mid-2019 Persons'
+
+# Number of title rows preceding the population data
+TitleRows = 5
+
+# Sheet columns written to the csv file
+PopulationColumns = [0,1,5,6]
+
+# Sheet row element tag
+RowTag = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}row'
+
+# Spreadsheet package member names
+WorkbookName = 'xl/workbook.xml'
+WorkbookRelationshipsName = 'xl/_rels/workbook.xml.rels'
+
+# Return the name of XML element tag 'tag' without its namespace
+def LocalName (tag) :
+
+    "Return the name of an XML element tag without its namespace"
+
+    return tag.rpartition('}')[2]
+
+# Return the zero based column position of cell reference 'reference' e.g. 'AB12'
+def ColumnPosition (reference) :
+
+    "Return the column position of a cell reference"
+
+    position = 0
+    for character in reference :
+        if not ( character.isalpha() ) : break
+        position = position * 26 + ord(character.upper()) - ord('A') + 1
+
+    return position - 1
+
+# Return the text held by the 't' and rich text run elements of element 'element'.
+# Phonetic runs are ignored.
+def ElementText (element) :
+
+    "Return the text held by an element"
+
+    text = []
+    for child in element :
+        name = LocalName(child.tag)
+        if ( name == 't' ) : text.append(child.text or '')
+        elif ( name in ('r','is') ) : text.append(ElementText(child))
+
+    return ''.join(text)
+
+# Return the package member names of the sheet named 'sheetname' and the shared
+# string table of the spreadsheet opened as zip file 'archive'
+def SheetMembers (archive,sheetname) :
+
+    "Return the member names of a sheet and the shared string table"
+
+    targets = {}
+    sharedstringsname = None
+    for relationship in ElementTree.fromstring(archive.read(WorkbookRelationshipsName)) :
+        target = relationship.get('Target')
+        target = target.lstrip('/') if ( target.startswith('/') ) else posixpath.normpath(posixpath.join('xl',target))
+        targets[relationship.get('Id')] = target
+        if ( relationship.get('Type','').endswith('/sharedStrings') ) : sharedstringsname = target
+
+    for element in ElementTree.fromstring(archive.read(WorkbookName)).iter() :
+        if ( LocalName(element.tag) == 'sheet' ) and ( element.get('name') == sheetname ) :
+            for attribute,value in element.items() :
+                if ( LocalName(attribute) == 'id' ) : return targets[value],sharedstringsname
+
+    raise KeyError('Sheet %s not found' % sheetname)
+
+# Return the list of shared strings held in member 'membername' of zip file 'archive'
+def SharedStrings (archive,membername) :
+
+    "Return the shared string table"
+
+    strings = []
+    if ( membername == None ) : return strings
+
+    with archive.open(membername) as fileobject :
+        for event,element in ElementTree.iterparse(fileobject) :
+            if ( LocalName(element.tag) == 'si' ) :
+                strings.append(ElementText(element))
+                element.clear()
+
+    return strings
+
+# Return the display value of cell element 'cell' using the shared string table 'strings'
+def CellValue (cell,strings) :
+
+    "Return the value of a cell"
+
+    celltype = cell.get('t','n')
+    if ( celltype == 'inlineStr' ) : return ElementText(cell)
+
+    value = None
+    for child in cell :
+        if ( LocalName(child.tag) == 'v' ) : value = child.text or ''
+    if ( value == None ) : return ''
+
+    if ( celltype == 's' ) : return strings[int(value)]
+    if ( celltype == 'b' ) : return 'TRUE' if ( value == '1' ) else 'FALSE'
+    if ( celltype == 'n' ) :
+        number = float(value)
+        if ( number.is_integer() ) : return str(int(number))
+
+    return value
+
+# Return a generator of (row number,cell values) tuples for the rows of the sheet
+# named 'sheetname' of the spreadsheet read from binary file object 'fileobject'.
+# Only the first 'columncount' cells of each row are returned and missing cells are
+# returned as empty strings.
+def SheetRows (fileobject,sheetname,columncount) :
+
+    "Return a generator of the rows of a sheet"
+
+    with zipfile.ZipFile(fileobject) as archive :
+        sheetmembername,sharedstringsname = SheetMembers(archive,sheetname)
+        strings = SharedStrings(archive,sharedstringsname)
+
+        with archive.open(sheetmembername) as sheetfileobject :
+            rownumber = 0
+            for event,element in ElementTree.iterparse(sheetfileobject) :
+                if ( element.tag != RowTag ) : continue
+
+                rownumber = int(element.get('r',rownumber + 1))
+                values = []
+                for cell in element :
+                    reference = cell.get('r')
+                    position = len(values) if ( reference == None ) else ColumnPosition(reference)
+                    if ( position >= columncount ) : break
+                    values.extend([''] * (position - len(values)))
+                    values.append(CellValue(cell,strings))
+
+                # Release the cells of each row once parsed so memory use does not
+                # depend on the size of the sheet
+                element.clear()
+
+                yield rownumber,values
+
+# Return a generator of the encoded csv lines of population data held in the
+# spreadsheet read from binary file object 'fileobject'
+def PopulationLines (fileobject,encoding=None) :
+
+    "Return a generator of csv lines of population data"
+
+    encoding = encoding or locale.getpreferredencoding(False)
+    line = io.StringIO()
+    writer = csv.writer(line,lineterminator='\r\n')
+
+    for rownumber,values in SheetRows(fileobject,SheetName,PopulationColumns[-1] + 1) :
+        if ( rownumber <= TitleRows ) or ( len(values) == 0 ) : continue
+        values.extend([''] * (PopulationColumns[-1] + 1 - len(values)))
+
+        line.seek(0)
+        line.truncate()
+        writer.writerow([values[column] for column in PopulationColumns])
+        yield line.getvalue().encode(encoding,'replace')
+
+# Write the population data of a spreadsheet as a csv file
+if ( __name__ == '__main__' ) :
+
+    if ( len(sys.argv) != 3 ) :
+        print('Usage: python extract_populations.py <xlsx file> <csv file>')
+        sys.exit(1)
+
+    with open(sys.argv[1],'rb') as XlsxFile :
+        with open(sys.argv[2],'wb') as CsvFile :
+            CsvFile.writelines(PopulationLines(XlsxFile))
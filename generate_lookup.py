@@ -10,17 +10,25 @@
 # 
 # <Post code>,<MSOA name><MSOA code>,<MSOA population>,<LTLA name><LTLA code>,<LTLA population>
 #
-# File 'lookup_data.csv' can be searched using 'findstr' to determine the 
+# File 'lookup_data.csv' can be searched using 'lookup_postcode.py' to determine the 
 # LTLA in which a postocode resides which maybe required when looking up data
 # provided at an LTLA level on the government's COVID-19 portal at the address below
-# A compressed version of this data file 'lookup_data.zip' is also generated to
-# make distribution of this large file easier. 
+# An index file 'lookup_data.idx' used by 'lookup_postcode.py' is generated alongside
+# 'lookup_data.csv' as is file 'lookup_data.bin' which holds the same rows in a compact 
+# dictionary encoded form (see 'compact_lookup.py'). Outcode index file 'lookup_data.outcodes'
+# records the rows, MSOAs and LTLAs of the postcodes of each outcode (see 'outcode_index.py')
+# and area index file 'lookup_data.areas' records the postcodes of each MSOA and LTLA
+# (see 'area_index.py').
+# A compressed version of this data file 'lookup_data.csv.gz' is also written as the rows
+# are generated to make distribution of this large file easier. It consists of independently
+# compressed blocks so that a postcode may be looked up by decompressing a single block
+# using block index file 'lookup_data.gzi' (see 'block_lookup.py'). 
 #
 # https://coronavirus.data.gov.uk/
 #
 # Example:
 #
-# findstr /C:"BN14 0BH" lookup_data.csv
+# python lookup_postcode.py "BN14 0BH"
 # 
 # Gives the following output.
 #
@@ -32,11 +40,64 @@
 # This script requires no command line arguments and can be invoked as follows:
 #
 # python generate_lookup.py
-# 
+#
+# The postcode file may be processed in parallel by a number of worker processes
+# as follows:
+#
+# python generate_lookup.py --workers <number of worker processes>
+#
+# In this mode the postcode file is split into shards aligned to line boundaries which are
+# processed concurrently and the resulting lookup rows are written in the original order.
+# A value of 0 uses one worker process per CPU. 
+#
+# When a new postcode file differs from the previous one in only a small number of postcodes
+# the lookup files may be regenerated incrementally as follows:
+#
+# python generate_lookup.py --incremental
+#
+# In this mode the lines of the postcode file are grouped by postcode major part and a hash
+# of each group is recorded in manifest file 'lookup_data.manifest'. Rows are only generated
+# for groups whose hash has changed since the previous build and the rows of unchanged groups
+# are copied from the previous 'lookup_data.csv' and 'lookup_data.bin' files. The rows added,
+# removed and changed are written to delta file 'lookup_data.delta' as lines of the form:
+#
+# <Added|Removed|Changed>,<lookup row>
+#
+# If there is no previous incremental build or any MSOA or LTLA details or postcode field
+# positions have changed all rows are generated and no delta file is written.
+#
+# The wall clock and CPU time, rows processed, bytes read and written and peak memory of each
+# stage are written to metrics file .\log\generate_lookup_metrics.json (see 'metrics.py').
+# The run may also be profiled as follows:
+#
+# python generate_lookup.py [--metrics <metrics file>] [--profile <profile file>] [--trace-memory]
+#
+# The lookup may also be written to a SQLite database of postcode, MSOA and LTLA tables
+# (see 'sqlite_sink.py') as follows:
+#
+# python generate_lookup.py --sqlite <database file>
+#
+# The lookup rows may also be passed as they are generated to any number of sinks, each of which
+# writes them in its own format on a thread of its own (see 'sinks.py'), as follows:
+#
+# python generate_lookup.py --sink csv:<file> --sink ndjson:<file> --sink index:<file>
+#
+# Index file 'lookup_data.idx' is itself written by an index sink. The rows written, time taken
+# and rows per second of each sink are logged along with the time spent waiting for it.
+#
+# The lookup files are written to temporary '.part' files which replace the lookup files once
+# the run completes. A checkpoint recording the postcode file offset reached, the length of
+# each temporary file and the counts and invalid MSOAs so far is written to checkpoint file
+# 'lookup_data.checkpoint' after each segment or shard of the postcode file, at most once per
+# checkpoint interval (see 'checkpoint.py'). An interrupted run is continued from its last
+# checkpoint as follows:
+#
+# python generate_lookup.py --resume [--checkpoint-interval <seconds>]
+#
 # Data and configuration files
 # ============================
 #
-# This utility requires configuration file ..\config\generate_lookup.csv which contains 4 lines
+# This utility requires configuration file ..\config\generate_lookup.csv which contains at least 4 lines
 # each specifying the positions of a number of data fields in a csv input file. The format of the 
 # file is as follows:
 #
@@ -63,42 +124,91 @@
 # Code:0,Name:1
 # Postcode:2,AuthorityCode:9,MsoaCode:41
 #
+# Any number of further geographies held in columns of the postcode file, for example LSOA, ward
+# or region, may be added to each lookup row by adding a line for each as follows:
+#
+# Geography:<name>,Column:<position of code field in postcode_data.csv>[,File:<dimension file>,Code:<position of code field>,Name:<position of name field>[,Population:<position of population field>]]
+#
+# e.g. Geography:LSOA,Column:34,File:lsoa_names.csv,Code:0,Name:1
+#
+# All geographies are resolved in the same single pass of the postcode file. The fields of each
+# geography follow the LTLA fields of each row in the order of the configuration file as
+# ,<Name>,<Code>,<Population> for geographies with a dimension file in the data directory, with
+# the name and population left empty for codes which are not in the dimension file, or ,<Code>
+# otherwise. Compact lookup file 'lookup_data.bin' holds the MSOA and LTLA fields only.
+#
 # Logging
 # =======
 #
 # This script logs error and status messages to the file .\log\log.txt an to the user console.
+# Messages are written on a background thread ( see 'log_writer.py' ). Only the first invalid
+# MSOAs are shown on the console but all are written to the log file. Messages may also be
+# written as JSON lines as follows:
+#
+# python generate_lookup.py --json-log <file>
 
-import calendar
-from datetime import date,timedelta
+import argparse
+import concurrent.futures
+import hashlib
+import io
+import itertools
+import json
+import locale
 import os
-import re
-import subprocess
-import sys
-import time
-from uk_covid19 import Cov19API
+import shutil
+import area_index as Areas
+import block_lookup as Blocks
+import checkpoint as Checkpoint
+import compact_lookup as Compact
+import log_writer as LogWriter
+import lookup_tables as Tables
+import outcode_index as Outcodes
+import metrics as Metrics
+import postcode_codec as Codec
+import postcode_index as Index
+import sinks as Sinks
+import sqlite_sink as Sqlite
 import utils as Utils
 
-############
-### MAIN ###
-############
-
 # File names and modes
 Currentdir = os.getcwd()
-LogDir = Currentdir + '\\log'
-ErrorFilename = LogDir + '\\' + 'log.txt'
-DataDir = Currentdir + '\\data'
-ConfigDir = Currentdir + '\\config'
-ConfigurationFilename = ConfigDir + '\\' + 'generate_lookup.csv'
-AuthoritiesFilename = DataDir + '\\' + 'authority_data.csv'
-PopulationFilename = DataDir + '\\' + 'msoa_populations.csv'
-PostcodeFilename = DataDir + '\\' + 'postcode_data.csv'
-MsoasFilename = DataDir + '\\' + 'msoa_names.csv'
-LookupFilename = DataDir + '\\' + 'lookup_data.csv'
+LogDir = os.path.join(Currentdir,'log')
+ErrorFilename = os.path.join(LogDir,'log.txt')
+MetricsFilename = os.path.join(LogDir,'generate_lookup_metrics.json')
+DataDir = os.path.join(Currentdir,'data')
+ConfigDir = os.path.join(Currentdir,'config')
+ConfigurationFilename = os.path.join(ConfigDir,'generate_lookup.csv')
+AuthoritiesFilename = os.path.join(DataDir,'authority_data.csv')
+PopulationFilename = os.path.join(DataDir,'msoa_populations.csv')
+PostcodeFilename = os.path.join(DataDir,'postcode_data.csv')
+MsoasFilename = os.path.join(DataDir,'msoa_names.csv')
+LookupFilename = os.path.join(DataDir,'lookup_data.csv')
+IndexFilename = os.path.join(DataDir,'lookup_data.idx')
+OutcodeFilename = os.path.join(DataDir,'lookup_data.outcodes')
+AreaFilename = os.path.join(DataDir,'lookup_data.areas')
+BlockFilename = os.path.join(DataDir,'lookup_data.csv.gz')
+BlockIndexFilename = os.path.join(DataDir,'lookup_data.gzi')
+CompactFilename = os.path.join(DataDir,'lookup_data.bin')
+ManifestFilename = os.path.join(DataDir,'lookup_data.manifest')
+DeltaFilename = os.path.join(DataDir,'lookup_data.delta')
+CheckpointFilename = os.path.join(DataDir,'lookup_data.checkpoint')
+CacheDir = os.path.join(Currentdir,'cache')
 append = 'a'
 read = 'r'
+readbinary = 'rb'
 overwrite = 'w'
 overwritebinary = 'wb'
 
+# Lookup file output buffering
+BufferSize = 1048576
+BatchSize = 10000
+
+# Number of shards processed by each worker process in parallel mode
+ShardsPerWorker = 4
+
+# Size in bytes of the segments of the postcode file processed between checkpoints
+SegmentSize = 8388608
+
 # Function return values
 invalid = failure = 0
 empty = ''
@@ -112,308 +222,1072 @@ info = 'INFO'
 # Script names
 module = 'generate_lookup.py'
 
-# Create/open log file
-ErrorFileObject = Utils.Open(ErrorFilename,append,failure)
-ErrorMessage = 'Could not open ' + ErrorFilename
-if ( ErrorFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+# Tables used by shard worker processes
+ShardTables = {}
 
-# Log start of script
-Utils.Logerror(ErrorFileObject,module,'Started',info)
+# Reads configuration file 'configurationfilename' and returns the field positions
+# of the MSOA names, MSOA populations, authorities and postcode files and the
+# declarations of any further geographies.
+def ReadConfiguration (configurationfilename,errorfileobject) :
 
-# Log progress messages
-ErrorMessage = 'Reading configuration file %s ' % ConfigurationFilename
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+    "Reads the field positions defined in configuration file 'configurationfilename'"
 
-# Open and parse configuration file
-ConfigurationFileObject = Utils.Open(ConfigurationFilename,read,failure)
-ErrorMessage = 'Could not open configuration file ' + ConfigurationFilename
-if ( ConfigurationFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+    # Open and parse configuration file
+    ConfigurationFileObject = Utils.Open(configurationfilename,read,failure)
+    ErrorMessage = 'Could not open configuration file ' + configurationfilename
+    if ( ConfigurationFileObject == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,error)
 
-ConfigurationData = Utils.Read(ConfigurationFileObject,failure)
-ErrorMessage = 'Could not read data in ' + ConfigurationFilename
-if ( ConfigurationFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+    ConfigurationData = Utils.Read(ConfigurationFileObject,failure)
+    ErrorMessage = 'Could not read data in ' + configurationfilename
+    if ( ConfigurationFileObject == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,error)
 
-ConfigurationDataLines = ConfigurationData.splitlines()
-if ( len(ConfigurationDataLines) != 4 ) :
-    ErrorMessage = 'Configuration file %s does not consist of exactly 4 lines ' % ConfigurationFilename
-    Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+    ConfigurationDataLines = ConfigurationData.splitlines()
+    if ( len(ConfigurationDataLines) < 4 ) :
+        ErrorMessage = 'Configuration file %s does not consist of at least 4 lines ' % configurationfilename
+        Utils.Logerror(errorfileobject,module,ErrorMessage,error)
 
-ConfigurationLineCount = 1   
-for ConfigurationDataLine in ConfigurationDataLines :
-    if ( len(ConfigurationDataLine) == 0 ) :
-        ErrorMessage = 'Configuration line %d in %s is empty ' % (ConfigurationLineCount,ConfigurationFilename)
-        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+    ConfigurationLineCount = 1   
+    for ConfigurationDataLine in ConfigurationDataLines :
+        if ( len(ConfigurationDataLine) == 0 ) :
+            ErrorMessage = 'Configuration line %d in %s is empty ' % (ConfigurationLineCount,configurationfilename)
+            Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+            
+        ConfigurationLineCount += 1
+
+    # Read field positions  
+    MsoasFileFields = Utils.ReturnPositions(ConfigurationDataLines[0])
+    PopulationFields = Utils.ReturnPositions(ConfigurationDataLines[1])
+    AuthoritiesFields = Utils.ReturnPositions(ConfigurationDataLines[2])
+    PostcodeFields = Utils.ReturnPositions(ConfigurationDataLines[3])
+
+    # Read further geography declarations
+    GeographyFields = []
+    for ConfigurationLineCount,ConfigurationDataLine in enumerate(ConfigurationDataLines[4:],5) :
+        Fields = Utils.ReturnPositions(ConfigurationDataLine)
+        if not ( isinstance(Fields.get('Geography'),str) and isinstance(Fields.get('Column'),int) ) :
+            ErrorMessage = 'Configuration line %d in %s does not give a Geography name and Column position ' % (ConfigurationLineCount,configurationfilename)
+            Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+        if ( 'File' in Fields ) and not ( isinstance(Fields.get('Code'),int) and isinstance(Fields.get('Name'),int) ) :
+            ErrorMessage = 'Configuration line %d in %s does not give the Code and Name positions of %s ' % (ConfigurationLineCount,configurationfilename,Fields['File'])
+            Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+        GeographyFields.append(Fields)
+
+    # Close Configuration file
+    ErrorMessage = 'Could not close ' + configurationfilename
+    if ( Utils.Close(ConfigurationFileObject,failure) == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,warning)
+
+    return MsoasFileFields,PopulationFields,AuthoritiesFields,PostcodeFields,GeographyFields
+
+# Reads authorities file 'authoritiesfilename' and returns a table of the authorities
+# ( see 'lookup_tables.py' ).
+def LoadAuthorities (authoritiesfilename,authoritiesfields,errorfileobject) :
+
+    "Reads the authorities defined in 'authoritiesfilename'"
+
+    # Open and parse authorities file
+    AuthoritiesFileObject = Utils.Open(authoritiesfilename,read,failure)
+    ErrorMessage = 'Could not open configuration file ' + authoritiesfilename
+    if ( AuthoritiesFileObject == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+
+    # Read authorities file
+    AuthoritiesFileData = Utils.Read(AuthoritiesFileObject,empty)
+    if ( AuthoritiesFileData != empty ) : 
+        AuthoritiesFileDataLines = AuthoritiesFileData.splitlines()
+    else:
+        ErrorMessage = 'No data in ' + authoritiesfilename
+        Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+
+    # Build authorities structure
+    Authorities = Tables.Table()
+
+    for AuthoritiesFileDataLine in AuthoritiesFileDataLines :
+        Data = Utils.ReturnData(AuthoritiesFileDataLine)
         
-    ConfigurationLineCount += 1
-
-# Read field positions  
-MsoasFileFields = Utils.ReturnPositions(ConfigurationDataLines[0])
-PopulationFields = Utils.ReturnPositions(ConfigurationDataLines[1])
-AuthoritiesFields = Utils.ReturnPositions(ConfigurationDataLines[2])
-PostcodeFields = Utils.ReturnPositions(ConfigurationDataLines[3])
-
-# Close Configuration file
-ErrorMessage = 'Could not close ' + ConfigurationFilename
-if ( Utils.Close(ConfigurationFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
-
-# Log progress messages
-ErrorMessage = 'Reading configuration file %s ' % AuthoritiesFilename
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-
-# Open and parse authorities file
-AuthoritiesFileObject = Utils.Open(AuthoritiesFilename,read,failure)
-ErrorMessage = 'Could not open configuration file ' + AuthoritiesFilename
-if ( AuthoritiesFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Read authorities file
-AuthoritiesFileData = Utils.Read(AuthoritiesFileObject,empty)
-if ( AuthoritiesFileData != empty ) : 
-    AuthoritiesFileDataLines = AuthoritiesFileData.splitlines()
-else:
-    ErrorMessage = 'No data in ' + AuthoritiesFilename
-    Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-if ( Utils.Close(AuthoritiesFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
-
-# Build authorities structure
-Authorities = {}
-AuthorityCodes = {}
-AuthorityData = {}
-
-for AuthoritiesFileDataLine in AuthoritiesFileDataLines :
-    Data = Utils.ReturnData(AuthoritiesFileDataLine)
-    
-    # Build Authorities structure
-    #
-    # Key:   String Authority name.
-    #
-    # Value: Dictionary 
-    #
-    # Code:         Authority code
-    # Name:         Authority name
-    # Population:   Authority population
-    
-    # Build AuthorityCodes structure
-    #
-    # Key:   String Authority code.
-    #
-    # Value: Dictionary 
-    #
-    # Code:         Authority code
-    # Name:         Authority name
-    # Population:   Authority population
-    
-    AuthorityCode = Data[AuthoritiesFields['Code']]
-    AuthorityData['Code'] = AuthorityCode
-    AuthorityName = Data[AuthoritiesFields['Name']]
-    AuthorityData['Name'] = AuthorityName
-    AuthorityData['Population'] = 0
-    Authorities[AuthorityName] = AuthorityData
-    AuthorityCodes[AuthorityCode] = AuthorityData
-    AuthorityData = {}
-
-# Close Authorities file
-ErrorMessage = 'Could not close ' + AuthoritiesFilename
-if ( Utils.Close(AuthoritiesFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
-
-# Log progress messages
-ErrorMessage = 'Reading configuration files %s and %s ' % (PopulationFilename,MsoasFilename)
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-
-# Open population file
-PopulationFileObject = Utils.Open(PopulationFilename,read,failure)
-ErrorMessage = 'Could not open configuration file ' + PopulationFilename
-if ( PopulationFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Open msoas file
-MsoasFileObject = Utils.Open(MsoasFilename,read,failure)
-ErrorMessage = 'Could not open configuration file ' + MsoasFilename
-if ( MsoasFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Read and parse population and MSOA files.
-PopulationFileDataLine = Utils.Readline(PopulationFileObject,empty)
-Errormessage = 'No data in ' + PopulationFilename
-if ( PopulationFileDataLine == empty ) : File.Logerror(ErrorFileObject,module,Errormessage,error)
-
-MsoasFileDataLine = Utils.Readline(MsoasFileObject,empty)
-Errormessage = 'No data in ' + MsoasFilename
-if ( MsoasFileDataLine == empty ) : File.Logerror(ErrorFileObject,module,Errormessage,error)
-
-# Build MSOA structure
-Msoas = {}
-MsoaData = {}
-
-# Initiate population total count.
-NewAuthorityName = ''
-OldAuthorityName = ''
-NewTotalPopulation = 0
-OldTotalPopulation = 0
-
-while ( ( PopulationFileDataLine != empty ) and ( MsoasFileDataLine != empty ) ):
-    
-    PopulationData = Utils.ReturnData(PopulationFileDataLine)
-    NewAuthorityName = PopulationData[PopulationFields['Name']]  
-    
-    MsoasData = Utils.ReturnData(MsoasFileDataLine)
-       
-    # These files should consist of the same number of data lines in the
-    # same alphabetic order with resepct to the first data value of each line.
-    if ( PopulationData[PopulationFields['Code']] != MsoasData[MsoasFileFields['Code']] ) : 
-        ErrorMessage = 'the contents of %s and %s do not align' % (PopulationFilename,MsoasFilename)
-        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-       
-       
-    # Build Msoas structure
-    #
-    # Key:   String MSOA code.
-    #
-    # Value: Dictionary 
-    #
-    # Code:         MSOA code
-    # Name:         MSOA name
-    # Population:   MSOA population
-    # Authority:    MSOA local authority name
-    
-    MsoaCode = MsoasData[MsoasFileFields['Code']]
-    MsoaData['Code'] = MsoaCode
-    MsoaData['Name'] = MsoasData[MsoasFileFields['Name']]
-    MsaoPopulationString = PopulationData[PopulationFields['Population']].replace(',','')
-    MsaoPopulation = int(MsaoPopulationString)
-    MsoaData['Population'] = MsaoPopulation
-    MsoaData['Authority'] = NewAuthorityName
-    Msoas[MsoaCode] = MsoaData
-    MsoaData = {}
-    
-    # Derive population totals
-    if ( NewAuthorityName == OldAuthorityName ) or ( OldAuthorityName == '' ):
-        NewTotalPopulation = NewTotalPopulation + MsaoPopulation
-    else :
-    
-        # MSOA's for some authorities do not have consecutive MSOA codes
-        # so following is required.
-        if ( OldAuthorityName in Authorities.keys() ) :
-            Authorities[OldAuthorityName]['Population'] = Authorities[OldAuthorityName]['Population'] + OldTotalPopulation
-        else:
-            Authorities[OldAuthorityName]['Population'] = OldTotalPopulation
-                
-        NewTotalPopulation = MsaoPopulation
+        # Build Authorities table
+        #
+        # Id:           Position of authority in table
+        #
+        # codes:        Authority code
+        # names:        Authority name
+        # populations:  Authority population derived from MSOA populations
         
-    OldAuthorityName = NewAuthorityName
-    OldTotalPopulation = NewTotalPopulation
-    
+        Authorities.Add(Data[authoritiesfields['Code']],Data[authoritiesfields['Name']],0)
+
+    # Close Authorities file
+    ErrorMessage = 'Could not close ' + authoritiesfilename
+    if ( Utils.Close(AuthoritiesFileObject,failure) == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,warning)
+
+    return Authorities
+
+# Reads population file 'populationfilename' and MSOA names file 'msoasfilename' and
+# returns a table of the MSOAs ( see 'lookup_tables.py' ). Authority populations in
+# table 'authorities' are derived from the MSOA populations.
+def LoadMsoas (populationfilename,msoasfilename,populationfields,msoasfilefields,authorities,errorfileobject) :
+
+    "Reads the MSOAs defined in 'populationfilename' and 'msoasfilename'"
+
+    # Open population file
+    PopulationFileObject = Utils.Open(populationfilename,read,failure)
+    ErrorMessage = 'Could not open configuration file ' + populationfilename
+    if ( PopulationFileObject == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+
+    # Open msoas file
+    MsoasFileObject = Utils.Open(msoasfilename,read,failure)
+    ErrorMessage = 'Could not open configuration file ' + msoasfilename
+    if ( MsoasFileObject == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+
+    # Read and parse population and MSOA files.
     PopulationFileDataLine = Utils.Readline(PopulationFileObject,empty)
+    ErrorMessage = 'No data in ' + populationfilename
+    if ( PopulationFileDataLine == empty ) : Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+
     MsoasFileDataLine = Utils.Readline(MsoasFileObject,empty)
+    ErrorMessage = 'No data in ' + msoasfilename
+    if ( MsoasFileDataLine == empty ) : Utils.Logerror(errorfileobject,module,ErrorMessage,error)
 
-# Close population file
-ErrorMessage = 'Could not close ' + PopulationFilename
-if ( Utils.Close(PopulationFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
-
-# Close msoas file
-ErrorMessage = 'Could not close ' + MsoasFilename
-if ( Utils.Close(MsoasFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
-
-# Log progress messages
-ErrorMessage = 'Reading configuration files %s ' % PostcodeFilename
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-
-# Open postcode file
-PostcodeFileObject = Utils.Open(PostcodeFilename,read,failure)
-ErrorMessage = 'Could not open configuration file ' + PostcodeFilename
-if ( PostcodeFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Open lookup file
-LookupFileObject = Utils.Open(LookupFilename,overwrite,failure)
-ErrorMessage = 'Could not open configuration file ' + LookupFilename
-if ( LookupFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Read and parse postcode file.
-PostcodeFileDataLine = Utils.Readline(PostcodeFileObject,empty)
-Errormessage = 'No data in ' + PostcodeFilename
-if ( PostcodeFileDataLine == empty ) : File.Logerror(ErrorFileObject,module,Errormessage,error)
-
-# Log progress messages
-ErrorMessage = 'Generating lookup file %s ' % LookupFilename
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-
-# Track invalid Post codes / MSOA codes
-InvalidMsoas = {}
-InvalidData = []
-PostcodeCount = 0
-PostcodeErrorCount = 0
-OldPostCodeMajorPart = ''
-PostCodeMajorPartCount = 0
-
-while ( PostcodeFileDataLine != empty ) :
-    
-    PostcodeData = Utils.ReturnData(PostcodeFileDataLine)
-    Postcode = PostcodeData[PostcodeFields['Postcode']]
-    
-    # Count major postcode parts. 
-    NewPostCodeMajorPart = Postcode.split()[0]
-    if ( NewPostCodeMajorPart != OldPostCodeMajorPart ) : PostCodeMajorPartCount +=1
-    OldPostCodeMajorPart = NewPostCodeMajorPart
+    # Build MSOA structure
+    Msoas = Tables.Table()
+
+    # Authorities are named in the population file
+    AuthorityIds = {Name : AuthorityId for AuthorityId,Name in enumerate(authorities.names)}
+
+    # Initiate population total count.
+    NewAuthorityName = ''
+    OldAuthorityName = ''
+    NewTotalPopulation = 0
+    OldTotalPopulation = 0
+
+    while ( ( PopulationFileDataLine != empty ) and ( MsoasFileDataLine != empty ) ):
         
-    AuthorityCode = PostcodeData[PostcodeFields['AuthorityCode']]
-    MsoaCode = PostcodeData[PostcodeFields['MsoaCode']]
-    
-    # Display progress message
-    PostcodeCount +=1 
-    if ( (PostcodeCount%100000) == 0 ) : 
-        ErrorMessage = '%d postcodes processed' % PostcodeCount
-        Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-       
-    
-    if not ( MsoaCode in Msoas.keys() ) : 
-        #ErrorMessage = 'The Post code %s has an invalid MSOA code %s defined ' % (Postcode,MsoaCode)
-        #Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+        PopulationData = Utils.ReturnData(PopulationFileDataLine)
+        NewAuthorityName = PopulationData[populationfields['Name']]  
         
-        PostcodeErrorCount += 1
+        MsoasData = Utils.ReturnData(MsoasFileDataLine)
+           
+        # These files should consist of the same number of data lines in the
+        # same alphabetic order with resepct to the first data value of each line.
+        if ( PopulationData[populationfields['Code']] != MsoasData[msoasfilefields['Code']] ) : 
+            ErrorMessage = 'the contents of %s and %s do not align' % (populationfilename,msoasfilename)
+            Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+           
+           
+        # Build Msoas table
+        #
+        # Id:           Position of MSOA in table
+        #
+        # codes:        MSOA code
+        # names:        MSOA name
+        # populations:  MSOA population
         
-        if MsoaCode in InvalidMsoas.keys() :
-            InvalidMsoas[MsoaCode].append(Postcode)
-        else:
-            InvalidData = [Postcode]
-            InvalidMsoas[MsoaCode] = InvalidData
-            InvalidData = []
-            
-    else :
-        OutputRow = [Postcode,Msoas[MsoaCode]['Name'],Msoas[MsoaCode]['Code'],Msoas[MsoaCode]['Population'],AuthorityCodes[AuthorityCode]['Name'],AuthorityCodes[AuthorityCode]['Code'],AuthorityCodes[AuthorityCode]['Population']]
-        PostCodeDataLine = Utils.GenerateCSVRow(OutputRow)
+        MsaoPopulationString = PopulationData[populationfields['Population']].replace(',','')
+        MsaoPopulation = int(MsaoPopulationString)
+        Msoas.Add(MsoasData[msoasfilefields['Code']],MsoasData[msoasfilefields['Name']],MsaoPopulation)
         
-        ErrorMessage = 'Could not write line %s to %s' % (PostCodeDataLine,LookupFilename)
-        if ( Utils.Writeline(LookupFileObject,PostCodeDataLine,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+        # Derive population totals
+        if ( NewAuthorityName == OldAuthorityName ) or ( OldAuthorityName == '' ):
+            NewTotalPopulation = NewTotalPopulation + MsaoPopulation
+        else :
+        
+            # MSOA's for some authorities do not have consecutive MSOA codes
+            # so following is required.
+            authorities.populations[AuthorityIds[OldAuthorityName]] += OldTotalPopulation
+                    
+            NewTotalPopulation = MsaoPopulation
             
+        OldAuthorityName = NewAuthorityName
+        OldTotalPopulation = NewTotalPopulation
         
-    PostcodeFileDataLine = Utils.Readline(PostcodeFileObject,empty)
-    
-# Output statistics.
-ErrorMessage = 'A total of %d postcodes were processed ' % PostcodeCount
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-ErrorMessage = 'A total of %d postcodes with non-existent MSOA\'s were found ' % PostcodeErrorCount
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
-
-# Print invalid MSOA data
-for MsoaCode in InvalidMsoas :
-
-    # Pront MSOA code
-    ErrorMessage = 'MSOA %s was invalid and associated with the following postcodes' % MsoaCode
+        PopulationFileDataLine = Utils.Readline(PopulationFileObject,empty)
+        MsoasFileDataLine = Utils.Readline(MsoasFileObject,empty)
+
+    # Close population file
+    ErrorMessage = 'Could not close ' + populationfilename
+    if ( Utils.Close(PopulationFileObject,failure) == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,warning)
+
+    # Close msoas file
+    ErrorMessage = 'Could not close ' + msoasfilename
+    if ( Utils.Close(MsoasFileObject,failure) == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,warning)
+
+    return Msoas
+
+# Reads the dimension files of the geographies declared by 'geographyfields' ( see
+# 'ReadConfiguration' ) from directory 'datadir' and returns a list of the geographies.
+# Each geography holds the position of its code in the postcode file lines and the table
+# of its dimension file with the csv fields rendered for each code of the table. Codes which are not in the
+# dimension file or of geographies without one are rendered by 'Missing'.
+def LoadGeographies (geographyfields,datadir,errorfileobject) :
+
+    "Reads the dimension files of the geographies declared in the configuration file"
+
+    Geographies = []
+
+    for Fields in geographyfields :
+        Geography = {'Name' : Fields['Geography'], 'Column' : Fields['Column'], 'Table' : None, 'Suffixes' : {}, 'Missing' : ',%s'}
+
+        if ( 'File' in Fields ) :
+            DimensionFilename = os.path.join(datadir,Fields['File'])
+            DimensionFileObject = Utils.Open(DimensionFilename,read,failure)
+            ErrorMessage = 'Could not open configuration file ' + DimensionFilename
+            if ( DimensionFileObject == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+
+            # Build geography table
+            Table = Tables.Table()
+            for DimensionFileDataLine in DimensionFileObject :
+                Data = Utils.ReturnData(DimensionFileDataLine)
+                Population = Data[Fields['Population']].replace(',','').strip() if ( 'Population' in Fields ) else ''
+                Table.Add(Data[Fields['Code']],Data[Fields['Name']],int(Population) if ( Population.isdigit() ) else 0)
+
+            # Close dimension file
+            ErrorMessage = 'Could not close ' + DimensionFilename
+            if ( Utils.Close(DimensionFileObject,failure) == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,warning)
+
+            Geography['Table'] = Table
+            Geography['Suffixes'] = dict(zip(Table.codes,Table.Render(',','')))
+            Geography['Missing'] = ',,%s,'
+
+        Geographies.append(Geography)
+
+    return Geographies
+
+# Returns the csv fields of each MSOA and authority pre-rendered once rather
+# than for every postcode. Each list is indexed by table id. The authority fields
+# end the row unless there are further geographies 'geographies'.
+def RenderSuffixes (msoas,authorities,geographies=()) :
+
+    "Returns the pre-rendered csv fields of each MSOA and authority"
+
+    return msoas.Render(',',''),authorities.Render(',','' if ( len(geographies) > 0 ) else '\n')
+
+# Return a generator of 'lookup_data.csv' rows for the postcode file lines 'lines'.
+# Postcodes with an MSOA code which is not in table 'msoas' are recorded in
+# 'invalidmsoas' and counts are maintained in 'statistics'. Progress messages are
+# logged to 'errorfileobject' if it is given. The fields of further geographies
+# 'geographies' ( see 'LoadGeographies' ) follow the authority fields of each row.
+def GenerateRows (lines,postcodefields,msoas,authorities,msoasuffixes,authoritysuffixes,compactfileobject,invalidmsoas,statistics,errorfileobject=None,geographies=()) :
+
+    "Return a generator of lookup rows for the postcode file lines 'lines'"
+
+    PostcodePosition = postcodefields['Postcode']
+    AuthorityCodePosition = postcodefields['AuthorityCode']
+    MsoaCodePosition = postcodefields['MsoaCode']
+    MsoaIds = msoas.index
+    AuthorityIds = authorities.index
+    Geographies = [(Geography['Column'],Geography['Suffixes'],Geography['Missing']) for Geography in geographies]
+    OldPostCodeMajorPart = ''
+
+    for PostcodeFileDataLine in lines :
+
+        PostcodeData = Utils.ReturnData(PostcodeFileDataLine)
+        Postcode = PostcodeData[PostcodePosition]
+
+        # Count major postcode parts.
+        NewPostCodeMajorPart = Postcode.split()[0]
+        if ( NewPostCodeMajorPart != OldPostCodeMajorPart ) : statistics['PostCodeMajorPartCount'] += 1
+        if ( statistics['PostcodeCount'] == 0 ) : statistics['FirstPostCodeMajorPart'] = NewPostCodeMajorPart
+        OldPostCodeMajorPart = NewPostCodeMajorPart
+
+        AuthorityCode = PostcodeData[AuthorityCodePosition]
+        MsoaCode = PostcodeData[MsoaCodePosition]
+
+        # Display progress message
+        statistics['PostcodeCount'] += 1
+        if ( (statistics['PostcodeCount']%100000) == 0 ) and ( errorfileobject != None ) :
+            ErrorMessage = '%d postcodes processed' % statistics['PostcodeCount']
+            Utils.Logerror(errorfileobject,module,ErrorMessage,info)
+
+        MsoaId = MsoaIds.get(MsoaCode)
+        if ( MsoaId == None ) :
+            statistics['PostcodeErrorCount'] += 1
+
+            if MsoaCode in invalidmsoas :
+                invalidmsoas[MsoaCode].append(Postcode)
+            else:
+                invalidmsoas[MsoaCode] = [Postcode]
+
+        else :
+            AuthorityId = AuthorityIds[AuthorityCode]
+            compactfileobject.Write(Postcode,MsoaId,AuthorityId)
+            if ( len(Geographies) == 0 ) :
+                yield Postcode + msoasuffixes[MsoaId] + authoritysuffixes[AuthorityId]
+            else:
+                GeographyFields = [Suffixes.get(PostcodeData[Column]) or Missing % PostcodeData[Column] for Column,Suffixes,Missing in Geographies]
+                yield Postcode + msoasuffixes[MsoaId] + authoritysuffixes[AuthorityId] + ''.join(GeographyFields) + '\n'
+
+    statistics['LastPostCodeMajorPart'] = OldPostCodeMajorPart
+
+# Return a new set of postcode counts
+def NewStatistics () :
+
+    "Return a new set of postcode counts"
+
+    return {'PostcodeCount' : 0, 'PostcodeErrorCount' : 0, 'PostCodeMajorPartCount' : 0, 'FirstPostCodeMajorPart' : '', 'LastPostCodeMajorPart' : ''}
+
+# Adds the counts 'partstatistics' and invalid MSOAs 'partinvalidmsoas' of a part of
+# the postcode file to those of the postcode file parts preceding it.
+def MergeStatistics (statistics,partstatistics,invalidmsoas,partinvalidmsoas) :
+
+    "Adds the counts and invalid MSOAs of a part of the postcode file"
+
+    if ( statistics['PostcodeCount'] == 0 ) : statistics['FirstPostCodeMajorPart'] = partstatistics['FirstPostCodeMajorPart']
+    statistics['PostcodeCount'] += partstatistics['PostcodeCount']
+    statistics['PostcodeErrorCount'] += partstatistics['PostcodeErrorCount']
+    statistics['PostCodeMajorPartCount'] += partstatistics['PostCodeMajorPartCount']
+    if ( partstatistics['PostcodeCount'] > 0 ) :
+        if ( partstatistics['FirstPostCodeMajorPart'] == statistics['LastPostCodeMajorPart'] ) : statistics['PostCodeMajorPartCount'] -= 1
+        statistics['LastPostCodeMajorPart'] = partstatistics['LastPostCodeMajorPart']
+
+    for MsoaCode in partinvalidmsoas :
+        if MsoaCode in invalidmsoas :
+            invalidmsoas[MsoaCode].extend(partinvalidmsoas[MsoaCode])
+        else:
+            invalidmsoas[MsoaCode] = list(partinvalidmsoas[MsoaCode])
+
+# Generates the lookup rows of binary postcode file object 'postcodefileobject' from byte
+# offset 'start' and writes them to 'lookupfileobject'. The postcode file is read in segments
+# of about 'SegmentSize' bytes ending at the end of a line and 'checkpoint' is saved after
+# each segment ( see 'checkpoint.py' ). The fields of geographies 'geographies' are
+# added to each row.
+def GenerateSequential (postcodefileobject,start,lookupfileobject,postcodefields,msoas,authorities,msoasuffixes,authoritysuffixes,geographies,compactfileobject,invalidmsoas,statistics,checkpoint,errorfileobject) :
+
+    "Generates the lookup rows of the postcode file in segments"
+
+    Encoding = locale.getpreferredencoding(False)
+    Offset = start
+    postcodefileobject.seek(start)
+
+    while True :
+        SegmentData = postcodefileobject.read(SegmentSize)
+        if ( len(SegmentData) == 0 ) : break
+        if not ( SegmentData.endswith(b'\n') ) : SegmentData += postcodefileobject.readline()
+        Offset += len(SegmentData)
+
+        SegmentStatistics = NewStatistics()
+        SegmentInvalidMsoas = {}
+        Lines = io.StringIO(SegmentData.decode(Encoding),newline=None)
+        LookupRows = GenerateRows(Lines,postcodefields,msoas,authorities,msoasuffixes,authoritysuffixes,compactfileobject,SegmentInvalidMsoas,SegmentStatistics,None,geographies)
+        if ( Utils.WriteLines(lookupfileobject,LookupRows,BatchSize,failure) == failure ) : raise OSError('Could not write lookup rows')
+
+        # Display progress message
+        Processed = statistics['PostcodeCount']
+        MergeStatistics(statistics,SegmentStatistics,invalidmsoas,SegmentInvalidMsoas)
+        if ( statistics['PostcodeCount'] // 100000 > Processed // 100000 ) :
+            ErrorMessage = '%d postcodes processed' % statistics['PostcodeCount']
+            Utils.Logerror(errorfileobject,module,ErrorMessage,info)
+
+        checkpoint.Save(Offset)
+
+# Return a list of (start,end) byte ranges which split file 'filename' from byte offset
+# 'start' into 'count' shards. Each shard starts at the beginning of a line.
+def ShardBoundaries (filename,count,start=0) :
+
+    "Return the byte ranges of 'count' shards of file 'filename'"
+
+    FileSize = os.path.getsize(filename)
+    Starts = [start]
+
+    with open(filename,readbinary) as FileObject :
+        for Shard in range(1,count) :
+            FileObject.seek(max(start + ( ( FileSize - start ) * Shard ) // count - 1,Starts[-1]))
+            FileObject.readline()
+            Starts.append(min(FileObject.tell(),FileSize))
+
+    Ends = Starts[1:] + [FileSize]
+
+    return [(Start,End) for Start,End in zip(Starts,Ends) if ( End > Start )]
+
+# Stores the tables used by 'ProcessShard' in each worker process
+def InitialiseShardWorker (postcodefields,msoas,authorities,geographies) :
+
+    "Stores the tables used by 'ProcessShard'"
+
+    ShardTables['PostcodeFields'] = postcodefields
+    ShardTables['Msoas'] = msoas
+    ShardTables['Authorities'] = authorities
+    ShardTables['Geographies'] = geographies
+    ShardTables['MsoaSuffixes'],ShardTables['AuthoritySuffixes'] = RenderSuffixes(msoas,authorities,geographies)
+
+# Generates the lookup rows for bytes 'start' to 'end' of postcode file 'postcodefilename'
+# and writes them to 'shardfilename'. Returns the compact lookup records, counts and
+# invalid MSOAs of the shard.
+def ProcessShard (postcodefilename,start,end,shardfilename) :
+
+    "Generates the lookup rows for one shard of the postcode file"
+
+    with open(postcodefilename,readbinary) as PostcodeFileObject :
+        PostcodeFileObject.seek(start)
+        ShardData = PostcodeFileObject.read(end - start).decode(locale.getpreferredencoding(False))
+
+    CompactRecords = Compact.CompactRecords()
+    InvalidMsoas = {}
+    Statistics = NewStatistics()
+
+    Lines = io.StringIO(ShardData,newline=None)
+    LookupRows = GenerateRows(Lines,ShardTables['PostcodeFields'],ShardTables['Msoas'],ShardTables['Authorities'],ShardTables['MsoaSuffixes'],ShardTables['AuthoritySuffixes'],CompactRecords,InvalidMsoas,Statistics,None,ShardTables['Geographies'])
+
+    with open(shardfilename,overwrite,BufferSize) as ShardFileObject :
+        if ( Utils.WriteLines(ShardFileObject,LookupRows,BatchSize,failure) == failure ) : raise OSError('Could not write to ' + shardfilename)
+
+    return CompactRecords.Data(),Statistics,InvalidMsoas
+
+# Generates the lookup rows of postcode file 'postcodefilename' from byte offset 'start'
+# using 'workers' processes and writes them to 'lookupfileobject' in the original order.
+# 'checkpoint' is saved after each shard is written ( see 'checkpoint.py' ).
+def GenerateParallel (postcodefilename,start,lookupfilename,lookupfileobject,workers,postcodefields,msoas,authorities,geographies,compactfileobject,invalidmsoas,statistics,checkpoint,errorfileobject) :
+
+    "Generates the lookup rows of the postcode file using a pool of worker processes"
+
+    Shards = ShardBoundaries(postcodefilename,workers * ShardsPerWorker,start)
+    ShardFilenames = ['%s.%d' % (lookupfilename,Shard) for Shard in range(len(Shards))]
+    InitialArguments = (postcodefields,msoas,authorities,geographies)
+
+    with concurrent.futures.ProcessPoolExecutor(workers,initializer=InitialiseShardWorker,initargs=InitialArguments) as Executor :
+        Results = Executor.map(ProcessShard,itertools.repeat(postcodefilename),[Start for Start,End in Shards],[End for Start,End in Shards],ShardFilenames)
+
+        for Shard,(CompactData,ShardStatistics,ShardInvalidMsoas) in enumerate(Results) :
+
+            # Append shard rows in the original order
+            lookupfileobject.flush()
+            with open(ShardFilenames[Shard],read,BufferSize) as ShardFileObject :
+                shutil.copyfileobj(ShardFileObject,lookupfileobject,BufferSize)
+            os.remove(ShardFilenames[Shard])
+            compactfileobject.WriteRecords(CompactData)
+
+            # Merge shard counts and invalid MSOAs
+            MergeStatistics(statistics,ShardStatistics,invalidmsoas,ShardInvalidMsoas)
+
+            ErrorMessage = 'Shard %d of %d processed, %d postcodes processed' % (Shard + 1,len(Shards),statistics['PostcodeCount'])
+            Utils.Logerror(errorfileobject,module,ErrorMessage,info)
+
+            checkpoint.Save(Shards[Shard][1])
+
+# Return a hash of the MSOA and authority codes, their rendered fields, the postcode
+# field positions and any further geographies. Rows of a previous build may only be
+# reused when this hash is unchanged.
+def TablesHash (postcodefields,msoas,authorities,msoasuffixes,authoritysuffixes,geographies=()) :
+
+    "Return a hash of the tables used to generate lookup rows"
+
+    Tables = [postcodefields,msoas.codes,msoasuffixes,authorities.codes,authoritysuffixes]
+    if ( len(geographies) > 0 ) : Tables.append([[Geography['Name'],Geography['Column'],sorted(Geography['Suffixes'].items()),Geography['Missing']] for Geography in geographies])
+    Digest = hashlib.sha256(json.dumps(Tables).encode('utf-8'))
+
+    return Digest.hexdigest()
+
+# Return the contents of manifest file 'manifestfilename' or an empty manifest
+def LoadManifest (manifestfilename) :
+
+    "Return the manifest of the previous build"
+
+    try:
+        with open(manifestfilename,read) as ManifestFileObject :
+            return json.load(ManifestFileObject)
+    except (OSError,ValueError) :
+        return {}
+
+# Write 'manifest' to manifest file 'manifestfilename'
+def SaveManifest (manifestfilename,manifest) :
+
+    "Write the manifest of the current build"
+
+    with open(manifestfilename + '.part',overwrite) as ManifestFileObject :
+        json.dump(manifest,ManifestFileObject)
+    os.replace(manifestfilename + '.part',manifestfilename)
+
+# Return a generator of (key,lines) tuples for each run of consecutive lines of binary
+# postcode file object 'postcodefileobject' sharing a postcode major part. The key is the
+# major part followed by its occurrence number if it is repeated.
+def PostcodeGroups (postcodefileobject,postcodeposition) :
+
+    "Return a generator of the postcode file lines grouped by postcode major part"
+
+    Encoding = locale.getpreferredencoding(False)
+    Occurrences = {}
+    MajorPart = None
+    Lines = []
+
+    for Line in postcodefileobject :
+        if ( b'"' in Line ) :
+            Postcode = Utils.ReturnData(Line.decode(Encoding).rstrip('\r\n'))[postcodeposition].encode(Encoding)
+        else:
+            Postcode = Line.split(b',',postcodeposition + 1)[postcodeposition]
+
+        NewMajorPart = Postcode.split()[0] if ( len(Postcode.split()) > 0 ) else Postcode
+        if ( NewMajorPart != MajorPart ) and ( len(Lines) > 0 ) :
+            Key = MajorPart.decode(Encoding,'replace')
+            Occurrences[Key] = Occurrences.get(Key,0) + 1
+            yield Key if ( Occurrences[Key] == 1 ) else '%s#%d' % (Key,Occurrences[Key]),Lines
+            Lines = []
+
+        MajorPart = NewMajorPart
+        Lines.append(Line)
+
+    if ( len(Lines) > 0 ) :
+        Key = MajorPart.decode(Encoding,'replace')
+        Occurrences[Key] = Occurrences.get(Key,0) + 1
+        yield Key if ( Occurrences[Key] == 1 ) else '%s#%d' % (Key,Occurrences[Key]),Lines
+
+# Return the key of lookup row 'row'. Rows are keyed by postcode key ( see 'postcode_codec.py' )
+# so that postcodes respaced between builds are matched. Rows whose postcode has no key are
+# keyed by the postcode itself.
+def RowKey (row) :
+
+    "Return the key of a lookup row"
+
+    Postcode = row.split(',',1)[0]
+
+    return Codec.Encode(Postcode) or Postcode
+
+# Return the lookup rows of a group of a previous build held in 'lookupfileobject'
+# keyed by postcode
+def GroupRows (lookupfileobject,group) :
+
+    "Return the lookup rows of a group of a previous build"
+
+    lookupfileobject.seek(group['Offset'])
+    Rows = lookupfileobject.read(group['Length']).decode(locale.getpreferredencoding(False)).splitlines()
+
+    return {RowKey(Row) : Row for Row in Rows}
+
+# Writes the differences between the lookup rows 'oldrows' and 'newrows' of a group
+# to delta file object 'deltafileobject' and returns the number of rows added, removed
+# and changed.
+def WriteDelta (deltafileobject,oldrows,newrows) :
+
+    "Writes the differences between the old and new lookup rows of a group"
+
+    Delta = []
+    for Postcode,Row in newrows.items() :
+        if not ( Postcode in oldrows ) :
+            Delta.append('Added,%s\n' % Row)
+        elif ( oldrows[Postcode] != Row ) :
+            Delta.append('Changed,%s\n' % Row)
+    for Postcode,Row in oldrows.items() :
+        if not ( Postcode in newrows ) : Delta.append('Removed,%s\n' % Row)
+
+    deltafileobject.writelines(Delta)
+
+    return [sum(1 for Row in Delta if Row.startswith(Action)) for Action in ('Added','Removed','Changed')]
+
+# Copies the run of unchanged rows 'copy' from the previous build to the new build.
+# 'copy' holds the lookup file offset and length and the first compact record and
+# record count of the run. The rows are also written to 'output', the block or sink
+# writer, if it is given.
+def CopyRows (oldlookupfileobject,lookupfileobject,oldcompact,compactfileobject,copy,output) :
+
+    "Copies a run of unchanged rows from the previous build"
+
+    Offset,Length,Record,Count = copy
+
+    lookupfileobject.flush()
+    oldlookupfileobject.seek(Offset)
+    while ( Length > 0 ) :
+        Data = oldlookupfileobject.read(min(Length,BufferSize))
+        if ( len(Data) == 0 ) : raise OSError('Previous lookup file is truncated')
+        lookupfileobject.buffer.write(Data)
+        if ( output != None ) : output.write(Data)
+        Length -= len(Data)
+
+    Start = oldcompact.recordoffset + Record * Compact.CompactRecord.size
+    compactfileobject.WriteRecords(oldcompact.buffer[Start:Start + Count * Compact.CompactRecord.size])
+
+# Generates lookup file 'lookupfilename' and compact lookup file 'compactfilename' reusing
+# the rows of the previous build for each postcode major part whose postcode file lines are
+# unchanged. Rows are only generated for changed major parts and the rows added, removed and
+# changed are written to delta file 'deltafilename'. If the previous build can not be reused
+# all rows are generated and no delta file is written. The compact records written are
+# passed to area index writer 'areas' and the lookup rows to 'output', the block or sink
+# writer, if it is given. Returns the number of groups reused and generated and the number of rows
+# added, removed and changed.
+def GenerateIncremental (postcodefilename,lookupfilename,compactfilename,manifestfilename,deltafilename,postcodefields,msoas,authorities,msoasuffixes,authoritysuffixes,geographies,invalidmsoas,statistics,areas,output) :
+
+    "Generates the lookup files reusing the unchanged rows of the previous build"
+
+    Encoding = locale.getpreferredencoding(False)
+    Manifest = LoadManifest(manifestfilename)
+    TablesDigest = TablesHash(postcodefields,msoas,authorities,msoasuffixes,authoritysuffixes,geographies)
+    Previous = ( Manifest.get('Tables') == TablesDigest ) and os.path.exists(lookupfilename) and os.path.exists(compactfilename)
+    Previous = Previous and ( os.path.getsize(lookupfilename) == Manifest.get('LookupSize') ) and ( os.path.getsize(compactfilename) == Manifest.get('CompactSize') )
+    OldGroups = {Group['Key'] : Group for Group in Manifest.get('Groups',[])} if ( Previous ) else {}
+    Counts = {'Reused' : 0, 'Generated' : 0, 'Added' : 0, 'Removed' : 0, 'Changed' : 0}
+
+    # Files of the previous build
+    if ( Previous ) :
+        OldLookupFileObject = open(lookupfilename,readbinary)
+        OldCompact = Compact.CompactLookup(compactfilename)
+        DeltaFileObject = open(deltafilename + '.new',overwrite,BufferSize)
+
+    # Files of the new build
+    PostcodeFileObject = open(postcodefilename,readbinary,BufferSize)
+    LookupFileObject = open(lookupfilename + '.new',overwrite,BufferSize)
+    CompactFileObject = Compact.CompactWriter(compactfilename + '.new',msoas,authorities,areas)
+
+    # Unchanged groups are copied from the previous build in contiguous runs
+    Copy = None
+    Position = 0
+    Groups = []
+
+    for Key,Lines in PostcodeGroups(PostcodeFileObject,postcodefields['Postcode']) :
+        Hash = hashlib.sha1(b''.join(Lines)).hexdigest()
+        OldGroup = OldGroups.pop(Key,None)
+
+        if ( OldGroup != None ) and ( OldGroup['Hash'] == Hash ) :
+            Group = dict(OldGroup,Offset=Position,Record=CompactFileObject.count + ( Copy[3] if ( Copy != None ) else 0 ))
+            if ( Copy != None ) and ( Copy[0] + Copy[1] == OldGroup['Offset'] ) and ( Copy[2] + Copy[3] == OldGroup['Record'] ) :
+                Copy[1] += OldGroup['Length']
+                Copy[3] += OldGroup['Rows']
+            else:
+                if ( Copy != None ) : CopyRows(OldLookupFileObject,LookupFileObject,OldCompact,CompactFileObject,Copy,output)
+                Copy = [OldGroup['Offset'],OldGroup['Length'],OldGroup['Record'],OldGroup['Rows']]
+            Position += OldGroup['Length']
+            Counts['Reused'] += 1
+        else:
+            if ( Copy != None ) : CopyRows(OldLookupFileObject,LookupFileObject,OldCompact,CompactFileObject,Copy,output)
+            Copy = None
+
+            # Generate the rows of a changed group
+            CompactRecords = Compact.CompactRecords()
+            GroupStatistics = NewStatistics()
+            GroupInvalidMsoas = {}
+            GroupLines = io.StringIO(b''.join(Lines).decode(Encoding),newline=None)
+            Rows = list(GenerateRows(GroupLines,postcodefields,msoas,authorities,msoasuffixes,authoritysuffixes,CompactRecords,GroupInvalidMsoas,GroupStatistics,None,geographies))
+
+            Group = {'Key' : Key, 'Hash' : Hash, 'Offset' : Position, 'Record' : CompactFileObject.count, 'Rows' : len(Rows), 'Statistics' : GroupStatistics, 'Invalid' : GroupInvalidMsoas}
+            LookupFileObject.writelines(Rows)
+            if ( output != None ) : output.writelines(Rows)
+            LookupFileObject.flush()
+            Group['Length'] = LookupFileObject.buffer.tell() - Position
+            Position += Group['Length']
+            CompactFileObject.WriteRecords(CompactRecords.Data())
+            Counts['Generated'] += 1
+
+            if ( Previous ) :
+                OldRows = GroupRows(OldLookupFileObject,OldGroup) if ( OldGroup != None ) else {}
+                NewRows = {RowKey(Row) : Row.rstrip('\n') for Row in Rows}
+                for Action,Count in zip(('Added','Removed','Changed'),WriteDelta(DeltaFileObject,OldRows,NewRows)) : Counts[Action] += Count
+
+        MergeStatistics(statistics,Group['Statistics'],invalidmsoas,Group['Invalid'])
+        Groups.append(Group)
+
+    if ( Copy != None ) : CopyRows(OldLookupFileObject,LookupFileObject,OldCompact,CompactFileObject,Copy,output)
+
+    # Record the rows of removed groups and replace the files of the previous build
+    if ( Previous ) :
+        for OldGroup in OldGroups.values() :
+            Counts['Removed'] += WriteDelta(DeltaFileObject,GroupRows(OldLookupFileObject,OldGroup),{})[1]
+        OldLookupFileObject.close()
+        OldCompact.Close()
+        DeltaFileObject.close()
+        os.replace(deltafilename + '.new',deltafilename)
+    elif ( os.path.exists(deltafilename) ) :
+        os.remove(deltafilename)
+
+    PostcodeFileObject.close()
+    LookupFileObject.close()
+    CompactFileObject.Close()
+    os.replace(lookupfilename + '.new',lookupfilename)
+    os.replace(compactfilename + '.new',compactfilename)
+
+    SaveManifest(manifestfilename,{'Tables' : TablesDigest, 'LookupSize' : os.path.getsize(lookupfilename), 'CompactSize' : os.path.getsize(compactfilename), 'Groups' : Groups})
+
+    return Previous,Counts
+
+############
+### MAIN ###
+############
+
+# Generates the lookup files using the command line arguments 'arguments' or those of
+# the script if 'arguments' is None. Returns the postcode counts.
+def Main (arguments=None) :
+
+    "Generates file 'lookup_data.csv'"
+
+    # Parse command line
+    Parser = argparse.ArgumentParser(description='Generate the postcode to MSOA and LTLA lookup file')
+    Parser.add_argument('--workers',type=int,default=1,help='number of worker processes, 0 for one per CPU')
+    Parser.add_argument('--incremental',action='store_true',help='only generate rows for postcodes changed since the previous build')
+    Parser.add_argument('--sqlite',help='also write the lookup to this SQLite database')
+    Parser.add_argument('--no-compress',dest='compress',action='store_false',help='do not write the block compressed lookup file')
+    Parser.add_argument('--sink',dest='sinks',action='append',default=[],help='also write the lookup rows to a sink given as <csv|ndjson|index>:<file>')
+    Parser.add_argument('--resume',action='store_true',help='continue an interrupted run from its last checkpoint')
+    Parser.add_argument('--checkpoint-interval',dest='checkpointinterval',type=float,default=Checkpoint.CheckpointInterval,help='minimum number of seconds between checkpoints')
+    Metrics.AddArguments(Parser)
+    LogWriter.AddArguments(Parser)
+    Arguments = Parser.parse_args(arguments)
+    PipelineMetrics = Metrics.Metrics(module,Arguments)
+    Workers = Arguments.workers if ( Arguments.workers > 0 ) else os.cpu_count()
+
+    # Create/open log file
+    ErrorFileObject = Utils.OpenLog(ErrorFilename,failure,Arguments.jsonlog)
+    ErrorMessage = 'Could not open ' + ErrorFilename
+    if ( ErrorFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Log start of script
+    Utils.Logerror(ErrorFileObject,module,'Started',info)
+
+    # Log progress messages
+    ErrorMessage = 'Reading configuration file %s ' % ConfigurationFilename
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    # Read field positions  
+    Stage = PipelineMetrics.Start('Configuration')
+    MsoasFileFields,PopulationFields,AuthoritiesFields,PostcodeFields,GeographyFields = ReadConfiguration(ConfigurationFilename,ErrorFileObject)
+    Stage.Read(ConfigurationFilename)
+    Stage.rows = 4 + len(GeographyFields)
+    Stage.Stop()
+
+    # Log progress messages
+    ErrorMessage = 'Reading configuration file %s ' % AuthoritiesFilename
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    # Build authorities structure
+    Stage = PipelineMetrics.Start('Authorities')
+    Authorities = LoadAuthorities(AuthoritiesFilename,AuthoritiesFields,ErrorFileObject)
+    Stage.Read(AuthoritiesFilename)
+    Stage.rows = len(Authorities)
+    Stage.Stop()
+
+    # Log progress messages
+    ErrorMessage = 'Reading configuration files %s and %s ' % (PopulationFilename,MsoasFilename)
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    # Build MSOA structure
+    Stage = PipelineMetrics.Start('MSOAs')
+    Msoas = LoadMsoas(PopulationFilename,MsoasFilename,PopulationFields,MsoasFileFields,Authorities,ErrorFileObject)
+    Stage.Read(PopulationFilename)
+    Stage.Read(MsoasFilename)
+    Stage.rows = len(Msoas)
+    Stage.Stop()
+
+    # Build further geography structures
+    Geographies = []
+    if ( len(GeographyFields) > 0 ) :
+        ErrorMessage = 'Reading the dimension files of geographies %s ' % ','.join(Fields['Geography'] for Fields in GeographyFields)
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+        Stage = PipelineMetrics.Start('Geographies')
+        Geographies = LoadGeographies(GeographyFields,DataDir,ErrorFileObject)
+        for Fields in GeographyFields :
+            if ( 'File' in Fields ) : Stage.Read(os.path.join(DataDir,Fields['File']))
+        Stage.rows = sum(len(Geography['Suffixes']) for Geography in Geographies)
+        Stage.Stop()
+
+    # Pre-render the csv fields of each MSOA and authority
+    MsoaSuffixes,AuthoritySuffixes = RenderSuffixes(Msoas,Authorities,Geographies)
+
+    # Track invalid Post codes / MSOA codes
+    InvalidMsoas = {}
+    Statistics = NewStatistics()
+    AreaIndexWriter = Areas.AreaIndexWriter()
+    Stage = PipelineMetrics.Start('Postcodes')
+
+    # Find the checkpoint of an interrupted run with the same postcode file and tables
+    State = None
+    Identity = Checkpoint.Identity(PostcodeFilename,TablesHash(PostcodeFields,Msoas,Authorities,MsoaSuffixes,AuthoritySuffixes,Geographies),{'Compress' : Arguments.compress})
+    if ( Arguments.resume ) :
+        ErrorMessage = 'Option --resume can not be used with --incremental'
+        if ( Arguments.incremental ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+        State = Checkpoint.LoadCheckpoint(CheckpointFilename,Identity)
+        if ( State != None ) and not ( os.path.exists(LookupFilename + '.part') and os.path.exists(CompactFilename + '.part') ) : State = None
+        if ( State == None ) :
+            ErrorMessage = 'No checkpoint of an interrupted run using the current input files was found, starting from the beginning '
+        else:
+            ErrorMessage = 'Resuming from the checkpoint at byte %d of %s after %d postcodes ' % (State['InputOffset'],PostcodeFilename,State['Statistics']['PostcodeCount'])
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+    if ( State == None ) : Checkpoint.RemoveCheckpoint(CheckpointFilename)
+
+    # Open block compressed lookup file
+    BlockWriter = None
+    if ( Arguments.compress ) :
+        try:
+            BlockWriter = Blocks.BlockWriter(BlockFilename,BlockIndexFilename,state=State['Blocks'] if ( State != None ) else None)
+        except OSError:
+            ErrorMessage = 'Could not open ' + BlockFilename
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Open the sinks to which the lookup rows are passed as they are written ( see 'sinks.py' ).
+    # Index file 'lookup_data.idx' is written by an index sink so that the lookup file is not
+    # read again to index it.
+    IndexSink = Sinks.IndexSink(IndexFilename,Msoas,Authorities,Geographies)
+    SinkList = [IndexSink]
+    for Sink in Arguments.sinks :
+        Kind,Separator,Filename = Sink.partition(':')
+        ErrorMessage = 'Sink %s is not of the form <%s>:<file> ' % (Sink,'|'.join(Sinks.SinkTypes))
+        if not ( Kind in Sinks.SinkTypes ) or ( Filename == '' ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+        SinkList.append(Sinks.SinkTypes[Kind](Filename,Msoas,Authorities,Geographies))
+
+    try:
+        SinkWriter = Sinks.SinkWriter(SinkList)
+    except OSError as Error:
+        ErrorMessage = 'Could not open sink: %s' % Error
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Lookup rows are written to the block compressed lookup file and then the sinks
+    RowOutput = SinkWriter
+    if ( BlockWriter != None ) :
+        BlockWriter.target = SinkWriter
+        RowOutput = BlockWriter
+
+    # Generate lookup rows for changed postcodes only
+    if ( Arguments.incremental ) :
+        ErrorMessage = 'Generating lookup file %s from postcodes changed since the previous build ' % LookupFilename
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+        try:
+            Previous,Counts = GenerateIncremental(PostcodeFilename,LookupFilename,CompactFilename,ManifestFilename,DeltaFilename,PostcodeFields,Msoas,Authorities,MsoaSuffixes,AuthoritySuffixes,Geographies,InvalidMsoas,Statistics,AreaIndexWriter,RowOutput)
+        except (OSError,ValueError) as Error:
+            ErrorMessage = 'Could not generate %s incrementally: %s' % (LookupFilename,Error)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+        if ( Previous ) :
+            ErrorMessage = '%d postcode major parts were unchanged and %d were regenerated ' % (Counts['Reused'],Counts['Generated'])
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+            ErrorMessage = 'A total of %d rows were added, %d removed and %d changed, see delta file %s ' % (Counts['Added'],Counts['Removed'],Counts['Changed'],DeltaFilename)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+        else:
+            ErrorMessage = 'The previous build could not be reused so all %d postcode major parts were generated ' % Counts['Generated']
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+        ErrorMessage = 'No data in ' + PostcodeFilename
+        if ( Statistics['PostcodeCount'] == 0 ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+    else :
+        # Log progress messages
+        ErrorMessage = 'Reading configuration files %s ' % PostcodeFilename
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+        # Open postcode file
+        PostcodeFileObject = Utils.Open(PostcodeFilename,readbinary,failure,BufferSize)
+        ErrorMessage = 'Could not open configuration file ' + PostcodeFilename
+        if ( PostcodeFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+        # Open lookup file. The lookup files are written to temporary files which replace
+        # the lookup files once complete. A resumed run continues the temporary files from
+        # the checkpoint.
+        if ( State != None ) : os.truncate(LookupFilename + '.part',State['LookupOffset'])
+        LookupFileObject = Utils.Open(LookupFilename + '.part',append if ( State != None ) else overwrite,failure,BufferSize)
+        ErrorMessage = 'Could not open configuration file ' + LookupFilename
+        if ( LookupFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+        # Lookup rows are also written to the block compressed lookup file and the sinks.
+        # A resumed run first passes the rows already written to the sinks.
+        SinkWriter.target = LookupFileObject
+        LookupOutput = RowOutput
+        if ( State != None ) : SinkWriter.Replay(LookupFilename + '.part')
+
+        # Open compact lookup file
+        try:
+            CompactFileObject = Compact.CompactWriter(CompactFilename + '.part',Msoas,Authorities,AreaIndexWriter,State['CompactRecords'] if ( State != None ) else None)
+        except:
+            ErrorMessage = 'Could not open ' + CompactFilename
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+        # Restore the counts and invalid MSOAs of the interrupted run
+        Start = 0
+        if ( State != None ) :
+            Start = State['InputOffset']
+            Statistics.update(State['Statistics'])
+            InvalidMsoas.update(State['InvalidMsoas'])
+        Checkpointer = Checkpoint.Checkpoint(CheckpointFilename,Identity,LookupFileObject,CompactFileObject,BlockWriter,Statistics,InvalidMsoas,Arguments.checkpointinterval)
+
+        # Read and parse postcode file.
+        ErrorMessage = 'No data in ' + PostcodeFilename
+        if ( os.path.getsize(PostcodeFilename) == 0 ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+        # Log progress messages
+        ErrorMessage = 'Generating lookup file %s ' % LookupFilename
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+        # Generate and write lookup rows
+        if ( Workers > 1 ) :
+            ErrorMessage = 'Processing %s using %d worker processes ' % (PostcodeFilename,Workers)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+            try:
+                GenerateParallel(PostcodeFilename,Start,LookupFilename,LookupOutput,Workers,PostcodeFields,Msoas,Authorities,Geographies,CompactFileObject,InvalidMsoas,Statistics,Checkpointer,ErrorFileObject)
+            except OSError as Error:
+                ErrorMessage = 'Could not generate %s in parallel: %s' % (LookupFilename,Error)
+                Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+        else :
+            try:
+                GenerateSequential(PostcodeFileObject,Start,LookupOutput,PostcodeFields,Msoas,Authorities,MsoaSuffixes,AuthoritySuffixes,Geographies,CompactFileObject,InvalidMsoas,Statistics,Checkpointer,ErrorFileObject)
+            except OSError as Error:
+                ErrorMessage = 'Could not write to %s: %s' % (LookupFilename,Error)
+                Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+        ErrorMessage = 'A total of %d checkpoints were written to %s ' % (Checkpointer.count,CheckpointFilename)
+        if ( Checkpointer.count > 0 ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+        # Close postcode file
+        ErrorMessage = 'Could not close ' + PostcodeFilename
+        if ( Utils.Close(PostcodeFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+        # Close lookup file
+        ErrorMessage = 'Could not close ' + LookupFilename
+        if ( Utils.Close(LookupFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+        # Close compact lookup file
+        try:
+            CompactFileObject.Close()
+        except:
+            ErrorMessage = 'Could not close ' + CompactFilename
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+        # Remove the manifest and delta file of any previous incremental build as
+        # they do not describe the files generated above
+        for Filename in (ManifestFilename,DeltaFilename) :
+            if ( os.path.exists(Filename) ) : os.remove(Filename)
+
+        # Replace the lookup files
+        try:
+            os.replace(LookupFilename + '.part',LookupFilename)
+            os.replace(CompactFilename + '.part',CompactFilename)
+        except OSError as Error:
+            ErrorMessage = 'Could not replace %s: %s' % (LookupFilename,Error)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Complete block compressed lookup file
+    if ( BlockWriter != None ) :
+        try:
+            BlockCount = BlockWriter.Close()
+            ErrorMessage = 'A total of %d compressed blocks were written to %s ' % (BlockCount,BlockFilename)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+        except OSError as Error:
+            ErrorMessage = 'Could not write block compressed lookup file %s: %s' % (BlockFilename,Error)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+    # Complete the files of the sinks and report their throughput
+    for Sink in SinkWriter.Close() :
+        if ( Sink.failure == None ) :
+            ErrorMessage = 'Sink %s wrote %d rows to %s in %.2f seconds ( %d rows/sec ), waited for %.2f seconds ' % (type(Sink).__name__,Sink.rows,Sink.filename,Sink.seconds,Sink.rows / max(Sink.seconds,1e-9),Sink.waited)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+        else:
+            ErrorMessage = 'Sink %s could not write %s: %s' % (type(Sink).__name__,Sink.filename,Sink.failure)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+    # The run is complete so its checkpoint is no longer required
+    Checkpoint.RemoveCheckpoint(CheckpointFilename)
+
+    Stage.Read(PostcodeFilename)
+    for Filename in (LookupFilename,CompactFilename,DeltaFilename,BlockFilename,BlockIndexFilename) : Stage.Written(Filename)
+    for Sink in SinkList : Stage.Written(Sink.filename)
+    Stage.rows = Statistics['PostcodeCount']
+    Stage.Stop()
+
+    # Output statistics.
+    ErrorMessage = 'A total of %d postcodes were processed ' % Statistics['PostcodeCount']
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+    ErrorMessage = 'A total of %d postcodes with non-existent MSOA\'s were found ' % Statistics['PostcodeErrorCount']
     Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
-    
-    # Print associated postcodes
-    OutputRow = InvalidMsoas[MsoaCode]
-    PostCodeDataLine = Utils.GenerateCSVRow(OutputRow)
-    Utils.Logerror(ErrorFileObject,module,PostCodeDataLine,warning)
-
-# Close postcode file
-ErrorMessage = 'Could not close ' + PostcodeFilename
-if ( Utils.Close(PostcodeFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
-
-# Close lookup file
-ErrorMessage = 'Could not close ' + LookupFilename
-if ( Utils.Close(LookupFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
-
-# Log end of script
-Utils.Logerror(ErrorFileObject,module,'Completed',info)
-
-# Close error log file
-ErrorMessage = 'Could not close ' + ErrorFilename
-if ( Utils.Close(ErrorFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
\ No newline at end of file
+
+    # Print invalid MSOA data
+    for MsoaCode in InvalidMsoas :
+
+        # Pront MSOA code
+        ErrorMessage = 'MSOA %s was invalid and associated with the following postcodes' % MsoaCode
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning,'InvalidMsoa')
+        
+        # Print associated postcodes
+        OutputRow = InvalidMsoas[MsoaCode]
+        PostCodeDataLine = Utils.GenerateCSVRow(OutputRow)
+        Utils.Logerror(ErrorFileObject,module,PostCodeDataLine,warning,'InvalidMsoa')
+
+    # Generate index file if the index sink failed. Otherwise the stage records the time
+    # taken by the sink on its own thread.
+    Stage = PipelineMetrics.Start('Index')
+    if ( IndexSink.failure == None ) :
+        IndexCount = len(IndexSink.records)
+        Stage.seconds = IndexSink.seconds
+        Stage.bytesread = IndexSink.bytes
+        Stage.Written(IndexFilename)
+    else:
+        ErrorMessage = 'Generating index file %s ' % IndexFilename
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+        IndexCount = Index.BuildIndex(LookupFilename,IndexFilename,failure)
+        ErrorMessage = 'Could not generate index file ' + IndexFilename
+        if ( IndexCount == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+        Stage.Read(LookupFilename)
+        Stage.Written(IndexFilename)
+    Stage.rows = IndexCount
+    Stage.Stop()
+
+    # Log progress messages
+    ErrorMessage = 'Generating outcode index file %s ' % OutcodeFilename
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    # Generate outcode index file
+    Stage = PipelineMetrics.Start('Outcodes')
+    OutcodeCount = Outcodes.BuildOutcodeIndex(LookupFilename,CompactFilename,OutcodeFilename,failure)
+    ErrorMessage = 'Could not generate outcode index file ' + OutcodeFilename
+    if ( OutcodeCount == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+    Stage.Read(LookupFilename)
+    Stage.Read(CompactFilename)
+    Stage.Written(OutcodeFilename)
+    Stage.rows = OutcodeCount
+    Stage.Stop()
+
+    # Log progress messages
+    ErrorMessage = 'Generating area index file %s ' % AreaFilename
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    # Write the MSOA and LTLA record runs collected while generating the compact lookup file
+    Stage = PipelineMetrics.Start('Areas')
+    try:
+        AreaCount = AreaIndexWriter.Save(CompactFilename,AreaFilename)
+    except (OSError,ValueError) :
+        AreaCount = failure
+        ErrorMessage = 'Could not generate area index file ' + AreaFilename
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+    Stage.Written(AreaFilename)
+    Stage.rows = AreaCount
+    Stage.Stop()
+
+    # Write SQLite database
+    if ( Arguments.sqlite != None ) :
+        ErrorMessage = 'Writing SQLite database %s ' % Arguments.sqlite
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+        Stage = PipelineMetrics.Start('SQLite')
+        try:
+            DatabaseCount,LoadSeconds,IndexSeconds = Sqlite.WriteDatabase(CompactFilename,Arguments.sqlite)
+            ErrorMessage = 'A total of %d postcodes were loaded in %.2f seconds ( %d rows/sec ) and indexed in %.2f seconds ' % (DatabaseCount,LoadSeconds,DatabaseCount / max(LoadSeconds,1e-9),IndexSeconds)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+            Stage.rows = DatabaseCount
+        except (OSError,ValueError,Sqlite.sqlite3.Error) as Error:
+            ErrorMessage = 'Could not write SQLite database %s: %s' % (Arguments.sqlite,Error)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+        Stage.Read(CompactFilename)
+        Stage.Written(Arguments.sqlite)
+        Stage.Stop()
+
+    # Record the source data files retrieved by 'retrieve_files.py' as those of the lookup
+    # in the download cache so they are no longer reported as changed
+    try:
+        if ( Utils.PromoteCache(CacheDir,Utils.CachePreparedFilename,Utils.CacheMetadataFilename) ) :
+            ErrorMessage = 'Recorded the source data files of the lookup in download cache %s ' % CacheDir
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+    except OSError as Error:
+        ErrorMessage = 'Could not update download cache %s: %s' % (CacheDir,Error)
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+    # Write metrics file
+    MetricsFile = Arguments.metrics or MetricsFilename
+    try:
+        for Record in PipelineMetrics.Save(MetricsFile) : Utils.Logerror(ErrorFileObject,module,Metrics.Summary(Record),info)
+    except OSError:
+        ErrorMessage = 'Could not write metrics file ' + MetricsFile
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+    # Log end of script
+    Utils.Logerror(ErrorFileObject,module,'Completed',info)
+
+    # Close error log file
+    ErrorMessage = 'Could not close ' + ErrorFilename
+    if ( Utils.Close(ErrorFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+    return Statistics
+
+# Worker processes import this script so the lookup file is only generated
+# when it is run directly.
+if ( __name__ == '__main__' ) :
+    Main()
@@ -0,0 +1,189 @@
+# log_writer.py
+#
+# Description
+# ===========
+#
+# This module provides a log file writer for 'utils.Logerror' which formats and writes
+# messages on a background thread. Messages are placed on a queue by the calling thread
+# and written to the log file and the console in batches so that scripts logging many
+# messages spend little time logging. Each message is written in the same form as by
+# 'utils.Logerror':
+#
+# <Time> <Level>: <Module>: <Text>
+#
+# Messages of level 'LOG' are only written to the log file. Repeated messages may be
+# given a key and only the first 'RepeatLimit' messages with the same key are shown on
+# the console. All messages are written to the log file and the number of messages not
+# shown is reported when the log is closed. ERROR messages are written before the
+# script exits.
+#
+# Messages may also be written to a second file as JSON lines of the form:
+#
+# {"Time": "2020-06-01T09:00:00.000", "Level": "INFO", "Module": "generate_lookup.py", "Text": "Started"}
+#
+# A "Key" field is added to messages given a key.
+#
+# Usage
+# =====
+#
+# ErrorFileObject = Utils.OpenLog(ErrorFilename,failure,JsonFilename)
+# Utils.Logerror(ErrorFileObject,module,'Started','INFO')
+# Utils.Close(ErrorFileObject,failure)
+
+import atexit
+import datetime
+import json
+import queue
+import sys
+import threading
+import time
+
+# Maximum number of messages written in each batch
+BatchSize = 1000
+
+# Number of messages with the same key shown on the console
+RepeatLimit = 10
+
+# Adds the structured log command line argument to argparse parser 'parser'
+def AddArguments (parser) :
+
+    "Adds the structured log command line argument"
+
+    parser.add_argument('--json-log',dest='jsonlog',help='also write log messages to this file as JSON lines')
+
+# Class writing log messages to a log file and the console on a background thread.
+# Messages are also written as JSON lines to 'jsonfilename' if it is given.
+class LogWriter :
+
+    "Writes log messages on a background thread"
+
+    def __init__ (self,filename,jsonfilename=None,repeatlimit=RepeatLimit) :
+
+        self.filename = filename
+        self.file = open(filename,'a')
+        self.jsonfile = open(jsonfilename,'a') if ( jsonfilename != None ) else None
+        self.repeatlimit = repeatlimit
+        self.repeats = {}
+        self.queue = queue.SimpleQueue()
+        self.failure = None
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.Run,name='LogWriter',daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Queue message 'text' of level 'level' from script 'module'. Only the first
+    # 'repeatlimit' messages with key 'key' are shown on the console.
+    def Log (self,module,text,level,key=None) :
+
+        "Queue a log message"
+
+        if ( self.failure != None ) or ( self.closed ) :
+            print ('Unable to log %s%s%s' % ('\"',self.failure or Format(time.time(),module,text,level),'\"') )
+            sys.exit()
+
+        console = ( level != 'LOG' )
+        if ( key != None ) :
+            count = self.repeats[key] = self.repeats.get(key,0) + 1
+            if ( count > self.repeatlimit ) : console = False
+
+        self.queue.put((time.time(),module,text,level,key,console))
+
+    # Wait until all queued messages have been written
+    def Flush (self) :
+
+        "Wait until all queued messages have been written"
+
+        if ( self.closed ) : return
+        written = threading.Event()
+        self.queue.put(written)
+        written.wait()
+
+    # Write the messages on the queue in batches until the log is closed
+    def Run (self) :
+
+        "Write queued messages"
+
+        timestamps = {}
+        stop = False
+
+        while not ( stop ) :
+            batch = [self.queue.get()]
+            while ( len(batch) < BatchSize ) :
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            consolelines = []
+            jsonlines = []
+            events = []
+
+            for entry in batch :
+                if ( entry == None ) :
+                    stop = True
+                    continue
+                if ( isinstance(entry,threading.Event) ) :
+                    events.append(entry)
+                    continue
+
+                seconds,module,text,level,key,console = entry
+                second = int(seconds)
+                timestamp = timestamps.get(second)
+                if ( timestamp == None ) :
+                    timestamps.clear()
+                    timestamp = timestamps[second] = time.asctime(time.localtime(seconds))
+
+                message = timestamp + ' ' + level + ': ' + module + ': ' + text + '\n'
+                lines.append(message)
+                if ( console ) : consolelines.append(message)
+
+                if ( self.jsonfile != None ) :
+                    record = {'Time' : datetime.datetime.fromtimestamp(seconds).isoformat(timespec='milliseconds'), 'Level' : level, 'Module' : module, 'Text' : text}
+                    if ( key != None ) : record['Key'] = key
+                    jsonlines.append(json.dumps(record) + '\n')
+
+            if ( self.failure == None ) :
+                try:
+                    self.file.writelines(lines)
+                    self.file.flush()
+                    if ( self.jsonfile != None ) :
+                        self.jsonfile.writelines(jsonlines)
+                        self.jsonfile.flush()
+                except (OSError,ValueError) :
+                    self.failure = lines[0].rstrip('\n') if ( len(lines) > 0 ) else 'messages to ' + self.filename
+
+            if ( len(consolelines) > 0 ) :
+                sys.stdout.write(''.join(consolelines))
+                sys.stdout.flush()
+
+            for event in events : event.set()
+
+    # Report the number of repeated messages not shown on the console, write
+    # the remaining messages and close the log files
+    def close (self) :
+
+        "Write remaining messages and close the log files"
+
+        if ( self.closed ) : return
+
+        for key,count in self.repeats.items() :
+            if ( count > self.repeatlimit ) :
+                self.queue.put((time.time(),'log_writer.py','%d further %s messages were written to %s only' % (count - self.repeatlimit,key,self.filename),'INFO',None,True))
+
+        self.queue.put(None)
+        self.thread.join()
+        self.closed = True
+        atexit.unregister(self.close)
+
+        self.file.close()
+        if ( self.jsonfile != None ) : self.jsonfile.close()
+        if ( self.failure != None ) : raise OSError('Unable to log ' + self.failure)
+
+# Return log message 'text' of level 'level' from script 'module' logged at time 'seconds'
+def Format (seconds,module,text,level) :
+
+    "Return a formatted log message"
+
+    return time.asctime(time.localtime(seconds)) + ' ' + level + ': ' + module + ': ' + text
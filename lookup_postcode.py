@@ -0,0 +1,233 @@
+# lookup_postcode.py
+#
+# Description
+# ===========
+#
+# This script returns the rows of file 'lookup_data.csv' relating to one or more UK
+# postcodes. Rows are located using index file 'lookup_data.idx' which is created
+# by 'generate_lookup.py' so each lookup requires a binary search of the memory mapped
+# index and a single read of 'lookup_data.csv' rather than a scan of the whole file.
+# Postcodes may be given in any case and with or without spacing.
+#
+# Example:
+#
+# python lookup_postcode.py "BN14 0BH"
+#
+# Gives the following output.
+#
+# BN14 0BH,High Salvington & Findon Valley,E02006621,7648,Worthing,E07000229,110570
+#
+# Usage
+# =====
+#
+# python lookup_postcode.py <postcode> [<postcode> ...]
+#
+# Postcodes that are not found are reported on the console and the script will
+# return exit status 1.
+#
+# python lookup_postcode.py --compressed <postcode> [<postcode> ...]
+#
+# Looks up postcodes in block compressed lookup file 'lookup_data.csv.gz' using its block
+# index file 'lookup_data.gzi' ( see 'block_lookup.py' ) rather than 'lookup_data.csv'.
+# Only the block holding each postcode is decompressed.
+#
+# python lookup_postcode.py --outcode <outcode> [--outcode <outcode> ...] [--summary]
+#
+# Returns the rows of every postcode of each outcode e.g. 'BN14' using outcode index file
+# 'lookup_data.outcodes'. The rows of an outcode are read with a single seek rather than a
+# scan of the whole file. If '--summary' is given the number of postcodes and the MSOAs and
+# LTLAs of each outcode are returned instead, for example:
+#
+# BN14,1021 postcodes
+# BN14,MSOA,E02006621,High Salvington & Findon Valley
+# BN14,LTLA,E07000229,Worthing
+#
+# python lookup_postcode.py --area <MSOA or LTLA code> [--area <code> ...] [--summary]
+#
+# Returns the rows of every postcode in each MSOA e.g. 'E02006621' or LTLA e.g. 'E07000229'
+# using area index file 'lookup_data.areas'. Only the postcode records of the area are read
+# from 'lookup_data.bin'. If '--summary' is given the number of postcodes in each area is
+# returned instead, for example:
+#
+# E02006621,1021 postcodes
+#
+# python lookup_postcode.py --build
+#
+# Recreates index files 'lookup_data.idx', 'lookup_data.outcodes' and 'lookup_data.areas'
+# from existing 'lookup_data.csv' and 'lookup_data.bin' files.
+#
+# Data and configuration files
+# ============================
+#
+# This utility requires the files ..\data\lookup_data.csv and ..\data\lookup_data.idx,
+# for outcode queries ..\data\lookup_data.outcodes and for MSOA and LTLA queries the files
+# ..\data\lookup_data.bin and ..\data\lookup_data.areas. With '--compressed' postcodes are
+# looked up using the files ..\data\lookup_data.csv.gz and ..\data\lookup_data.gzi
+#
+# Logging
+# =======
+#
+# This script logs error messages to the file .\log\log.txt an to the user console.
+
+import argparse
+import os
+import struct
+import sys
+import area_index as Areas
+import block_lookup as Blocks
+import outcode_index as Outcodes
+import postcode_index as Index
+import utils as Utils
+
+############
+### MAIN ###
+############
+
+# File names and modes
+Currentdir = os.getcwd()
+LogDir = os.path.join(Currentdir,'log')
+ErrorFilename = os.path.join(LogDir,'log.txt')
+DataDir = os.path.join(Currentdir,'data')
+LookupFilename = os.path.join(DataDir,'lookup_data.csv')
+IndexFilename = os.path.join(DataDir,'lookup_data.idx')
+CompactFilename = os.path.join(DataDir,'lookup_data.bin')
+OutcodeFilename = os.path.join(DataDir,'lookup_data.outcodes')
+AreaFilename = os.path.join(DataDir,'lookup_data.areas')
+BlockFilename = os.path.join(DataDir,'lookup_data.csv.gz')
+BlockIndexFilename = os.path.join(DataDir,'lookup_data.gzi')
+append = 'a'
+
+# Function return values
+invalid = failure = 0
+empty = ''
+success = 1
+
+# Error levels
+error = 'ERROR'
+warning = 'WARNING'
+info = 'INFO'
+
+# Script names
+module = 'lookup_postcode.py'
+
+# Parse command line
+Parser = argparse.ArgumentParser(description='Look up the MSOA and LTLA of UK postcodes')
+Parser.add_argument('postcodes',nargs='*',help='postcodes to look up')
+Parser.add_argument('--outcode',action='append',default=[],help='outcode whose postcodes are returned')
+Parser.add_argument('--area',action='append',default=[],help='MSOA or LTLA code whose postcodes are returned')
+Parser.add_argument('--summary',action='store_true',help='return the postcode count, MSOAs and LTLAs of each outcode or area')
+Parser.add_argument('--compressed',action='store_true',help='look up postcodes in the block compressed lookup file')
+Parser.add_argument('--build',action='store_true',help='rebuild the index files from the lookup files')
+Arguments = Parser.parse_args()
+
+# Create/open log file
+ErrorFileObject = Utils.Open(ErrorFilename,append,failure)
+ErrorMessage = 'Could not open ' + ErrorFilename
+if ( ErrorFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+# Rebuild index file
+if ( Arguments.build ) :
+    ErrorMessage = 'Generating index file %s ' % IndexFilename
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    IndexCount = Index.BuildIndex(LookupFilename,IndexFilename,failure)
+    ErrorMessage = 'Could not generate index file ' + IndexFilename
+    if ( IndexCount == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    ErrorMessage = 'A total of %d postcodes were indexed ' % IndexCount
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    ErrorMessage = 'Generating outcode index file %s ' % OutcodeFilename
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    OutcodeCount = Outcodes.BuildOutcodeIndex(LookupFilename,CompactFilename,OutcodeFilename,failure)
+    ErrorMessage = 'Could not generate outcode index file ' + OutcodeFilename
+    if ( OutcodeCount == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    ErrorMessage = 'A total of %d outcodes were indexed ' % OutcodeCount
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    ErrorMessage = 'Generating area index file %s ' % AreaFilename
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    AreaCount = Areas.BuildAreaIndex(CompactFilename,AreaFilename,failure)
+    ErrorMessage = 'Could not generate area index file ' + AreaFilename
+    if ( AreaCount == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    ErrorMessage = 'A total of %d MSOAs and LTLAs were indexed ' % AreaCount
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+# Open index
+if ( Arguments.compressed ) :
+    try:
+        PostcodeIndex = Blocks.BlockLookup(BlockFilename,BlockIndexFilename)
+    except (OSError,ValueError,struct.error) :
+        ErrorMessage = 'Could not open block index file %s for %s' % (BlockIndexFilename,BlockFilename)
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+else:
+    try:
+        PostcodeIndex = Index.PostcodeIndex(LookupFilename,IndexFilename)
+    except:
+        ErrorMessage = 'Could not open index file %s for %s' % (IndexFilename,LookupFilename)
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+# Look up postcodes
+NotFoundCount = 0
+for Postcode in Arguments.postcodes :
+    LookupRow = PostcodeIndex.Lookup(Postcode)
+    if ( LookupRow != empty ) :
+        print(LookupRow)
+    else:
+        print('Postcode %s not found' % Postcode)
+        NotFoundCount += 1
+
+PostcodeIndex.Close()
+
+# Open outcode index
+if ( len(Arguments.outcode) > 0 ) :
+    try:
+        OutcodeIndex = Outcodes.OutcodeIndex(LookupFilename,OutcodeFilename)
+    except (OSError,ValueError,KeyError) :
+        ErrorMessage = 'Could not open outcode index file %s for %s' % (OutcodeFilename,LookupFilename)
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+# Look up outcodes
+for Outcode in Arguments.outcode :
+    OutcodeKey = OutcodeIndex.Key(Outcode)
+    if ( OutcodeKey == None ) :
+        print('Outcode %s not found' % Outcode)
+        NotFoundCount += 1
+    elif ( Arguments.summary ) :
+        Entry = OutcodeIndex.Entry(OutcodeKey)
+        print('%s,%d postcodes' % (OutcodeKey,Entry['Postcodes']))
+        for MsoaCode in Entry['Msoas'] : print('%s,MSOA,%s,%s' % (OutcodeKey,MsoaCode,OutcodeIndex.msoanames[MsoaCode]))
+        for AuthorityCode in Entry['Ltlas'] : print('%s,LTLA,%s,%s' % (OutcodeKey,AuthorityCode,OutcodeIndex.authoritynames[AuthorityCode]))
+    else:
+        for LookupRow in OutcodeIndex.Rows(OutcodeKey) : print(LookupRow)
+
+# Open area index
+if ( len(Arguments.area) > 0 ) :
+    try:
+        AreaIndex = Areas.AreaIndex(CompactFilename,AreaFilename)
+    except (OSError,ValueError,KeyError) :
+        ErrorMessage = 'Could not open area index file %s for %s' % (AreaFilename,CompactFilename)
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+# Look up MSOAs and LTLAs
+for Area in Arguments.area :
+    AreaKey = AreaIndex.Key(Area)
+    if ( AreaKey == None ) :
+        print('Area %s not found' % Area)
+        NotFoundCount += 1
+    elif ( Arguments.summary ) :
+        print('%s,%d postcodes' % (AreaKey,AreaIndex.Count(AreaKey)))
+    else:
+        for LookupRow in AreaIndex.Rows(AreaKey) : print(LookupRow)
+
+if ( len(Arguments.area) > 0 ) : AreaIndex.Close()
+
+# Close error log file
+ErrorMessage = 'Could not close ' + ErrorFilename
+if ( Utils.Close(ErrorFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+if ( NotFoundCount > 0 ) : sys.exit(1)
@@ -0,0 +1,382 @@
+# lookup_service.py
+#
+# Description
+# ===========
+#
+# This script runs a local HTTP service returning the MSOA and LTLA of UK postcodes.
+# The compact lookup file 'lookup_data.bin' created by 'generate_lookup.py' is loaded
+# once at startup and postcodes are joined against it using the sorted integer keys
+# of 'bulk_join.py'. The service runs on a single asyncio event loop and requires no
+# external services so it can be load tested locally. Results for recently requested
+# postcodes are held in an LRU cache.
+#
+# The following requests are supported:
+#
+# GET /postcode/<postcode>     Returns the MSOA and LTLA of a postcode e.g.
+#
+# {"Postcode": "BN14 0BH", "MsoaName": "High Salvington & Findon Valley", "MsoaCode": "E02006621",
+#  "MsoaPopulation": 7648, "LtlaName": "Worthing", "LtlaCode": "E07000229", "LtlaPopulation": 110570}
+#
+#                              or status 404 if the postcode is not found.
+#
+# POST /postcodes              Returns a JSON list of the results for a JSON list of postcodes
+#                              given as the request body. The result of each postcode that is
+#                              not found is null. Bulk requests use the cache but do not add
+#                              postcodes to it so they do not evict hot postcodes.
+#
+# GET /stats                   Returns request, postcode and cache hit counts, the cache hit
+#                              rate and the 50th, 90th and 99th percentile and maximum latency
+#                              in milliseconds of the most recent single and bulk requests.
+#
+# Postcodes may be given in any case and with or without spacing.
+#
+# Usage
+# =====
+#
+# python lookup_service.py [--host <address>] [--port <port>] [--cache-size <postcodes>]
+#                          [--lookup <compact lookup file>] [--json-log <file>]
+#
+# The service listens on 127.0.0.1 port 8080 by default and runs until interrupted or terminated.
+# 'benchmarks\load_service.py' can be used to load test the service.
+#
+# Data and configuration files
+# ============================
+#
+# This utility requires the file ..\data\lookup_data.bin created by 'generate_lookup.py'
+# and the third party NumPy package.
+#
+# Logging
+# =======
+#
+# This script logs error and status messages to the file .\log\log.txt an to the user console.
+# Individual requests are not logged. The request counts are logged when the service stops.
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import signal
+import time
+import urllib.parse
+import bulk_join as Join
+import numpy
+import log_writer as LogWriter
+import postcode_codec as Codec
+import utils as Utils
+
+# Default service address and number of postcodes held in the LRU cache
+Host = '127.0.0.1'
+Port = 8080
+CacheSize = 100000
+
+# Largest request body and number of postcodes accepted in a bulk request
+MaxBodySize = 16777216
+MaxBulkCount = 100000
+
+# Number of most recent request latencies from which percentiles are calculated
+LatencyWindow = 10000
+Percentiles = (50,90,99)
+
+# HTTP status reasons
+Reasons = {200 : 'OK', 400 : 'Bad Request', 404 : 'Not Found', 405 : 'Method Not Allowed', 413 : 'Payload Too Large'}
+
+# Return the 'percentile' percentile of the sorted list of values 'values'
+def Percentile (values,percentile) :
+
+    "Return a percentile of a sorted list of values"
+
+    return values[min(len(values) - 1,int(round(percentile / 100 * ( len(values) - 1 ))))]
+
+# Class answering postcode lookups from compact lookup file 'filename' and holding
+# the results of up to 'cachesize' recently requested postcodes.
+class LookupService :
+
+    "Answers postcode lookup requests"
+
+    def __init__ (self,filename,cachesize) :
+
+        self.join = Join.PostcodeJoin(filename)
+        self.count = len(self.join.keys)
+        self.cache = collections.OrderedDict()
+        self.cachesize = cachesize
+        self.counters = {'Requests' : 0, 'Errors' : 0, 'Postcodes' : 0, 'Found' : 0, 'CacheHits' : 0, 'CacheMisses' : 0}
+        self.latencies = {'Single' : collections.deque(maxlen=LatencyWindow), 'Bulk' : collections.deque(maxlen=LatencyWindow)}
+        self.started = time.time()
+
+        # Pre-render the JSON fields of every MSOA and LTLA
+        self.msoafields = ['"MsoaName": %s, "MsoaCode": %s, "MsoaPopulation": %d' % (json.dumps(name),json.dumps(code),population) for code,name,population in self.join.msoas]
+        self.authorityfields = ['"LtlaName": %s, "LtlaCode": %s, "LtlaPopulation": %d' % (json.dumps(name),json.dumps(code),population) for code,name,population in self.join.authorities]
+
+    # Return the JSON results of the list of postcode keys 'keys' ( see 'postcode_codec.py' )
+    # which are not cached. The result of a postcode that is not found is 'null'.
+    def Results (self,keys) :
+
+        "Return the JSON results of postcode keys"
+
+        msoaids,authorityids,matched = self.join.JoinKeys(numpy.array(keys,dtype=numpy.uint64))
+        self.counters['CacheMisses'] += len(keys)
+
+        results = []
+        for key,msoaid,authorityid in zip(keys,msoaids.tolist(),authorityids.tolist()) :
+            if ( msoaid == self.join.unmatchedmsoa ) :
+                results.append('null')
+            else:
+                results.append('{"Postcode": "%s", %s, %s}' % (Codec.Decode(key),self.msoafields[msoaid],self.authorityfields[authorityid]))
+
+        return results
+
+    # Return the JSON result of 'postcode' or 'null' if it is not found. The
+    # result is added to the cache.
+    def Lookup (self,postcode) :
+
+        "Return the JSON result of a postcode"
+
+        self.counters['Postcodes'] += 1
+        key = Codec.Encode(postcode)
+        if ( key == Codec.InvalidKey ) : return 'null'
+
+        result = self.cache.get(key)
+        if ( result != None ) :
+            self.cache.move_to_end(key)
+            self.counters['CacheHits'] += 1
+        else:
+            result = self.Results([key])[0]
+            self.cache[key] = result
+            if ( len(self.cache) > self.cachesize ) : self.cache.popitem(last=False)
+
+        if ( result != 'null' ) : self.counters['Found'] += 1
+
+        return result
+
+    # Return a list of the JSON results of the list of 'postcodes'. Cached results
+    # are used but results are not added to the cache.
+    def LookupMany (self,postcodes) :
+
+        "Return the JSON results of a list of postcodes"
+
+        self.counters['Postcodes'] += len(postcodes)
+        results = []
+        misses = []
+        missing = []
+
+        for position,postcode in enumerate(postcodes) :
+            key = Codec.Encode(postcode)
+            result = self.cache.get(key) if ( key != Codec.InvalidKey ) else 'null'
+            if ( result == None ) :
+                misses.append(key)
+                missing.append(position)
+            elif ( key != Codec.InvalidKey ) :
+                self.cache.move_to_end(key)
+                self.counters['CacheHits'] += 1
+            results.append(result)
+
+        if ( len(misses) > 0 ) :
+            for position,result in zip(missing,self.Results(misses)) : results[position] = result
+
+        self.counters['Found'] += sum(1 for result in results if ( result != 'null' ))
+
+        return results
+
+    # Return the service counters, cache hit rate and latency percentiles
+    def Statistics (self) :
+
+        "Return the service statistics"
+
+        statistics = dict(self.counters)
+        lookups = self.counters['CacheHits'] + self.counters['CacheMisses']
+        statistics['CacheHitRate'] = self.counters['CacheHits'] / lookups if ( lookups > 0 ) else 0.0
+        statistics['CacheEntries'] = len(self.cache)
+        statistics['IndexedPostcodes'] = self.count
+        statistics['UptimeSeconds'] = time.time() - self.started
+
+        statistics['Latency'] = {}
+        for kind,latencies in self.latencies.items() :
+            values = sorted(latencies)
+            latency = {'Count' : len(values)}
+            if ( len(values) > 0 ) :
+                for percentile in Percentiles : latency['P%d' % percentile] = Percentile(values,percentile) * 1000
+                latency['Max'] = values[-1] * 1000
+            statistics['Latency'][kind] = latency
+
+        return statistics
+
+    # Return the status, latency class and JSON body of the response to request
+    # 'method' 'target' with body 'body'
+    def Respond (self,method,target,body) :
+
+        "Return the response to a request"
+
+        path = urllib.parse.urlsplit(target).path
+
+        if ( path.startswith('/postcode/') ) :
+            if ( method != 'GET' ) : return 405,None,{'Error' : 'Use GET to look up a postcode'}
+            postcode = urllib.parse.unquote(path[len('/postcode/'):])
+            result = self.Lookup(postcode)
+            if ( result == 'null' ) : return 404,'Single',{'Error' : 'Postcode %s not found' % postcode}
+            return 200,'Single',result
+
+        if ( path == '/postcodes' ) :
+            if ( method != 'POST' ) : return 405,None,{'Error' : 'Use POST to look up a list of postcodes'}
+            try:
+                postcodes = json.loads(body)
+            except ValueError:
+                return 400,None,{'Error' : 'The request body is not JSON'}
+            if not ( isinstance(postcodes,list) and all(isinstance(postcode,str) for postcode in postcodes) ) :
+                return 400,None,{'Error' : 'The request body is not a list of postcodes'}
+            if ( len(postcodes) > MaxBulkCount ) : return 413,None,{'Error' : 'At most %d postcodes may be requested' % MaxBulkCount}
+            return 200,'Bulk','[' + ','.join(self.LookupMany(postcodes)) + ']'
+
+        if ( path == '/stats' ) :
+            if ( method != 'GET' ) : return 405,None,{'Error' : 'Use GET to read the statistics'}
+            return 200,None,self.Statistics()
+
+        return 404,None,{'Error' : 'Unknown resource %s' % path}
+
+    # Answer the HTTP requests of one client connection
+    async def Handle (self,reader,writer) :
+
+        "Answer the requests of a client connection"
+
+        try:
+            while True :
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError,asyncio.LimitOverrunError) :
+                    break
+                started = time.perf_counter()
+
+                lines = head.decode('latin-1').split('\r\n')
+                request = lines[0].split()
+                headers = {}
+                for line in lines[1:] :
+                    name,separator,value = line.partition(':')
+                    if ( separator != '' ) : headers[name.strip().lower()] = value.strip()
+
+                keepalive = False
+                try:
+                    length = int(headers.get('content-length','0'))
+                except ValueError:
+                    length = -1
+
+                if ( len(request) != 3 ) or ( length < 0 ) :
+                    status,kind,payload = 400,None,{'Error' : 'Malformed request'}
+                elif ( length > MaxBodySize ) :
+                    status,kind,payload = 413,None,{'Error' : 'The request body is larger than %d bytes' % MaxBodySize}
+                else:
+                    method,target,version = request
+                    body = await reader.readexactly(length) if ( length > 0 ) else b''
+                    connection = headers.get('connection','').lower()
+                    keepalive = ( connection == 'keep-alive' ) if ( version == 'HTTP/1.0' ) else ( connection != 'close' )
+                    status,kind,payload = self.Respond(method,target,body)
+
+                self.counters['Requests'] += 1
+                if ( status >= 400 ) : self.counters['Errors'] += 1
+
+                data = ( payload if ( isinstance(payload,str) ) else json.dumps(payload) ).encode('utf-8')
+                header = 'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n' % (status,Reasons[status],len(data),'keep-alive' if ( keepalive ) else 'close')
+                writer.write(header.encode('latin-1') + data)
+                await writer.drain()
+
+                if ( kind != None ) : self.latencies[kind].append(time.perf_counter() - started)
+                if not ( keepalive ) : break
+
+        except (ConnectionError,asyncio.IncompleteReadError) :
+            pass
+        finally:
+            writer.close()
+
+# Serve requests using 'service' on address 'host' port 'port' until interrupted or terminated
+async def Serve (service,host,port) :
+
+    "Serve requests until interrupted or terminated"
+
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,stop.set)
+    except (NotImplementedError,AttributeError) :
+        pass
+
+    server = await asyncio.start_server(service.Handle,host,port,limit=65536)
+    async with server :
+        await stop.wait()
+
+############
+### MAIN ###
+############
+
+def Main () :
+
+    "Runs the postcode lookup service"
+
+    # File names and modes
+    Currentdir = os.getcwd()
+    LogDir = os.path.join(Currentdir,'log')
+    ErrorFilename = os.path.join(LogDir,'log.txt')
+    DataDir = os.path.join(Currentdir,'data')
+    CompactFilename = os.path.join(DataDir,'lookup_data.bin')
+
+    # Function return values
+    failure = 0
+
+    # Error levels
+    error = 'ERROR'
+    warning = 'WARNING'
+    info = 'INFO'
+
+    # Script names
+    module = 'lookup_service.py'
+
+    # Parse command line
+    Parser = argparse.ArgumentParser(description='Run a local HTTP service returning the MSOA and LTLA of UK postcodes')
+    Parser.add_argument('--host',default=Host,help='address to listen on')
+    Parser.add_argument('--port',type=int,default=Port,help='port to listen on')
+    Parser.add_argument('--cache-size',dest='cachesize',type=int,default=CacheSize,help='number of postcodes held in the LRU cache')
+    Parser.add_argument('--lookup',default=CompactFilename,help='compact lookup file')
+    LogWriter.AddArguments(Parser)
+    Arguments = Parser.parse_args()
+
+    # Create/open log file
+    ErrorFileObject = Utils.OpenLog(ErrorFilename,failure,Arguments.jsonlog)
+    ErrorMessage = 'Could not open ' + ErrorFilename
+    if ( ErrorFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Log start of script
+    Utils.Logerror(ErrorFileObject,module,'Started',info)
+
+    # Load compact lookup file
+    ErrorMessage = 'Reading compact lookup file %s ' % Arguments.lookup
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    try:
+        Service = LookupService(Arguments.lookup,Arguments.cachesize)
+    except (OSError,ValueError) :
+        ErrorMessage = 'Could not read compact lookup file ' + Arguments.lookup
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Serve requests until interrupted
+    ErrorMessage = 'Serving %d postcodes on http://%s:%d/ ' % (Service.count,Arguments.host,Arguments.port)
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    try:
+        asyncio.run(Serve(Service,Arguments.host,Arguments.port))
+    except KeyboardInterrupt:
+        pass
+    except OSError as Error :
+        ErrorMessage = 'Could not listen on %s port %d: %s' % (Arguments.host,Arguments.port,Error)
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Log request counts
+    Statistics = Service.Statistics()
+    ErrorMessage = 'A total of %d requests for %d postcodes were answered with a cache hit rate of %.1f%% ' % (Statistics['Requests'],Statistics['Postcodes'],Statistics['CacheHitRate'] * 100)
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    # Log end of script
+    Utils.Logerror(ErrorFileObject,module,'Completed',info)
+
+    # Close error log file
+    ErrorMessage = 'Could not close ' + ErrorFilename
+    if ( Utils.Close(ErrorFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+if ( __name__ == '__main__' ) :
+    Main()
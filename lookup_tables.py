@@ -0,0 +1,101 @@
+# lookup_tables.py
+#
+# Description
+# ===========
+#
+# This module provides the compact in memory tables of MSOAs and LTLAs used by
+# 'generate_lookup.py' and 'compact_lookup.py'. Rather than holding a dictionary of
+# fields for each entry a table holds the codes, names and populations of its entries
+# in parallel arrays and gives each entry a small integer id, its position in the
+# table. A single index maps each code to its id so joining a postcode to its MSOA
+# or LTLA takes one dictionary lookup after which all fields are found by position.
+#
+# Example:
+#
+# Msoas = Table()
+# MsoaId = Msoas.Add('E02006621','High Salvington & Findon Valley',7648)
+# Msoas.Id('E02006621')          -> 0
+# Msoas.names[MsoaId]            -> 'High Salvington & Findon Valley'
+# list(Msoas)                    -> [('E02006621','High Salvington & Findon Valley',7648)]
+
+from array import array
+
+# Class holding the codes, names and populations of a table of MSOAs or LTLAs
+# in parallel arrays indexed by entry id.
+class Table :
+
+    "Holds the codes, names and populations of MSOAs or LTLAs"
+
+    __slots__ = ('codes','names','populations','index')
+
+    def __init__ (self,entries=()) :
+
+        self.codes = []
+        self.names = []
+        self.populations = array('q')
+        self.index = {}
+
+        for code,name,population in entries : self.Add(code,name,population)
+
+    # Add an entry and return its id. An entry with an existing code replaces
+    # the previous entry and keeps its id.
+    def Add (self,code,name,population) :
+
+        "Add an entry and return its id"
+
+        entryid = self.index.get(code)
+        if ( entryid != None ) :
+            self.names[entryid] = name
+            self.populations[entryid] = population
+            return entryid
+
+        entryid = len(self.codes)
+        self.index[code] = entryid
+        self.codes.append(code)
+        self.names.append(name)
+        self.populations.append(population)
+
+        return entryid
+
+    # Return the id of the entry with code 'code' or None if there is no such entry
+    def Id (self,code) :
+
+        "Return the id of an entry"
+
+        return self.index.get(code)
+
+    # Return the (Code,Name,Population) tuple of entry 'entryid'
+    def Entry (self,entryid) :
+
+        "Return the fields of an entry"
+
+        return self.codes[entryid],self.names[entryid],self.populations[entryid]
+
+    # Return a list of the csv fields '<Name>,<Code>,<Population>' of each entry
+    # preceded by 'prefix' and followed by 'suffix'
+    def Render (self,prefix='',suffix='') :
+
+        "Return the rendered csv fields of each entry"
+
+        return ['%s%s,%s,%d%s' % (prefix,name,code,population,suffix) for code,name,population in zip(self.codes,self.names,self.populations)]
+
+    def __len__ (self) :
+
+        return len(self.codes)
+
+    def __contains__ (self,code) :
+
+        return code in self.index
+
+    def __iter__ (self) :
+
+        return zip(self.codes,self.names,self.populations)
+
+    def __getstate__ (self) :
+
+        return self.codes,self.names,self.populations
+
+    def __setstate__ (self,state) :
+
+        self.codes,self.names,self.populations = state
+        self.index = {code : entryid for entryid,code in enumerate(self.codes)}
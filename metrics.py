@@ -0,0 +1,257 @@
+# metrics.py
+#
+# Description
+# ===========
+#
+# This module records metrics for each stage of 'retrieve_files.py' and 'generate_lookup.py'
+# and writes them to a JSON metrics file at the end of each run. For each stage the wall
+# clock and CPU seconds, number of rows processed, rows per second, bytes read and written
+# and the peak resident memory of the process at the end of the stage are recorded.
+#
+# Optional profiling is enabled by command line flags added by 'AddArguments':
+#
+# --metrics <file>      Write the metrics to <file> rather than .\log\<script>_metrics.json
+# --profile <file>      Profile the run using cProfile and write the statistics to <file>
+#                       which can be read using the 'pstats' module
+# --trace-memory        Trace memory allocations using tracemalloc and record the peak
+#                       traced memory of each stage and the largest allocation sites. This
+#                       slows the run considerably.
+#
+# Metrics file
+# ============
+#
+# The metrics file has the following form:
+#
+# {"Module": "generate_lookup.py", "Started": "2020-06-01T09:00:00", "Seconds": ..., "CpuSeconds": ...,
+#  "PeakMemory": ..., "Stages": [{"Stage": "Authorities", "Seconds": ..., "CpuSeconds": ..., "Rows": ...,
+#  "RowsPerSecond": ..., "BytesRead": ..., "BytesWritten": ..., "PeakMemory": ...}, ...]}
+#
+# Memory is given in bytes and is null where it can not be measured. When memory tracing
+# is enabled each stage also holds "TracedPeakMemory" and the file holds "TopAllocations".
+#
+# Usage
+# =====
+#
+# The stages of two metrics files can be compared using:
+#
+# python metrics.py <previous metrics file> <current metrics file>
+
+import cProfile
+import ctypes
+import datetime
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Number of allocation sites recorded when tracing memory
+TopAllocationCount = 10
+
+# Return the peak resident memory of this process in bytes or None if it can not be measured
+def PeakMemory () :
+
+    "Return the peak resident memory of this process"
+
+    if ( resource != None ) :
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if ( sys.platform == 'darwin' ) else peak * 1024
+
+    if ( os.name == 'nt' ) :
+        class ProcessMemoryCounters (ctypes.Structure) :
+            _fields_ = [('cb',ctypes.c_ulong),('PageFaultCount',ctypes.c_ulong),('PeakWorkingSetSize',ctypes.c_size_t),('WorkingSetSize',ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage',ctypes.c_size_t),('QuotaPagedPoolUsage',ctypes.c_size_t),('QuotaPeakNonPagedPoolUsage',ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage',ctypes.c_size_t),('PagefileUsage',ctypes.c_size_t),('PeakPagefileUsage',ctypes.c_size_t)]
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        try:
+            process = ctypes.windll.kernel32.GetCurrentProcess()
+            if ( ctypes.windll.psapi.GetProcessMemoryInfo(process,ctypes.byref(counters),counters.cb) ) : return counters.PeakWorkingSetSize
+        except (AttributeError,OSError) :
+            pass
+
+    return None
+
+# Return the size of file 'filename' or 0 if it does not exist
+def FileSize (filename) :
+
+    "Return the size of a file"
+
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 0
+
+# Adds the metrics command line arguments to argparse parser 'parser'
+def AddArguments (parser) :
+
+    "Adds the metrics command line arguments"
+
+    parser.add_argument('--metrics',help='metrics file to write')
+    parser.add_argument('--profile',help='profile the run and write the cProfile statistics to this file')
+    parser.add_argument('--trace-memory',dest='tracememory',action='store_true',help='trace memory allocations of each stage')
+
+# Class recording the metrics of one stage. The number of rows processed and the
+# bytes read and written are set while the stage runs. If 'seconds' is set the stage
+# records it in place of the time between 'Start' and 'Stop', for stages whose work is
+# done and timed elsewhere such as on a sink's thread.
+class Stage :
+
+    "Records the metrics of one stage"
+
+    def __init__ (self,metrics,name) :
+
+        self.metrics = metrics
+        self.name = name
+        self.rows = 0
+        self.bytesread = 0
+        self.byteswritten = 0
+        self.seconds = None
+
+    # Add the size of file 'filename' to the bytes read
+    def Read (self,filename) :
+
+        "Add the size of a file to the bytes read"
+
+        self.bytesread += FileSize(filename)
+
+    # Add the size of file 'filename' to the bytes written
+    def Written (self,filename) :
+
+        "Add the size of a file to the bytes written"
+
+        self.byteswritten += FileSize(filename)
+
+    # Start timing the stage
+    def Start (self) :
+
+        "Start timing the stage"
+
+        if ( self.metrics.tracememory ) and ( hasattr(tracemalloc,'reset_peak') ) : tracemalloc.reset_peak()
+        self.starttime = time.perf_counter()
+        self.startcpu = time.process_time()
+
+        return self
+
+    # Stop timing the stage and record its metrics
+    def Stop (self) :
+
+        "Stop timing the stage and record its metrics"
+
+        seconds = time.perf_counter() - self.starttime if ( self.seconds == None ) else self.seconds
+        record = {'Stage' : self.name, 'Seconds' : seconds, 'CpuSeconds' : time.process_time() - self.startcpu, 'Rows' : self.rows,
+                  'RowsPerSecond' : self.rows / max(seconds,1e-9), 'BytesRead' : self.bytesread, 'BytesWritten' : self.byteswritten, 'PeakMemory' : PeakMemory()}
+        if ( self.metrics.tracememory ) : record['TracedPeakMemory'] = tracemalloc.get_traced_memory()[1]
+        self.metrics.stages.append(record)
+
+        return record
+
+    def __enter__ (self) :
+
+        return self.Start()
+
+    def __exit__ (self,exceptiontype,exception,traceback) :
+
+        self.Stop()
+
+# Class recording the metrics of a run of script 'module'. Profiling and memory
+# tracing are enabled as given by the 'profile' and 'tracememory' arguments
+# added by 'AddArguments'.
+class Metrics :
+
+    "Records the metrics of a run"
+
+    def __init__ (self,module,arguments=None) :
+
+        self.module = module
+        self.stages = []
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.starttime = time.perf_counter()
+        self.startcpu = time.process_time()
+
+        self.profilefilename = getattr(arguments,'profile',None)
+        self.tracememory = getattr(arguments,'tracememory',False)
+        self.profiler = None
+
+        if ( self.tracememory ) : tracemalloc.start()
+        if ( self.profilefilename != None ) :
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    # Return a 'Stage' object recording the metrics of stage 'name'. The stage may
+    # be used in a 'with' statement or timed using its 'Start' and 'Stop' methods.
+    def Stage (self,name) :
+
+        "Return an object recording the metrics of a stage"
+
+        return Stage(self,name)
+
+    # Return a started 'Stage' object recording the metrics of stage 'name'
+    def Start (self,name) :
+
+        "Start timing a stage"
+
+        return Stage(self,name).Start()
+
+    # Stop profiling and write the metrics to file 'filename'. Returns the stage metrics.
+    def Save (self,filename) :
+
+        "Write the metrics file"
+
+        results = {'Module' : self.module, 'Started' : self.started, 'Seconds' : time.perf_counter() - self.starttime,
+                   'CpuSeconds' : time.process_time() - self.startcpu, 'PeakMemory' : PeakMemory(), 'Stages' : self.stages}
+
+        if ( self.profiler != None ) :
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profilefilename)
+            results['Profile'] = self.profilefilename
+
+        if ( self.tracememory ) :
+            statistics = tracemalloc.take_snapshot().statistics('lineno')[:TopAllocationCount]
+            results['TopAllocations'] = [{'Location' : str(statistic.traceback[0]), 'Bytes' : statistic.size, 'Count' : statistic.count} for statistic in statistics]
+            tracemalloc.stop()
+
+        with open(filename + '.part','w') as fileobject :
+            json.dump(results,fileobject,indent=1)
+        os.replace(filename + '.part',filename)
+
+        return self.stages
+
+# Return a one line summary of stage metrics 'record'
+def Summary (record) :
+
+    "Return a one line summary of a stage"
+
+    return 'Stage %s took %.3f seconds ( %.3f CPU ) processing %d rows at %.0f rows/sec ' % (record['Stage'],record['Seconds'],record['CpuSeconds'],record['Rows'],record['RowsPerSecond'])
+
+# Return a list of lines comparing the stages of metrics 'previous' and 'current'
+def Compare (previous,current) :
+
+    "Return lines comparing the stages of two sets of metrics"
+
+    previousstages = {stage['Stage'] : stage for stage in previous['Stages']}
+    lines = ['%-16s %10s %10s %8s %14s %14s' % ('Stage','Previous','Current','Change','Previous rows/s','Current rows/s')]
+    for stage in current['Stages'] :
+        old = previousstages.get(stage['Stage'])
+        if ( old == None ) :
+            lines.append('%-16s %10s %10.3f %8s %14s %14.0f' % (stage['Stage'],'-',stage['Seconds'],'-','-',stage['RowsPerSecond']))
+        else:
+            change = ( stage['Seconds'] - old['Seconds'] ) / max(old['Seconds'],1e-9) * 100
+            lines.append('%-16s %10.3f %10.3f %+7.1f%% %14.0f %14.0f' % (stage['Stage'],old['Seconds'],stage['Seconds'],change,old['RowsPerSecond'],stage['RowsPerSecond']))
+
+    return lines
+
+# Compare the stages of two metrics files
+if ( __name__ == '__main__' ) :
+
+    if ( len(sys.argv) != 3 ) :
+        print('Usage: python metrics.py <previous metrics file> <current metrics file>')
+        sys.exit(1)
+
+    with open(sys.argv[1],'r') as PreviousFile, open(sys.argv[2],'r') as CurrentFile :
+        for Line in Compare(json.load(PreviousFile),json.load(CurrentFile)) : print(Line)
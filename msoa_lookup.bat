@@ -9,24 +9,23 @@ rem file consists of the following fields:
 rem 
 rem <Post code>,<MSOA name><MSOA code>,<MSOA population>,<LTLA name><LTLA code>,<LTLA population>
 rem
-rem This script invokes Python utilities 'retrieve_files.py' and 
-rem 'generate_lookup.py' and assumes that the 7-Zip utility is installed 
-rem in directory C:\Program Files\7-Zip
+rem This script invokes Python utilities 'retrieve_files.py', 'prepare_files.py' 
+rem and 'generate_lookup.py'
 rem
-rem File 'lookup_data.csv' can be searched using 'findstr' to determine the 
+rem File 'lookup_data.csv' can be searched using 'lookup_postcode.py' to determine the 
 rem LTLA in which a postocode resides which is required when looking up data
 rem provided at an LTLA level on the government's COVID-19 portal.
 rem
 rem e.g.
 rem
-rem findstr /C:"BN14 0BH" lookup_data.csv
+rem python lookup_postcode.py "BN14 0BH"
 rem 
 rem Gives the following output.
 rem
 rem BN14 0BH,High Salvington & Findon Valley,E02006621,7648,Worthing,E07000229,110570
 rem
-rem A compressed version of this data file 'lookup_data.zip' is also generated to
-rem make distribution of this large file easier. 
+rem A block compressed version of this data file 'lookup_data.csv.gz' is also generated
+rem by 'generate_lookup.py' to make distribution of this large file easier. 
  
 rem Create variables
 rem
@@ -43,10 +42,9 @@ set LookupFile=lookup_data
 set TempDir=c:\temp
 rem
 rem Executables
-set Zip="C:\Program Files\7-Zip\7z.exe"
 set RetrieveFiles=%ScriptDir%\retrieve_files.py
+set PrepareFiles=%ScriptDir%\prepare_files.py
 set GenerateLookup=%ScriptDir%\generate_lookup.py
-set ExtractPopulations=%ScriptDir%\extract_populations.vbs
 
 rem Move to script directory
 cd %ScriptDir%
@@ -54,26 +52,19 @@ cd %ScriptDir%
 rem Remove old log file
 erase %LogFile%
 
-rem Retrieve source data files from web locations to temporary storage
-%RetrieveFiles%
+rem Retrieve source data files from web locations to temporary storage. Files
+rem are downloaded through the download cache and exit status 2 indicates that
+rem no file has changed since lookup_data.csv was last generated so it does not
+rem need to be regenerated. Changed files are recorded in the download cache by
+rem prepare_files.py and generate_lookup.py once each completes.
+python %RetrieveFiles%
+if errorlevel 2 goto Unchanged
 
 rem Generate input data files from temporary data files by extracting data for England
 rem and ordering data records 
 
-rem Generate msoa_names.csv
-type %TempDir%\%NamesFile%.csv | findstr "^E" | findstr /V "^W" | sort > %DataDir%\%NamesFile%.csv
-
-rem Generate msoa_populations.csv
-%Zip% rn %TempDir%\%PopulationsFile%.zip SAPE22DT4-mid-2019-msoa-syoa-estimates-unformatted.xlsx %PopulationsFile%.xlsx 
-%Zip% e %TempDir%\%PopulationsFile%.zip -o%TempDir% %PopulationsFile%.xlsx -y -r 
-%ExtractPopulations%
-type %TempDir%\%PopulationsFile%.csv | findstr "^E" | findstr /V "^W" | sort > %DataDir%\%PopulationsFile%.csv
-
-rem Generate authority_data.csv
-%Zip% e %TempDir%\%AuthorityFile%.zip -so "LA_UA names and codes UK as at 04_20.csv" | findstr "^E" | findstr /V "^W" | sort > %DataDir%\%AuthorityFile%.csv
-
-rem Generate postcode_data.csv
-%Zip% e %TempDir%\%PostcodesFile%.zip -so "gridall.csv" | findstr /C:"E0200" | findstr /V /C:"W0200" | findstr /V /C:"N99999999" > %DataDir%\%PostcodesFile%.csv
+rem Generate msoa_names.csv, msoa_populations.csv, authority_data.csv and postcode_data.csv
+python %PrepareFiles%
 
 rem Remove temporary files
 erase /f /s %TempDir%\%AuthorityFile%.zip
@@ -81,14 +72,15 @@ erase /f /s %TempDir%\%NamesFile%.csv
 erase /f /s %TempDir%\%PostcodesFile%.zip
 erase /f /s %TempDir%\%PopulationsFile%.*
 
-rem Generate lookup_data.csv 
-%GenerateLookup%
+rem Generate lookup_data.csv and compressed lookup data file lookup_data.csv.gz
+%GenerateLookup% --workers 0
 cd %DataDir%
 
-rem Create compressed lookup data file lookup_data.zip.
-%Zip% a %LookupFile%.zip %LookupFile%.csv
-
 rem Remove all csv files.
 rem
 rem NOTE: This line should be removed once software is installed
-erase  /f /s *.csv
\ No newline at end of file
+erase  /f /s *.csv
+goto :eof
+
+:Unchanged
+echo Source data files have not changed, lookup data was not regenerated
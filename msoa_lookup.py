@@ -0,0 +1,95 @@
+# msoa_lookup.py
+#
+# Description
+# ===========
+#
+# This module allows the lookup to be used from other Python programs rather than by
+# running the scripts. Importing it only imports 'os' so a program which imports it
+# starts in well under a millisecond more. The modules which retrieve, generate and
+# search the lookup files are only imported when they are first used and the lookup
+# files are only opened when the first postcode is looked up.
+#
+# Usage
+# =====
+#
+# import msoa_lookup
+#
+# Row = msoa_lookup.Lookup('BN14 0BH')
+#
+# Returns the row of 'lookup_data.csv' for a postcode e.g.
+#
+# BN14 0BH,High Salvington & Findon Valley,E02006621,7648,Worthing,E07000229,110570
+#
+# or an empty string if the postcode is not present. Postcodes may be given in any case
+# and with or without spacing. Rows are located using index file 'lookup_data.idx' ( see
+# 'postcode_index.py' ) which stays open until 'Close' is called.
+#
+# Statistics = msoa_lookup.Generate('--workers','0')
+# Status = msoa_lookup.Retrieve()
+#
+# Run 'generate_lookup.py' and 'retrieve_files.py' in the calling process with the given
+# command line arguments. 'Generate' returns the postcode counts and 'Retrieve' the exit
+# status of the script.
+#
+# Data and configuration files
+# ============================
+#
+# As with the scripts the log, config and data directories are those of the current
+# directory. Errors are logged to the log file and end the script by raising SystemExit
+# which the caller may catch.
+
+import os
+
+# Lookups opened by 'LoadLookup' by data directory
+Loaded = {}
+
+# Return the postcode index of the lookup files in data directory 'datadir' or the data
+# directory of the current directory if 'datadir' is None. Each index is opened once.
+def LoadLookup (datadir=None) :
+
+    "Return the postcode index of the lookup files"
+
+    datadir = datadir or os.path.join(os.getcwd(),'data')
+    index = Loaded.get(datadir)
+    if ( index == None ) :
+        import postcode_index as Index
+        index = Loaded[datadir] = Index.PostcodeIndex(os.path.join(datadir,'lookup_data.csv'),os.path.join(datadir,'lookup_data.idx'))
+
+    return index
+
+# Return the lookup file row for 'postcode' without its line ending or an empty string
+# if 'postcode' is not present
+def Lookup (postcode,datadir=None) :
+
+    "Return the lookup file row for 'postcode'"
+
+    return LoadLookup(datadir).Lookup(postcode).rstrip('\r\n')
+
+# Close the lookups opened by 'LoadLookup'
+def Close () :
+
+    "Close the open lookups"
+
+    for index in Loaded.values() : index.Close()
+    Loaded.clear()
+
+# Generate the lookup files with the command line arguments 'arguments' of
+# 'generate_lookup.py'. Open lookups are closed first as their files are replaced.
+def Generate (*arguments) :
+
+    "Generate the lookup files"
+
+    Close()
+    import generate_lookup
+
+    return generate_lookup.Main(list(arguments))
+
+# Retrieve the source data files with the command line arguments 'arguments' of
+# 'retrieve_files.py'
+def Retrieve (*arguments) :
+
+    "Retrieve the source data files"
+
+    import retrieve_files
+
+    return retrieve_files.Main(list(arguments))
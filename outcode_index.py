@@ -0,0 +1,193 @@
+# outcode_index.py
+#
+# Description
+# ===========
+#
+# This module builds and searches outcode index file 'lookup_data.outcodes' for the file
+# 'lookup_data.csv' created by 'generate_lookup.py'. The outcode of a postcode is the
+# outward code preceding its 3 character inward code e.g. 'BN14' for 'BN14 0BH'. For each
+# outcode the index records the ranges of 'lookup_data.csv' rows holding its postcodes,
+# its postcode count and the codes of the distinct MSOAs and LTLAs its postcodes lie in.
+# All the postcodes of an outcode are read with one seek per row range, normally one,
+# and the MSOAs and LTLAs of an outcode are returned without reading 'lookup_data.csv'.
+#
+# The MSOA and LTLA of each row are read from compact lookup file 'lookup_data.bin'
+# ( see 'compact_lookup.py' ) which holds one record for each row of 'lookup_data.csv'
+# in the same order.
+#
+# Index file layout
+# =================
+#
+# The index file is JSON of the following form:
+#
+# {"LookupSize": <size of lookup_data.csv>, "Outcodes": {"BN14": {"Postcodes": 1021,
+#  "Ranges": [{"Offset": <byte offset>, "Length": <bytes>, "Row": <first row>, "Rows": <rows>}],
+#  "Msoas": ["E02006621", ...], "Ltlas": ["E07000229"]}, ...},
+#  "MsoaNames": {"E02006621": "High Salvington & Findon Valley", ...}, "LtlaNames": {"E07000229": "Worthing", ...}}
+#
+# Offsets and rows are counted from the start of 'lookup_data.csv'.
+
+import json
+import locale
+import os
+import compact_lookup as Compact
+
+# Return the outcode of 'postcode' in upper case
+def Outcode (postcode) :
+
+    "Return the outcode of a postcode"
+
+    return ''.join(postcode.split()).upper()[:-3]
+
+# Builds outcode index file 'outcodefilename' from lookup file 'lookupfilename' and
+# compact lookup file 'compactfilename'. Returns the number of outcodes indexed.
+def BuildOutcodeIndex (lookupfilename,compactfilename,outcodefilename,failure) :
+
+    "Builds an outcode index file for the lookup file 'lookupfilename'"
+
+    outcodes = {}
+    ranges = []
+    offset = 0
+    row = 0
+    current = None
+
+    try:
+        lookup = Compact.CompactLookup(compactfilename)
+        end = lookup.recordoffset + lookup.count * Compact.CompactRecord.size
+        view = memoryview(lookup.buffer)[lookup.recordoffset:end]
+        records = Compact.CompactRecord.iter_unpack(view)
+
+        with open(lookupfilename,'rb') as lookupfile :
+            for line,(postcode,msoaid,authorityid) in zip(lookupfile,records) :
+
+                # Rows of the same outcode are normally consecutive
+                outcode = postcode.rstrip(b'\x00')[:-3].strip()
+                if ( outcode != current ) :
+                    if ( current != None ) : ranges[-1] += [offset - ranges[-1][0],row - ranges[-1][1]]
+                    current = outcode
+                    entry = outcodes.get(outcode)
+                    if ( entry == None ) : entry = outcodes[outcode] = [[],set(),set()]
+                    ranges.append([offset,row])
+                    entry[0].append(len(ranges) - 1)
+                    msoas = entry[1]
+                    authorities = entry[2]
+                    lastmsoa = lastauthority = None
+
+                if ( msoaid != lastmsoa ) :
+                    msoas.add(msoaid)
+                    lastmsoa = msoaid
+                if ( authorityid != lastauthority ) :
+                    authorities.add(authorityid)
+                    lastauthority = authorityid
+
+                offset += len(line)
+                row += 1
+
+        if ( current != None ) : ranges[-1] += [offset - ranges[-1][0],row - ranges[-1][1]]
+
+        # Each row of the lookup file must have a compact record
+        aligned = ( row == lookup.count ) and ( offset == os.path.getsize(lookupfilename) )
+        msoacodes = lookup.msoas.codes
+        authoritycodes = lookup.authorities.codes
+        names = {'MsoaNames' : dict(zip(lookup.msoas.codes,lookup.msoas.names)), 'LtlaNames' : dict(zip(lookup.authorities.codes,lookup.authorities.names))}
+        del records
+        view.release()
+        lookup.Close()
+        if not ( aligned ) : return failure
+
+        index = {}
+        for outcode in sorted(outcodes) :
+            positions,msoas,authorities = outcodes[outcode]
+            outcoderanges = [{'Offset' : ranges[position][0], 'Length' : ranges[position][2], 'Row' : ranges[position][1], 'Rows' : ranges[position][3]} for position in positions]
+            index[outcode.decode('ascii').upper()] = {'Postcodes' : sum(outcoderange['Rows'] for outcoderange in outcoderanges), 'Ranges' : outcoderanges,
+                                                      'Msoas' : sorted(msoacodes[msoaid] for msoaid in msoas), 'Ltlas' : sorted(authoritycodes[authorityid] for authorityid in authorities)}
+
+        with open(outcodefilename + '.part','w') as outcodefile :
+            json.dump(dict(names,LookupSize=offset,Outcodes=index),outcodefile)
+        os.replace(outcodefilename + '.part',outcodefilename)
+    except (OSError,ValueError,UnicodeDecodeError) :
+        return failure
+
+    return len(index)
+
+# Class answering outcode queries of a lookup file using its outcode index file.
+class OutcodeIndex :
+
+    "Answers outcode queries using an outcode index file"
+
+    def __init__ (self,lookupfilename,outcodefilename) :
+
+        with open(outcodefilename,'r') as outcodefile :
+            index = json.load(outcodefile)
+
+        self.lookupfilename = lookupfilename
+        self.outcodes = index['Outcodes']
+        self.msoanames = index['MsoaNames']
+        self.authoritynames = index['LtlaNames']
+        if ( index['LookupSize'] != os.path.getsize(lookupfilename) ) :
+            raise ValueError('%s does not index the current %s' % (outcodefilename,lookupfilename))
+
+    # Return the indexed outcode of 'outcode' or None if it is not present. 'outcode'
+    # may be given in any case and as a full postcode.
+    def Key (self,outcode) :
+
+        "Return the indexed outcode of an outcode or postcode"
+
+        outcode = ''.join(outcode.split()).upper()
+        if ( outcode in self.outcodes ) : return outcode
+        if ( len(outcode) > 4 ) and ( Outcode(outcode) in self.outcodes ) : return Outcode(outcode)
+
+        return None
+
+    # Return the index entry of 'outcode' or None if it is not present
+    def Entry (self,outcode) :
+
+        "Return the index entry of an outcode"
+
+        key = self.Key(outcode)
+
+        return self.outcodes[key] if ( key != None ) else None
+
+    # Return a list of the lookup file rows of the postcodes of 'outcode'
+    def Rows (self,outcode) :
+
+        "Return the lookup file rows of an outcode"
+
+        entry = self.Entry(outcode)
+        if ( entry == None ) : return []
+
+        rows = []
+        encoding = locale.getpreferredencoding(False)
+        with open(self.lookupfilename,'rb') as lookupfile :
+            for outcoderange in entry['Ranges'] :
+                lookupfile.seek(outcoderange['Offset'])
+                rows.extend(lookupfile.read(outcoderange['Length']).decode(encoding).splitlines())
+
+        return rows
+
+    # Return the number of postcodes of 'outcode'
+    def Count (self,outcode) :
+
+        "Return the number of postcodes of an outcode"
+
+        entry = self.Entry(outcode)
+
+        return entry['Postcodes'] if ( entry != None ) else 0
+
+    # Return a list of the codes of the MSOAs of 'outcode'
+    def Msoas (self,outcode) :
+
+        "Return the MSOA codes of an outcode"
+
+        entry = self.Entry(outcode)
+
+        return entry['Msoas'] if ( entry != None ) else []
+
+    # Return a list of the codes of the LTLAs of 'outcode'
+    def Authorities (self,outcode) :
+
+        "Return the LTLA codes of an outcode"
+
+        entry = self.Entry(outcode)
+
+        return entry['Ltlas'] if ( entry != None ) else []
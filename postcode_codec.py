@@ -0,0 +1,139 @@
+# postcode_codec.py
+#
+# Description
+# ===========
+#
+# This module converts UK postcodes to and from a canonical integer key. Postcodes are
+# first normalised by removing all spacing and converting to upper case and then laid
+# out as 7 characters with the outward code left justified in 4 characters followed by
+# the 3 character inward code, for example:
+#
+# 'bn14 0bh' -> 'BN140BH'
+# 'N1 1AA'   -> 'N1  1AA'
+#
+# This is the 'pcd' form of the ONS postcode directory and the order in which its
+# postcodes are sorted. Each of the 7 characters is held in 6 bits of the key, first
+# character in the most significant bits, using the following values:
+#
+# <space> = 0, '0' to '9' = 1 to 10, 'A' to 'Z' = 11 to 36
+#
+# so keys are at most 42 bits long, fit any 64 bit integer type and sort in the same order
+# as the normalised postcodes. Postcodes that can not be valid UK postcodes, that is those
+# which are not 5 to 7 letters and digits starting with a letter and ending with an inward
+# code of a digit followed by two letters, are given key 0. No valid postcode has key 0 as
+# the first character of a valid postcode is a letter.
+#
+# Usage
+# =====
+#
+# Key = Codec.Encode('BN14 0BH')
+# Postcode = Codec.Decode(Key)
+
+import string
+
+# Key layout
+CharacterBits = 6
+KeyLength = 7
+InwardLength = 3
+KeyBits = CharacterBits * KeyLength
+CharacterMask = ( 1 << CharacterBits ) - 1
+InvalidKey = 0
+
+# Characters in order of their values
+Symbols = ' ' + string.digits + string.ascii_uppercase
+
+# Value of each character
+Values = {character : value for value,character in enumerate(Symbols)}
+
+# Keys of the outward and inward codes already encoded. There are only a few thousand
+# outward codes and inward codes so each is only encoded once.
+OutwardKeys = {}
+InwardKeys = {}
+
+# Return True if 'compact', a postcode in upper case without spacing, has the form of a
+# UK postcode
+def Valid (compact) :
+
+    "Return True if a postcode has the form of a UK postcode"
+
+    if ( len(compact) < 5 ) or ( len(compact) > KeyLength ) : return False
+    if not ( compact.isascii() and compact.isalnum() ) : return False
+
+    return compact[0].isalpha() and compact[-InwardLength].isdigit() and compact[-InwardLength + 1:].isalpha()
+
+# Return the normalised form of 'postcode' or an empty string if
+# 'postcode' can not be a valid UK postcode.
+def Normalise (postcode) :
+
+    "Return the normalised form of a postcode"
+
+    compact = ''.join(postcode.split()).upper()
+    if not ( Valid(compact) ) : return ''
+
+    return compact[:-InwardLength].ljust(KeyLength - InwardLength) + compact[-InwardLength:]
+
+# Return the key of normalised postcode 'normalised' ( see 'Normalise' )
+def EncodeNormalised (normalised) :
+
+    "Return the key of a normalised postcode"
+
+    key = 0
+    for character in normalised :
+        key = ( key << CharacterBits ) | Values[character]
+
+    return key
+
+# Return the key of 'postcode' or 'InvalidKey' if 'postcode' can not be a valid UK postcode
+def Encode (postcode) :
+
+    "Return the key of a postcode"
+
+    # Postcodes in printed form whose outward and inward codes have been seen before
+    if ( postcode[-InwardLength - 1:-InwardLength] == ' ' ) :
+        outwardkey = OutwardKeys.get(postcode[:-InwardLength - 1])
+        inwardkey = InwardKeys.get(postcode[-InwardLength:])
+        if ( outwardkey != None ) and ( inwardkey != None ) : return outwardkey | inwardkey
+
+    compact = ''.join(postcode.split()).upper()
+    if not ( Valid(compact) ) : return InvalidKey
+
+    outward = compact[:-InwardLength]
+    outwardkey = OutwardKeys.get(outward)
+    if ( outwardkey == None ) :
+        outwardkey = OutwardKeys[outward] = EncodeNormalised(outward.ljust(KeyLength - InwardLength)) << ( CharacterBits * InwardLength )
+
+    inward = compact[-InwardLength:]
+    inwardkey = InwardKeys.get(inward)
+    if ( inwardkey == None ) : inwardkey = InwardKeys[inward] = EncodeNormalised(inward)
+
+    return outwardkey | inwardkey
+
+# Return the normalised postcode of key 'key'
+def DecodeNormalised (key) :
+
+    "Return the normalised postcode of a key"
+
+    characters = []
+    for position in range(KeyLength) :
+        characters.append(Symbols[key & CharacterMask])
+        key >>= CharacterBits
+
+    return ''.join(reversed(characters))
+
+# Return the printed form of key 'key' e.g. 'BN14 0BH' or an empty string for 'InvalidKey'
+def Decode (key) :
+
+    "Return the printed form of the postcode of a key"
+
+    if ( key == InvalidKey ) : return ''
+    normalised = DecodeNormalised(key)
+
+    return normalised[:-InwardLength].rstrip() + ' ' + normalised[-InwardLength:]
+
+# Return the key of the outward code of key 'key'. Keys of the same outward code share
+# the same outward key.
+def OutwardKey (key) :
+
+    "Return the outward code key of a key"
+
+    return key >> ( CharacterBits * InwardLength )
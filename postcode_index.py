@@ -0,0 +1,148 @@
+# postcode_index.py
+#
+# Description
+# ===========
+#
+# This module builds and searches an index file 'lookup_data.idx' for the file
+# 'lookup_data.csv' created by 'generate_lookup.py'. The index holds one fixed width
+# record for each row of 'lookup_data.csv' sorted by postcode key. Each record
+# consists of the following fields:
+#
+# <Postcode key (8 bytes)>,<Row offset (8 bytes)>,<Row length (4 bytes)>
+#
+# The key of a postcode is the integer form of its normalised postcode ( see
+# 'postcode_codec.py' ) so postcodes may be given in any case and with any spacing.
+# A postcode is located by a binary search over the memory mapped index followed by a
+# single read of the matching row from 'lookup_data.csv' so neither file is loaded
+# into memory.
+#
+# Index file layout
+# =================
+#
+# <Magic 'MSOAIDX2' (8 bytes)><Record count (8 bytes)><Record 0>...<Record n-1>
+#
+# The header is stored little endian. Records are stored big endian so that packed
+# records sort by key.
+
+import locale
+import mmap
+import struct
+import postcode_codec as Codec
+
+# Index file format
+IndexMagic = b'MSOAIDX2'
+IndexHeader = struct.Struct('<8sQ')
+IndexRecord = struct.Struct('>QQI')
+IndexKey = struct.Struct('>Q')
+KeyLength = IndexKey.size
+
+# Appends the packed index records of the lookup file lines 'lines' held as bytes
+# to 'records'. The first line starts at byte offset 'offset' of the lookup file.
+# Returns the offset following the lines.
+def AddRecords (records,lines,offset) :
+
+    "Appends the index records of lookup file lines"
+
+    for line in lines :
+        postcode = line[:line.find(b',')].decode('ascii')
+        key = Codec.Encode(postcode)
+        if ( key != Codec.InvalidKey ) :
+            length = len(line.rstrip(b'\r\n'))
+            records.append(IndexRecord.pack(key,offset,length))
+        offset += len(line)
+
+    return offset
+
+# Sorts the packed index records 'records' and writes them to index file object 'indexfile'
+def WriteRecords (indexfile,records) :
+
+    "Writes the sorted index records to an index file"
+
+    # Packed records sort by key as the key is held in the leading bytes.
+    records.sort()
+
+    indexfile.write(IndexHeader.pack(IndexMagic,len(records)))
+    indexfile.write(b''.join(records))
+
+# Builds index file 'indexfilename' from lookup file 'lookupfilename'.
+# Returns the number of indexed rows.
+def BuildIndex (lookupfilename,indexfilename,failure) :
+
+    "Builds an index file for the lookup file 'lookupfilename'"
+
+    records = []
+
+    try:
+        with open(lookupfilename,'rb') as lookupfile :
+            AddRecords(records,lookupfile,0)
+    except:
+        return failure
+
+    try:
+        with open(indexfilename,'wb') as indexfile :
+            WriteRecords(indexfile,records)
+    except:
+        return failure
+
+    return len(records)
+
+# Class providing postcode searches of a lookup file using its index file.
+class PostcodeIndex :
+
+    "Searches a lookup file using a memory mapped index file"
+
+    def __init__ (self,lookupfilename,indexfilename) :
+
+        self.indexfile = open(indexfilename,'rb')
+        self.index = mmap.mmap(self.indexfile.fileno(),0,access=mmap.ACCESS_READ)
+        magic,self.count = IndexHeader.unpack_from(self.index,0)
+        if ( magic != IndexMagic ) :
+            self.Close()
+            raise ValueError('%s is not a postcode index file' % indexfilename)
+        self.lookupfile = open(lookupfilename,'rb')
+
+    # Return the position of the first record whose key is not less than 'key'
+    # where 'key' is a packed postcode key
+    def Search (self,key) :
+
+        "Return the position of the first record whose key is not less than 'key'"
+
+        index = self.index
+        low = 0
+        high = self.count
+        while ( low < high ) :
+            middle = ( low + high ) // 2
+            start = IndexHeader.size + middle * IndexRecord.size
+            if ( index[start:start + KeyLength] < key ) :
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    # Return the lookup file row for 'postcode' or an empty string if
+    # 'postcode' is not present.
+    def Lookup (self,postcode) :
+
+        "Return the lookup file row for 'postcode'"
+
+        key = Codec.Encode(postcode)
+        if ( key == Codec.InvalidKey ) : return ''
+
+        position = self.Search(IndexKey.pack(key))
+        if ( position == self.count ) : return ''
+
+        recordkey,offset,length = IndexRecord.unpack_from(self.index,IndexHeader.size + position * IndexRecord.size)
+        if ( recordkey != key ) : return ''
+
+        self.lookupfile.seek(offset)
+        return self.lookupfile.read(length).decode(locale.getpreferredencoding(False))
+
+    # Close the index and lookup files
+    def Close (self) :
+
+        "Close the index and lookup files"
+
+        self.index.close()
+        self.indexfile.close()
+        if ( hasattr(self,'lookupfile') ) : self.lookupfile.close()
@@ -0,0 +1,224 @@
+# prepare_files.py
+#
+# Description
+# ===========
+#
+# This script creates the input data files used by 'generate_lookup.py' from the source
+# data files retrieved to temporary storage by 'retrieve_files.py'. Each source file is
+# read in a single streaming pass, zip archive members being read directly from the
+# archive, and only the rows relating to England are written to the ..\data directory.
+# The source files, the rows selected from them and the data files created are as follows:
+#
+# MSOA names and codes
+# --------------------
+# <temp>\msoa_names.csv
+#
+# Rows starting with 'E', sorted.
+#
+# ..\data\msoa_names.csv
+#
+# MSOA codes and populations
+# --------------------------
+# <temp>\msoa_populations.zip member 'SAPE22DT4-mid-2019-msoa-syoa-estimates-unformatted.xlsx'
+#
+# Code, name, LA name and population columns of the 'Mid-2019 Persons' sheet ( see
+# 'extract_populations.py' ), rows starting with 'E', sorted.
+#
+# ..\data\msoa_populations.csv
+#
+# LTLA names and codes
+# --------------------
+# <temp>\authority_data.zip member 'LA_UA names and codes UK as at 04_20.csv'
+#
+# Rows starting with 'E', sorted.
+#
+# ..\data\authority_data.csv
+#
+# MSOA code relating to each UK postcode:
+# ---------------------------------------
+# <temp>\postcode_data.zip member 'gridall.csv'
+#
+# Rows containing 'E0200' but not 'W0200' or 'N99999999', in their original order.
+#
+# ..\data\postcode_data.csv
+#
+# The temporary storage directory <temp> is c:\temp on Windows and the system temporary
+# directory on other platforms.
+#
+# Usage
+# =====
+#
+# This script requires no command line arguments and can be invoked as follows:
+#
+# python prepare_files.py
+#
+# Logging
+# =======
+#
+# This script logs error and status messages to the file .\log\log.txt an to the user console.
+# Messages are written on a background thread ( see 'log_writer.py' ).
+
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+import xml.etree.ElementTree as ElementTree
+import extract_populations as Populations
+import utils as Utils
+
+# File names and modes
+Currentdir = os.getcwd()
+LogDir = os.path.join(Currentdir,'log')
+ErrorFilename = os.path.join(LogDir,'log.txt')
+DataDir = os.path.join(Currentdir,'data')
+CacheDir = os.path.join(Currentdir,'cache')
+TempDir = 'c:\\temp' if ( os.name == 'nt' ) else tempfile.gettempdir()
+TempMsoaNameFileName = os.path.join(TempDir,'msoa_names.csv')
+TempMsoaPopulationFileName = os.path.join(TempDir,'msoa_populations.zip')
+TempAuthorityDataFileName = os.path.join(TempDir,'authority_data.zip')
+TempPostcodeDataFileName = os.path.join(TempDir,'postcode_data.zip')
+MsoaPopulationMemberName = 'SAPE22DT4-mid-2019-msoa-syoa-estimates-unformatted.xlsx'
+AuthorityDataMemberName = 'LA_UA names and codes UK as at 04_20.csv'
+PostcodeDataMemberName = 'gridall.csv'
+MsoaNameFileName = os.path.join(DataDir,'msoa_names.csv')
+MsoaPopulationFileName = os.path.join(DataDir,'msoa_populations.csv')
+AuthorityDataFileName = os.path.join(DataDir,'authority_data.csv')
+PostcodeDataFileName = os.path.join(DataDir,'postcode_data.csv')
+append = 'a'
+overwritebinary = 'wb'
+
+# Output buffering
+BufferSize = 1048576
+BatchSize = 10000
+
+# Function return values
+invalid = failure = 0
+empty = ''
+success = 1
+
+# Error levels
+error = 'ERROR'
+warning = 'WARNING'
+info = 'INFO'
+
+# Script names
+module = 'prepare_files.py'
+
+# Row filters
+EnglandPrefix = b'E'
+PostcodeIncluded = b'E0200'
+PostcodeExcluded = (b'W0200',b'N99999999')
+
+# Return a binary file object reading member 'membername' of zip file 'zipfilename'.
+# The member is matched by name ignoring any directory and case.
+def OpenMember (zipfilename,membername) :
+
+    "Return a file object reading a member of a zip file"
+
+    archive = zipfile.ZipFile(zipfilename)
+    for member in archive.infolist() :
+        if ( os.path.basename(member.filename).lower() == membername.lower() ) :
+            return io.BufferedReader(archive.open(member),BufferSize)
+
+    archive.close()
+    raise KeyError('%s does not contain %s' % (zipfilename,membername))
+
+# Return the lines of 'fileobject' starting with 'E' in sorted order
+def EnglandLines (fileobject) :
+
+    "Return the sorted lines relating to England"
+
+    lines = [line for line in fileobject if line.startswith(EnglandPrefix)]
+    if ( len(lines) > 0 ) and not ( lines[-1].endswith(b'\n') ) : lines[-1] += b'\n'
+    lines.sort()
+
+    return lines
+
+# Return the sorted population lines relating to England extracted from the spreadsheet
+# read from 'fileobject'. The spreadsheet is copied to a temporary file as reading it
+# requires a seekable file.
+def EnglandPopulationLines (fileobject) :
+
+    "Return the sorted population lines relating to England"
+
+    with tempfile.TemporaryFile() as spreadsheetfileobject :
+        shutil.copyfileobj(fileobject,spreadsheetfileobject,BufferSize)
+        spreadsheetfileobject.seek(0)
+
+        return EnglandLines(Populations.PopulationLines(spreadsheetfileobject))
+
+# Return a generator of the lines of 'fileobject' relating to postcodes in England
+def EnglandPostcodeLines (fileobject) :
+
+    "Return a generator of the postcode lines relating to England"
+
+    for line in fileobject :
+        if ( PostcodeIncluded in line ) and not ( PostcodeExcluded[0] in line or PostcodeExcluded[1] in line ) :
+            yield line
+
+# Create data file 'filename' from the source file object 'fileobject' using 'selection'
+def PrepareFile (fileobject,filename,selection) :
+
+    "Create a data file from a source file"
+
+    with fileobject :
+        with open(filename,overwritebinary,BufferSize) as DataFileObject :
+            if ( Utils.WriteLines(DataFileObject,iter(selection(fileobject)),BatchSize,failure) == failure ) :
+                raise OSError('Could not write to ' + filename)
+
+############
+### MAIN ###
+############
+
+def Main () :
+
+    "Creates the input data files used by 'generate_lookup.py'"
+
+    # Create/open log file
+    ErrorFileObject = Utils.OpenLog(ErrorFilename,failure)
+    ErrorMessage = 'Could not open ' + ErrorFilename
+    if ( ErrorFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Log start of script
+    Utils.Logerror(ErrorFileObject,module,'Started',info)
+
+    Preparations = [(TempMsoaNameFileName,None,MsoaNameFileName,EnglandLines),
+                    (TempMsoaPopulationFileName,MsoaPopulationMemberName,MsoaPopulationFileName,EnglandPopulationLines),
+                    (TempAuthorityDataFileName,AuthorityDataMemberName,AuthorityDataFileName,EnglandLines),
+                    (TempPostcodeDataFileName,PostcodeDataMemberName,PostcodeDataFileName,EnglandPostcodeLines)]
+
+    for SourceFileName,MemberName,DataFileName,Selection in Preparations :
+
+        # Log progress messages
+        ErrorMessage = 'Creating data file %s from %s ' % (DataFileName,SourceFileName if ( MemberName == None ) else SourceFileName + ' member ' + MemberName)
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+        try:
+            if ( MemberName == None ) :
+                SourceFileObject = open(SourceFileName,'rb',BufferSize)
+            else:
+                SourceFileObject = OpenMember(SourceFileName,MemberName)
+
+            PrepareFile(SourceFileObject,DataFileName,Selection)
+        except (OSError,KeyError,ValueError,zipfile.BadZipFile,ElementTree.ParseError) as Error :
+            ErrorMessage = 'Could not create %s: %s' % (DataFileName,Error)
+            Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Pass the download cache metadata of the source data files on to 'generate_lookup.py'
+    # which records them as the files of the lookup once it completes
+    try:
+        Utils.PromoteCache(CacheDir,Utils.CachePendingFilename,Utils.CachePreparedFilename)
+    except OSError as Error:
+        ErrorMessage = 'Could not update download cache %s: %s' % (CacheDir,Error)
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+    # Log end of script
+    Utils.Logerror(ErrorFileObject,module,'Completed',info)
+
+    # Close error log file
+    ErrorMessage = 'Could not close ' + ErrorFilename
+    if ( Utils.Close(ErrorFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+if ( __name__ == '__main__' ) :
+    Main()
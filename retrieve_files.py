@@ -6,8 +6,9 @@
 # This utility will retrieve all source data files necessary to create file
 # 'lookup_data.csv' containing information relating to the MSOA ( Middle Super Output Area ) 
 # and LTLA (Lower Tier Local Authority ) in which each UK postcode resides. All files are 
-# stored in temporay storage on c:\temp from where the necessary information is
-# extracted and stored as data files in the ..\data directory by batch file 'msoa_lookup.bat'
+# stored in temporay storage on c:\temp ( the system temporary directory on other platforms )
+# from where the necessary information is extracted and stored as data files in the ..\data
+# directory by 'prepare_files.py'
 # The contents, web sources and destination files of each type of information required are as follows:
 #
 # MSOA names and codes
@@ -48,10 +49,32 @@
 # This script requires no command line arguments and can be invoked as follows:
 #
 # python retrieve_files.py
+#
+# Files are downloaded through the download cache directory .\cache which holds the last
+# copy of each file together with its ETag, Last-Modified and SHA-256 values. Files are
+# requested conditionally and unchanged files are copied from the cache. If no file has 
+# changed since 'lookup_data.csv' was last generated the script returns exit status 2 so
+# that regeneration of 'lookup_data.csv' can be skipped. Changed files are only recorded
+# as the files of the lookup once 'prepare_files.py' and 'generate_lookup.py' have
+# completed, so a run in which either fails is followed by a regeneration. The cache can
+# be bypassed as follows:
+#
+# python retrieve_files.py --no-cache
+#
+# The wall clock and CPU time, bytes written and peak memory of each stage are written to
+# metrics file .\log\retrieve_files_metrics.json (see 'metrics.py'). The run may also be
+# profiled as follows:
+#
+# python retrieve_files.py [--metrics <metrics file>] [--profile <profile file>] [--trace-memory]
 # 
 # Data and configuration files
 # ============================
 #
+# All files are downloaded concurrently and streamed to disk in chunks. The size, duration
+# and throughput of each download is logged. Large files such as the postcode file are
+# downloaded in parallel byte range segments when the server supports byte ranges and an
+# interrupted download is continued by the next run ( see 'downloads.py' ).
+#
 # This utility will create the following data files.
 #
 # c:\temp\msoa_names.csv
@@ -79,33 +102,38 @@
 # =======
 #
 # This script logs error and status messages to the file .\log\log.txt an to the user console.
+# Messages are written on a background thread ( see 'log_writer.py' ) and may also be
+# written as JSON lines as follows:
+#
+# python retrieve_files.py --json-log <file>
 
-import calendar
-from datetime import date,timedelta
+import argparse
 import os
-import re
-import requests
-import subprocess
 import sys
-import time
+import tempfile
+import downloads as Download
+import log_writer as LogWriter
+import metrics as Metrics
 import utils as Utils
 
 # File names and modes
 Currentdir = os.getcwd()
-LogDir = Currentdir + '\\log'
-ErrorFilename = LogDir + '\\' + 'log.txt'
-ConfigDir = Currentdir + '\\config'
-ConfigurationFilename = ConfigDir + '\\' + 'retrieve_files.csv'
-DataDir = Currentdir + '\\data'
-TempDir = 'c:\\temp'
+LogDir = os.path.join(Currentdir,'log')
+ErrorFilename = os.path.join(LogDir,'log.txt')
+MetricsFilename = os.path.join(LogDir,'retrieve_files_metrics.json')
+ConfigDir = os.path.join(Currentdir,'config')
+ConfigurationFilename = os.path.join(ConfigDir,'retrieve_files.csv')
+DataDir = os.path.join(Currentdir,'data')
+CacheDir = os.path.join(Currentdir,'cache')
+TempDir = 'c:\\temp' if ( os.name == 'nt' ) else tempfile.gettempdir()
 MsoaNameFileName = 'msoa_names.csv'
-TempMsoaNameFileName = TempDir + '\\' + MsoaNameFileName
+TempMsoaNameFileName = os.path.join(TempDir,MsoaNameFileName)
 MsoaPopulationFileName = 'msoa_populations.zip'
-TempMsoaPopulationFileName = TempDir + '\\' + MsoaPopulationFileName 
+TempMsoaPopulationFileName = os.path.join(TempDir,MsoaPopulationFileName)
 AuthorityDataFileName = 'authority_data.zip'
-TempAuthorityDataFileName = TempDir + '\\' + AuthorityDataFileName 
+TempAuthorityDataFileName = os.path.join(TempDir,AuthorityDataFileName)
 PostcodeDataFileName = 'postcode_data.zip'
-TempPostcodeDataFileName = TempDir + '\\' + PostcodeDataFileName 
+TempPostcodeDataFileName = os.path.join(TempDir,PostcodeDataFileName)
 
 append = 'a'
 read = 'r'
@@ -122,127 +150,156 @@ error = 'ERROR'
 warning = 'WARNING'
 info = 'INFO'
 
+# Exit status returned when all files are retrieved and when no source file has changed
+retrieved = 0
+unchanged = 2
+
 # Script names
 module = 'retrieve_files.py'
 
-# Create/open log file
-ErrorFileObject = Utils.Open(ErrorFilename,append,failure)
-ErrorMessage = 'Could not open ' + ErrorFilename
-if ( ErrorFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Log start of script
-Utils.Logerror(ErrorFileObject,module,'Started',info)
-
-# Log progress messages
-ErrorMessage = 'Reading configuration file %s ' % ConfigurationFilename
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-
-# Open and parse configuration file
-ConfigurationFileObject = Utils.Open(ConfigurationFilename,read,failure)
-ErrorMessage = 'Could not open configuration file ' + ConfigurationFilename
-if ( ConfigurationFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-ConfigurationData = Utils.Read(ConfigurationFileObject,failure)
-ErrorMessage = 'Could not read data in ' + ConfigurationFilename
-if ( ConfigurationFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-ConfigurationDataLines = ConfigurationData.splitlines()
-if ( len(ConfigurationDataLines) != 4 ) :
-    ErrorMessage = 'Configuration file %s does not consist of exactly 4 lines ' % ConfigurationFilename
-    Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-ConfigurationLineCount = 1   
-for ConfigurationDataLine in ConfigurationDataLines :
-    if ( len(ConfigurationDataLine) == 0 ) :
-        ErrorMessage = 'Configuration line %d in %s is empty ' % (ConfigurationLineCount,ConfigurationFilename)
-        Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-        
-    ConfigurationLineCount += 1
-    
-MsoaNameFileUrl =  ConfigurationDataLines[0]
-MsoaPopulationFileUrl = ConfigurationDataLines[1]
-AuthorityDataFileUrl = ConfigurationDataLines[2]
-PostcodeDataFileUrl = ConfigurationDataLines[3]
-    
-# Close Configuration file
-ErrorMessage = 'Could not close ' + ConfigurationFilename
-if ( Utils.Close(ConfigurationFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
-
-# Log progress messages
-ErrorMessage = 'Downloading file %s ' % MsoaNameFileUrl
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-
-# Open Msoa name output file
-MsoaNameFileObject = Utils.Open(TempMsoaNameFileName,overwritebinary,failure)
-ErrorMessage = 'Could not open ' + TempMsoaNameFileName
-if ( MsoaNameFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Download Msoa name spreadsheet contents.
-Response = requests.get(MsoaNameFileUrl)
-if ( Response.status_code != 200 ) :
-    ErrorMessage = 'GET operation for %s failed' % MsoaNameFileUrl
-    Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Write Msoa name output file. 
-Utils.Write(MsoaNameFileObject,Response.content,failure)
-
-# Log progress messages
-ErrorMessage = 'Downloading file %s ' % MsoaPopulationFileUrl
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-
-# Open Msoa population output file
-MsoaPopulationFileObject = Utils.Open(TempMsoaPopulationFileName,overwritebinary,failure)
-ErrorMessage = 'Could not open ' + TempMsoaPopulationFileName
-if ( MsoaPopulationFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Download Msoa population spreadsheet contents.
-Response = requests.get(MsoaPopulationFileUrl)
-if ( Response.status_code != 200 ) :
-    ErrorMessage = 'GET operation for %s failed' % MsoaPopulationFileUrl
-    Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-    
-# Write Msoa population output. 
-Utils.Write(MsoaPopulationFileObject,Response.content,failure)
-
-# Log progress messages
-ErrorMessage = 'Downloading file %s ' % AuthorityDataFileUrl
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-
-# Open authority data output file
-AuthorityDataFileObject = Utils.Open(TempAuthorityDataFileName,overwritebinary,failure)
-ErrorMessage = 'Could not open ' + TempAuthorityDataFileName
-if ( AuthorityDataFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Download authority data spreadsheet contents.
-Response = requests.get(AuthorityDataFileUrl)
-if ( Response.status_code != 200 ) :
-    ErrorMessage = 'GET operation for %s failed' % AuthorityDataFileUrl
-    Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-    
-# Write authority. 
-Utils.Write(AuthorityDataFileObject,Response.content,failure)
-
-# Log progress messages
-ErrorMessage = 'Downloading file %s ' % PostcodeDataFileUrl
-Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
-
-# Open authority data output file
-PostcodeDataFileObject = Utils.Open(TempPostcodeDataFileName,overwritebinary,failure)
-ErrorMessage = 'Could not open ' + TempPostcodeDataFileName
-if ( PostcodeDataFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-
-# Download authority data spreadsheet contents.
-Response = requests.get(PostcodeDataFileUrl)
-if ( Response.status_code != 200 ) :
-    ErrorMessage = 'GET operation for %s failed' % PostcodeDataFileUrl
-    Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
-    
-# Write authority. 
-Utils.Write(PostcodeDataFileObject,Response.content,failure)
-
-# Log end of script
-Utils.Logerror(ErrorFileObject,module,'Completed',info)
-
-# Close error log file
-ErrorMessage = 'Could not close ' + ErrorFilename
-if ( Utils.Close(ErrorFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
\ No newline at end of file
+# Reads configuration file 'configurationfilename' and returns the urls of the MSOA names,
+# MSOA populations, authorities and postcode files.
+def ReadConfiguration (configurationfilename,errorfileobject) :
+
+    "Reads the source file urls defined in configuration file 'configurationfilename'"
+
+    # Open and parse configuration file
+    ConfigurationFileObject = Utils.Open(configurationfilename,read,failure)
+    ErrorMessage = 'Could not open configuration file ' + configurationfilename
+    if ( ConfigurationFileObject == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+
+    ConfigurationData = Utils.Read(ConfigurationFileObject,failure)
+    ErrorMessage = 'Could not read data in ' + configurationfilename
+    if ( ConfigurationFileObject == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+
+    ConfigurationDataLines = ConfigurationData.splitlines()
+    if ( len(ConfigurationDataLines) != 4 ) :
+        ErrorMessage = 'Configuration file %s does not consist of exactly 4 lines ' % configurationfilename
+        Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+
+    ConfigurationLineCount = 1   
+    for ConfigurationDataLine in ConfigurationDataLines :
+        if ( len(ConfigurationDataLine) == 0 ) :
+            ErrorMessage = 'Configuration line %d in %s is empty ' % (ConfigurationLineCount,configurationfilename)
+            Utils.Logerror(errorfileobject,module,ErrorMessage,error)
+            
+        ConfigurationLineCount += 1
+
+    # Close Configuration file
+    ErrorMessage = 'Could not close ' + configurationfilename
+    if ( Utils.Close(ConfigurationFileObject,failure) == failure ) : Utils.Logerror(errorfileobject,module,ErrorMessage,warning)
+
+    return ConfigurationDataLines
+
+# Downloads the files of 'downloadlist', a list of (url,filename) tuples, through download
+# cache directory 'cachedir' unless it is None and logs the result of each download.
+# Returns the number of files which have changed.
+def RetrieveFiles (downloadlist,cachedir,stage,errorfileobject) :
+
+    "Downloads the source data files"
+
+    # Log progress messages
+    for DownloadUrl,DownloadFileName in downloadlist :
+        ErrorMessage = 'Downloading file %s ' % DownloadUrl
+        Utils.Logerror(errorfileobject,module,ErrorMessage,info)
+
+    # Download all files concurrently streaming each to its output file.
+    Results = Download.DownloadFiles(downloadlist,len(downloadlist),cachedir)
+
+    # Log download statistics
+    ChangedCount = 0
+    for Result in Results :
+        if ( isinstance(Result,Download.DownloadError) ) :
+            Utils.Logerror(errorfileobject,module,str(Result),error)
+
+        if ( Result['Status'] == 304 ) :
+            if ( Result['Copied'] ) :
+                ErrorMessage = 'File %s has not changed and was copied from the download cache to %s ' % (Result['Url'],Result['Filename'])
+            else:
+                ErrorMessage = 'File %s has not changed and %s is already a copy of it ' % (Result['Url'],Result['Filename'])
+        else:
+            ErrorMessage = 'Downloaded %s to %s: %d bytes in %.2f seconds ( %.0f bytes/sec ) ' % (Result['Url'],Result['Filename'],Result['Bytes'],Result['Duration'],Result['Throughput'])
+            if ( Result['Segments'] > 1 ) : ErrorMessage += 'in %d segments, %d bytes continued from an earlier download ' % (Result['Segments'],Result['Resumed'])
+        Utils.Logerror(errorfileobject,module,ErrorMessage,info)
+
+        if ( Result.get('Changed',True) ) : ChangedCount += 1
+        stage.Written(Result['Filename'])
+
+    stage.rows = len(Results)
+
+    return ChangedCount
+
+############
+### MAIN ###
+############
+
+# Retrieves the source data files using the command line arguments 'arguments' or those
+# of the script if 'arguments' is None. Returns exit status 'unchanged' if no source file
+# has changed and 'retrieved' otherwise.
+def Main (arguments=None) :
+
+    "Retrieves the source data files"
+
+    # Parse command line
+    Parser = argparse.ArgumentParser(description='Retrieve the source data files used by generate_lookup.py')
+    Parser.add_argument('--no-cache',action='store_true',help='download all files without using the download cache')
+    Metrics.AddArguments(Parser)
+    LogWriter.AddArguments(Parser)
+    Arguments = Parser.parse_args(arguments)
+    PipelineMetrics = Metrics.Metrics(module,Arguments)
+
+    # Create/open log file
+    ErrorFileObject = Utils.OpenLog(ErrorFilename,failure,Arguments.jsonlog)
+    ErrorMessage = 'Could not open ' + ErrorFilename
+    if ( ErrorFileObject == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,error)
+
+    # Log start of script
+    Utils.Logerror(ErrorFileObject,module,'Started',info)
+
+    # Log progress messages
+    ErrorMessage = 'Reading configuration file %s ' % ConfigurationFilename
+    Utils.Logerror(ErrorFileObject,module,ErrorMessage,info)
+
+    # Read source file urls
+    Stage = PipelineMetrics.Start('Configuration')
+    MsoaNameFileUrl,MsoaPopulationFileUrl,AuthorityDataFileUrl,PostcodeDataFileUrl = ReadConfiguration(ConfigurationFilename,ErrorFileObject)
+    Stage.Read(ConfigurationFilename)
+    Stage.rows = 4
+    Stage.Stop()
+
+    DownloadList = [(MsoaNameFileUrl,TempMsoaNameFileName),
+                    (MsoaPopulationFileUrl,TempMsoaPopulationFileName),
+                    (AuthorityDataFileUrl,TempAuthorityDataFileName),
+                    (PostcodeDataFileUrl,TempPostcodeDataFileName)]
+
+    # Download source files
+    Stage = PipelineMetrics.Start('Download')
+    ChangedCount = RetrieveFiles(DownloadList,None if ( Arguments.no_cache ) else CacheDir,Stage,ErrorFileObject)
+    Stage.Stop()
+
+    # Write metrics file
+    MetricsFile = Arguments.metrics or MetricsFilename
+    try:
+        for Record in PipelineMetrics.Save(MetricsFile) : Utils.Logerror(ErrorFileObject,module,Metrics.Summary(Record),info)
+    except OSError:
+        ErrorMessage = 'Could not write metrics file ' + MetricsFile
+        Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+    # Report that no source file has changed so regeneration can be skipped
+    if ( ChangedCount == 0 ) :
+        Utils.Logerror(ErrorFileObject,module,'No source files have changed',info)
+        Utils.Close(ErrorFileObject,failure)
+        return unchanged
+
+    # Log end of script
+    Utils.Logerror(ErrorFileObject,module,'Completed',info)
+
+    # Close error log file
+    ErrorMessage = 'Could not close ' + ErrorFilename
+    if ( Utils.Close(ErrorFileObject,failure) == failure ) : Utils.Logerror(ErrorFileObject,module,ErrorMessage,warning)
+
+    return retrieved
+
+# The source files are only retrieved when this script is run directly
+if ( __name__ == '__main__' ) :
+    sys.exit(Main())
@@ -0,0 +1,336 @@
+# sinks.py
+#
+# Description
+# ===========
+#
+# This module provides the sinks to which 'generate_lookup.py' passes the rows of
+# 'lookup_data.csv' as they are generated so that the lookup may be written in a number
+# of formats in a single run rather than by reading 'lookup_data.csv' again for each.
+# The following sinks are provided:
+#
+# csv       A copy of 'lookup_data.csv'
+# ndjson    One JSON object per line for each postcode holding the fields given by
+#           'lookup_service.py' followed by those of any further geographies, e.g.
+#           {"Postcode": "BN14 0BH", "MsoaName": "High Salvington & Findon Valley", ...}
+# index     A postcode index file of the rows passed to the sink ( see 'postcode_index.py' )
+#
+# A 'SinkWriter' object is used in place of the lookup file object. It passes the rows
+# written to it in batches of about 'BatchSize' bytes, each ending at the end of a row, to
+# each sink on a thread of its own through a queue of at most 'QueueLength' batches, so
+# the generation of rows only waits for a slow sink once its queue is full. The rows are
+# passed as the bytes written to the lookup file so the offsets of an index sink are
+# those of 'lookup_data.csv'. Each sink counts the rows and bytes it has written and the
+# time taken to write them so that its throughput can be reported along with the time
+# the generating thread waited for it.
+#
+# Each sink writes its file to a temporary file which replaces the file once complete. A
+# sink which fails is discarded without affecting the other sinks. Further sinks are
+# added by subclassing 'Sink', overriding 'Write' to write the rows in another form, and
+# adding the class to 'SinkTypes'.
+
+import io
+import json
+import locale
+import os
+import queue
+import threading
+import time
+import postcode_index as Index
+
+# Size in bytes of the batches of rows passed to each sink
+BatchSize = 1048576
+
+# Number of batches waiting to be written by a sink before the generating thread waits
+QueueLength = 8
+
+# Number of row endings whose JSON fields are kept by an 'ndjson' sink
+JsonCacheSize = 65536
+
+# Base class of the sinks of lookup rows. Each sink is given the lookup tables used to
+# generate the rows ( see 'generate_lookup.py' ) so that it can interpret them.
+class Sink :
+
+    "Writes lookup rows to a file"
+
+    def __init__ (self,filename,msoas,authorities,geographies=(),encoding=None) :
+
+        self.filename = filename
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.waited = 0.0
+        self.failure = None
+        self.file = None
+
+    # Open the temporary file of the sink
+    def Open (self) :
+
+        "Open the temporary file of the sink"
+
+        self.file = open(self.filename + '.part','wb')
+
+    # Write the lookup rows 'data' held as bytes ending at the end of a row. Rows are
+    # written unchanged unless a sink overrides this.
+    def Write (self,data) :
+
+        "Write lookup rows"
+
+        self.file.write(data)
+
+    # Complete the file of the sink
+    def Close (self) :
+
+        "Complete the file of the sink"
+
+        self.file.close()
+        os.replace(self.filename + '.part',self.filename)
+
+    # Remove the temporary file of a sink which has failed
+    def Discard (self) :
+
+        "Remove the temporary file of the sink"
+
+        try:
+            if ( self.file != None ) : self.file.close()
+            if ( os.path.exists(self.filename + '.part') ) : os.remove(self.filename + '.part')
+        except OSError:
+            pass
+
+# Sink writing a copy of the lookup file using the 'Write' of 'Sink'
+class CsvSink (Sink) :
+
+    "Writes a copy of the lookup file"
+
+# Sink writing a JSON object for each postcode. The JSON fields of the part of each row
+# following its postcode are found by matching it against the rendered fields of the
+# MSOAs, LTLAs and further geographies as names may hold commas.
+class JsonSink (Sink) :
+
+    "Writes the lookup rows as newline delimited JSON"
+
+    def __init__ (self,filename,msoas,authorities,geographies=(),encoding=None) :
+
+        Sink.__init__(self,filename,msoas,authorities,geographies,encoding)
+
+        # Rendered csv fields and JSON fields of each MSOA, LTLA and geography entry with
+        # the number of fields and JSON fields of an entry which is not in its table
+        self.parts = [(dict(zip(table.Render(',',''),['"%sName": %s, "%sCode": %s, "%sPopulation": %d' % (prefix,json.dumps(name),prefix,json.dumps(code),prefix,population) for code,name,population in table])),None,None) for prefix,table in (('Msoa',msoas),('Ltla',authorities))]
+        for geography in geographies :
+            prefix = geography['Name']
+            if ( geography['Table'] != None ) :
+                fields = dict(zip(geography['Table'].Render(',',''),['"%sName": %s, "%sCode": %s, "%sPopulation": %d' % (prefix,json.dumps(name),prefix,json.dumps(code),prefix,population) for code,name,population in geography['Table']]))
+                self.parts.append((fields,3,'"%sName": "", "%sCode": %%s, "%sPopulation": null' % (prefix,prefix,prefix)))
+            else:
+                self.parts.append(({},1,'"%sCode": %%s' % prefix))
+        self.cache = {}
+
+    # Return the JSON fields of 'ending', the part of a lookup row following its postcode
+    def Fields (self,ending) :
+
+        "Return the JSON fields of the end of a lookup row"
+
+        commas = [position for position,character in enumerate(ending) if ( character == ',' )] + [len(ending)]
+        if ( commas[0] != 0 ) : raise ValueError('Lookup row does not match the tables: ' + ending)
+
+        fields = []
+        start = 0
+        for entries,width,missing in self.parts :
+            for end in range(start + 1,len(commas)) :
+                entry = entries.get(ending[commas[start]:commas[end]])
+                if ( entry != None ) : break
+            else:
+                if ( width == None ) or ( start + width >= len(commas) ) : raise ValueError('Lookup row does not match the tables: ' + ending)
+                end = start + width
+                entry = missing % json.dumps(ending[commas[start]:commas[end]].split(',')[-2 if ( width == 3 ) else -1])
+            fields.append(entry)
+            start = end
+
+        if ( start != len(commas) - 1 ) : raise ValueError('Lookup row does not match the tables: ' + ending)
+
+        return ', '.join(fields)
+
+    def Write (self,data) :
+
+        "Write lookup rows"
+
+        cache = self.cache
+        objects = []
+        for row in data.decode(self.encoding).splitlines() :
+            postcode = row[:row.find(',')]
+            ending = row[len(postcode):]
+            fields = cache.get(ending)
+            if ( fields == None ) :
+                if ( len(cache) >= JsonCacheSize ) : cache.clear()
+                fields = cache[ending] = self.Fields(ending)
+            objects.append('{"Postcode": %s, %s}\n' % (json.dumps(postcode),fields))
+
+        self.file.write(''.join(objects).encode('utf-8'))
+
+# Sink writing a postcode index file of the rows passed to it
+class IndexSink (Sink) :
+
+    "Writes a postcode index file"
+
+    def __init__ (self,filename,msoas,authorities,geographies=(),encoding=None) :
+
+        Sink.__init__(self,filename,msoas,authorities,geographies,encoding)
+        self.records = []
+        self.offset = 0
+
+    def Write (self,data) :
+
+        "Index lookup rows"
+
+        self.offset = Index.AddRecords(self.records,io.BytesIO(data),self.offset)
+
+    def Close (self) :
+
+        "Write the index file"
+
+        Index.WriteRecords(self.file,self.records)
+        Sink.Close(self)
+
+# Sink types by name
+SinkTypes = {'csv' : CsvSink, 'ndjson' : JsonSink, 'index' : IndexSink}
+
+# Class passing the lookup rows written to it to the sinks 'sinks' each on its own
+# thread. Rows are given to 'write' in lookup file order as text or bytes in pieces of
+# any size. If 'target' is given everything written is also written to file object
+# 'target' so this object may be used in place of the lookup file object.
+class SinkWriter :
+
+    "Passes lookup rows to a number of sinks"
+
+    def __init__ (self,sinks,target=None,encoding=None) :
+
+        self.sinks = sinks
+        self.target = target
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.pending = []
+        self.pendingsize = 0
+        self.queues = []
+        self.threads = []
+
+        for sink in sinks :
+            sink.Open()
+            self.queues.append(queue.Queue(QueueLength))
+            self.threads.append(threading.Thread(target=self.Run,args=(sink,self.queues[-1]),name='Sink ' + sink.filename,daemon=True))
+            self.threads[-1].start()
+
+    # Write 'data' to the target file and add it to the pending rows. Text is written
+    # with the line endings of the lookup file.
+    def write (self,data) :
+
+        "Write lookup rows"
+
+        if ( self.target != None ) : self.target.write(data)
+        if ( isinstance(data,str) ) :
+            if ( os.linesep != '\n' ) : data = data.replace('\n',os.linesep)
+            data = data.encode(self.encoding)
+
+        self.pending.append(data)
+        self.pendingsize += len(data)
+        if ( self.pendingsize >= BatchSize ) : self.Cut()
+
+        return len(data)
+
+    # Add the lines 'lines' to the lookup rows written
+    def writelines (self,lines) :
+
+        "Write a list of lookup rows"
+
+        self.write(''.join(lines))
+
+    # Flush the target file
+    def flush (self) :
+
+        "Flush the target file"
+
+        if ( self.target != None ) : self.target.flush()
+
+    # Pass the complete rows of the pending data to the sinks
+    def Cut (self) :
+
+        "Pass complete rows to the sinks"
+
+        data = b''.join(self.pending)
+        end = data.rfind(b'\n') + 1
+        if ( end > 0 ) : self.Queue(data[:end])
+
+        self.pending = [data[end:]]
+        self.pendingsize = len(data) - end
+
+    # Pass the rows 'data' to the queue of each sink. The time spent waiting for a
+    # sink whose queue is full is added to its 'waited' time.
+    def Queue (self,data) :
+
+        "Pass rows to the sinks"
+
+        for sink,rows in zip(self.sinks,self.queues) :
+            if ( sink.failure != None ) : continue
+            started = time.perf_counter()
+            rows.put(data)
+            sink.waited += time.perf_counter() - started
+
+    # Pass the rows of existing lookup file 'filename' to the sinks only. Used when a
+    # lookup file is continued from a checkpoint.
+    def Replay (self,filename) :
+
+        "Pass the rows of an existing lookup file to the sinks"
+
+        with open(filename,'rb') as fileobject :
+            while True :
+                data = fileobject.read(BatchSize)
+                if ( len(data) == 0 ) : break
+                self.pending.append(data)
+                self.pendingsize += len(data)
+                self.Cut()
+
+    # Write the rows passed by 'Queue' to sink 'sink' until 'None' is passed and complete
+    # its file. Any error of the sink sets its 'failure' and the remaining rows are taken
+    # from the queue unwritten so that 'Queue' never waits for a failed sink.
+    def Run (self,sink,rows) :
+
+        "Write rows to a sink"
+
+        while True :
+            data = rows.get()
+            if ( data == None ) : break
+            if ( sink.failure != None ) : continue
+
+            started = time.perf_counter()
+            try:
+                sink.Write(data)
+            except Exception as error:
+                sink.failure = str(error) or type(error).__name__
+                continue
+            sink.seconds += time.perf_counter() - started
+            sink.rows += data.count(b'\n')
+            sink.bytes += len(data)
+
+        if ( sink.failure == None ) :
+            started = time.perf_counter()
+            try:
+                sink.Close()
+            except Exception as error:
+                sink.failure = str(error) or type(error).__name__
+            sink.seconds += time.perf_counter() - started
+
+        if ( sink.failure != None ) : sink.Discard()
+
+    # Pass the remaining rows to the sinks and wait for them to complete their files.
+    # Returns the sinks whose 'failure' is set if they failed.
+    def Close (self) :
+
+        "Complete the files of the sinks"
+
+        data = b''.join(self.pending)
+        if ( len(data) > 0 ) and not ( data.endswith(b'\n') ) : data += os.linesep.encode('ascii')
+        if ( len(data) > 0 ) : self.Queue(data)
+        self.pending = []
+
+        for rows in self.queues : rows.put(None)
+        for thread in self.threads : thread.join()
+
+        return self.sinks
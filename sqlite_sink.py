@@ -0,0 +1,115 @@
+# sqlite_sink.py
+#
+# Description
+# ===========
+#
+# This module writes the contents of compact lookup file 'lookup_data.bin' ( see
+# 'compact_lookup.py' ) to a SQLite database so that the lookup may be queried using SQL
+# rather than by searching 'lookup_data.csv'. The database holds the following tables:
+#
+# ltlas(id INTEGER PRIMARY KEY, code TEXT, name TEXT, population INTEGER)
+# msoas(id INTEGER PRIMARY KEY, code TEXT, name TEXT, population INTEGER)
+# postcodes(postcode TEXT, key INTEGER, msoa_id INTEGER, ltla_id INTEGER)
+#
+# Column 'key' holds the integer key of each postcode ( see 'postcode_codec.py' ) so a
+# postcode given in any case and spacing is found using a single indexed search. View
+# 'lookup' joins the tables to give the fields of each row of 'lookup_data.csv' and its row
+# number counted from 1, for example:
+#
+# SELECT * FROM lookup WHERE key = <key of 'BN14 0BH'>
+# SELECT postcode FROM lookup WHERE msoa_code = 'E02006621'
+#
+# The database is written to a temporary file in a single transaction using batched
+# inserts with journalling and synchronous writes turned off. The indexes are created
+# after the rows have been loaded and the file replaces any previous database once complete.
+
+import os
+import sqlite3
+import time
+import compact_lookup as Compact
+import postcode_codec as Codec
+
+# Number of postcode rows passed to each 'executemany' call
+BatchSize = 100000
+
+# Page cache size in KiB used while loading
+CacheSize = 262144
+
+# Database schema
+Schema = '''
+CREATE TABLE ltlas (id INTEGER PRIMARY KEY, code TEXT NOT NULL, name TEXT NOT NULL, population INTEGER NOT NULL);
+CREATE TABLE msoas (id INTEGER PRIMARY KEY, code TEXT NOT NULL, name TEXT NOT NULL, population INTEGER NOT NULL);
+CREATE TABLE postcodes (postcode TEXT NOT NULL, key INTEGER NOT NULL, msoa_id INTEGER NOT NULL, ltla_id INTEGER NOT NULL);
+CREATE VIEW lookup AS
+    SELECT postcodes.rowid AS row, postcodes.postcode AS postcode, postcodes.key AS key,
+           msoas.name AS msoa_name, msoas.code AS msoa_code, msoas.population AS msoa_population,
+           ltlas.name AS ltla_name, ltlas.code AS ltla_code, ltlas.population AS ltla_population
+    FROM postcodes JOIN msoas ON msoas.id = postcodes.msoa_id JOIN ltlas ON ltlas.id = postcodes.ltla_id;
+'''
+
+# Indexes created once the rows have been loaded
+Indexes = '''
+CREATE UNIQUE INDEX ltlas_code ON ltlas (code);
+CREATE UNIQUE INDEX msoas_code ON msoas (code);
+CREATE INDEX postcodes_key ON postcodes (key);
+CREATE INDEX postcodes_msoa ON postcodes (msoa_id);
+CREATE INDEX postcodes_ltla ON postcodes (ltla_id);
+'''
+
+# Return a generator of lists of at most 'BatchSize' postcode table rows for the
+# records of compact lookup file object 'lookup'
+def PostcodeBatches (lookup) :
+
+    "Return a generator of batches of postcode table rows"
+
+    encode = Codec.Encode
+    batch = []
+    for postcode,msoaid,authorityid in lookup.Records() :
+        batch.append((postcode,encode(postcode),msoaid,authorityid))
+        if ( len(batch) == BatchSize ) :
+            yield batch
+            batch = []
+    if ( len(batch) > 0 ) : yield batch
+
+# Writes SQLite database 'databasefilename' from compact lookup file 'compactfilename'.
+# Returns the number of postcode rows loaded and the time taken to load them and to
+# create the indexes in seconds.
+def WriteDatabase (compactfilename,databasefilename) :
+
+    "Writes a SQLite database from a compact lookup file"
+
+    partfilename = databasefilename + '.part'
+    if ( os.path.exists(partfilename) ) : os.remove(partfilename)
+
+    lookup = Compact.CompactLookup(compactfilename)
+    connection = sqlite3.connect(partfilename,isolation_level=None)
+
+    try:
+        connection.execute('PRAGMA journal_mode = OFF')
+        connection.execute('PRAGMA synchronous = OFF')
+        connection.execute('PRAGMA temp_store = MEMORY')
+        connection.execute('PRAGMA cache_size = -%d' % CacheSize)
+        connection.executescript(Schema)
+
+        started = time.perf_counter()
+        connection.execute('BEGIN')
+        connection.executemany('INSERT INTO ltlas VALUES (?,?,?,?)',[(position,) + entry for position,entry in enumerate(lookup.authorities)])
+        connection.executemany('INSERT INTO msoas VALUES (?,?,?,?)',[(position,) + entry for position,entry in enumerate(lookup.msoas)])
+        for batch in PostcodeBatches(lookup) :
+            connection.executemany('INSERT INTO postcodes VALUES (?,?,?,?)',batch)
+        connection.execute('COMMIT')
+        loadseconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        connection.executescript(Indexes)
+        connection.execute('ANALYZE')
+        indexseconds = time.perf_counter() - started
+
+        count = lookup.count
+    finally:
+        connection.close()
+        lookup.Close()
+
+    os.replace(partfilename,databasefilename)
+
+    return count,loadseconds,indexseconds
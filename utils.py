@@ -1,20 +1,46 @@
+import itertools
+import os
 import subprocess
 import sys
 import time
+import log_writer as LogWriter
 
-# Opens a file
-def Open (filename,mode,failure):
+# Download cache metadata files ( see 'downloads.py' ). Metadata of downloads which have
+# changed is written to the pending file by 'retrieve_files.py', renamed to the prepared
+# file once 'prepare_files.py' has created the data files and renamed to the metadata
+# file once 'generate_lookup.py' has generated the lookup files. Until then the changed
+# files are reported as changed by each run of 'retrieve_files.py'.
+CacheMetadataFilename = 'cache.json'
+CachePendingFilename = 'cache.pending.json'
+CachePreparedFilename = 'cache.prepared.json'
+
+# Opens a file. The size of the file buffer may be given by 'buffering'.
+def Open (filename,mode,failure,buffering=-1):
     
     "Opens a file"
 
     try:
-        fo = open(filename,mode)
+        fo = open(filename,mode,buffering)
     except:
         return failure
     else:
         return fo
       
 
+# Opens log file 'filename' for writing by 'Logerror' on a background thread
+# ( see 'log_writer.py' ). Messages are also written as JSON lines to
+# 'jsonfilename' if it is given.
+def OpenLog (filename,failure,jsonfilename=None):
+
+    "Opens a log file"
+
+    try:
+        fo = LogWriter.LogWriter(filename,jsonfilename)
+    except OSError:
+        return failure
+    else:
+        return fo
+
 # Closes a file      
 def Close (Fileobject,failure):
     
@@ -73,12 +99,37 @@ def Writeline (Fileobject,line,failure):
     else:
         return line
         
+# Writes the lines generated by iterator 'lines' to a file in
+# batches of 'batchsize' lines. Lines may be strings or bytes.
+def WriteLines (Fileobject,lines,batchsize,failure):
+    
+    "Writes lines to a file in batches"
+
+    try:
+        while True :
+            batch = list(itertools.islice(lines,batchsize))
+            if ( len(batch) == 0 ) : break
+            Fileobject.write(batch[0][:0].join(batch))
+    except OSError:
+        return failure
+    else:
+        return True
+        
 # Write error log entry. The program will exit if the error level
-# is 'error'
-def Logerror (Fileobject,module,text,level):
+# is 'error'. If the log was opened using 'OpenLog' the entry is written
+# on a background thread and only the first entries with the same 'key'
+# are shown on the console.
+def Logerror (Fileobject,module,text,level,key=None):
 
     "Write an entry in the error log"
     
+    if ( isinstance(Fileobject,LogWriter.LogWriter) ) :
+        Fileobject.Log(module,text,level,key)
+        if ( level == 'ERROR' ) :
+            Close(Fileobject,None)
+            sys.exit()
+        return
+
     timestamp = time.asctime( time.localtime(time.time()) )
     message = timestamp + ' ' + level + ': ' +  module + ': ' + text
     
@@ -92,6 +143,19 @@ def Logerror (Fileobject,module,text,level):
         if ( level == 'ERROR' ) : sys.exit()
 
 
+# Renames download cache metadata file 'source' of cache directory 'cachedir' to
+# 'destination' if it exists. Returns True if it was renamed.
+def PromoteCache (cachedir,source,destination) :
+
+    "Renames a download cache metadata file"
+
+    try:
+        os.replace(os.path.join(cachedir,source),os.path.join(cachedir,destination))
+    except FileNotFoundError:
+        return False
+    else:
+        return True
+
 # Launches spreadsheet program with file argument
 def ViewSpeadsheet (spreadsheet,file) :
  
@@ -153,7 +217,8 @@ def ReturnData(line) :
     return data
 
 # This procedure will return a dictionary of field positions
-# created from the contents of 'string'. 
+# created from the contents of 'string'. Values which are not
+# positions, such as file names, are returned as strings.
 def ReturnPositions(string) :
 
     "This procedure will return a dictionary of field positions created from the contents of 'string'"
@@ -161,9 +226,9 @@ def ReturnPositions(string) :
     positions = {}
     
     for field in string.split(',') :
-        combined = field.split(':')
-        key = combined[0]
-        value = int(combined[1])
-        positions[key] = value
+        combined = field.split(':',1)
+        key = combined[0].strip()
+        value = combined[1].strip()
+        positions[key] = int(value) if ( value.isdigit() ) else value
 
     return positions